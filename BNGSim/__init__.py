@@ -1,7 +1,25 @@
+import importlib
 from .model import BNGModel
 from .structs import Parameters, Species, MoleculeTypes, Observables, Functions,Compartments, Rules
 from .pattern import Pattern, Molecule, Bonds
 from .xmlparsers import ObsXML, MolTypeXML, RuleXML, FuncXML, SpeciesXML
-from .result import BNGResult
-from .worker import BNGWorker
-from .simulator import BNGSimulator
+
+# The simulation/analysis side pulls in numpy, h5py and multiprocessing,
+# these are only imported the first time they are asked for
+_lazy_imports = {"BNGResult": ".result",
+                 "BNGWorker": ".worker",
+                 "BNGSimulator": ".simulator",
+                 "ObservableMatrix": ".matching",
+                 "ExpressionGraph": ".expressions",
+                 "NetworkODE": ".ode"}
+
+def __getattr__(name):
+    if name in _lazy_imports:
+        module = importlib.import_module(_lazy_imports[name], __name__)
+        obj = getattr(module, name)
+        globals()[name] = obj
+        return obj
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_lazy_imports.keys()))
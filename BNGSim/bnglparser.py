@@ -0,0 +1,426 @@
+import re
+from BNGSim.utils import split_bngl_blocks, bngl_block_names
+
+###### NATIVE BNGL FRONT-END ######
+# Parses BNGL text without BNG2.pl. Every block is turned
+# into the same xmltodict style dicts BNG2.pl --xml gives
+# us, so the model structures are built by the exact same
+# code for both routes.
+class BNGLParseError(Exception):
+    pass
+
+# model attribute -> (XML list name, XML item tag)
+bngl_block_xml = {"parameters": ("ListOfParameters", "Parameter"),
+                  "compartments": ("ListOfCompartments", "compartment"),
+                  "moltypes": ("ListOfMoleculeTypes", "MoleculeType"),
+                  "species": ("ListOfSpecies", "Species"),
+                  "observables": ("ListOfObservables", "Observable"),
+                  "functions": ("ListOfFunctions", "Function"),
+                  "rules": ("ListOfReactionRules", "ReactionRule")}
+
+# blocks we can safely skip, anything else means the model
+# uses features we don't handle
+ignored_block_names = ["model", "actions"]
+
+_mol_re = re.compile(r"^(\w+)(?:%(\w+))?(?:\((.*)\))?(?:%(\w+))?(?:@(\w+))?$")
+_comp_re = re.compile(r"^(\w+)((?:[~%!](?:\w+|\+|\?))*)$")
+_comp_tag_re = re.compile(r"([~%!])(\w+|\+|\?)")
+_prefix_re = re.compile(r"^(?:@(\w+)::?|%(\w+)::?)")
+_param_re = re.compile(r"^(?:\d+\s+)?([A-Za-z_]\w*)\s*(?:=\s*|\s+)(.+)$")
+_func_re = re.compile(r"^([A-Za-z_]\w*)\s*(?:\(([^)]*)\))?\s*=?\s*(.+)$")
+_rule_name_re = re.compile(r"^([A-Za-z_]\w*)\s*:(?!:)\s*(.*)$")
+_rate_func_re = re.compile(r"^(MM|Sat)\((.*)\)$")
+_func_call_re = re.compile(r"^([A-Za-z_]\w*)\(\s*\)$")
+
+def one_or_list(items):
+    '''
+    xmltodict gives a single dict for one child
+    and a list for more
+    '''
+    if len(items) == 1:
+        return items[0]
+    return items
+
+def split_top_level(text, sep):
+    '''
+    splits text at sep, ignoring anything in parentheses
+    '''
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if depth == 0 and (char == sep or (sep == " " and char.isspace())):
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return [p.strip() for p in parts if len(p.strip()) > 0]
+
+def block_lines(block_text):
+    '''
+    lines of a block without begin/end, comments and with
+    line continuations joined
+    '''
+    lines = []
+    cont = ""
+    # block text is "\nbegin X\n...\nend X\n"
+    for line in block_text.splitlines()[2:-1]:
+        line = line.split("#")[0].strip()
+        if line.endswith("\\"):
+            cont += line[:-1] + " "
+            continue
+        line = (cont + line).strip()
+        cont = ""
+        if len(line) > 0:
+            lines.append(line)
+    return lines
+
+def parse_pattern_string(pat_str):
+    '''
+    XML style dict of a single pattern string, 
+    None if it can't be parsed
+    '''
+    try:
+        return BNGLParser("").parse_pattern(pat_str, "P1")
+    except (BNGLParseError, ValueError, TypeError):
+        return None
+
+class BNGLParser:
+    '''
+    Takes BNGL text and gives back each block in the
+    layout BNGModel._parse_xml_list expects
+    '''
+    def __init__(self, bngl_text):
+        self.bngl_text = bngl_text
+        self.blocks = split_bngl_blocks(bngl_text)
+        self.block_xml_names = bngl_block_xml
+        self._function_names = None
+        self._check_blocks()
+
+    def _check_blocks(self):
+        for line in self.bngl_text.splitlines():
+            line = re.sub(r"\s+", " ", line.split("#")[0].strip())
+            if line.startswith("begin "):
+                name = line[len("begin "):]
+                if name not in bngl_block_names and name not in ignored_block_names:
+                    raise BNGLParseError("Block {} is not supported".format(name))
+
+    def iter_blocks(self):
+        '''
+        yields (XML list name, list dict) for each block in
+        the text, same as the XML front-end
+        '''
+        for block in bngl_block_xml:
+            if block in self.blocks:
+                yield self.block_xml(block)
+
+    def block_xml(self, block, block_text=None):
+        listkey, item_tag = bngl_block_xml[block]
+        if block_text is None:
+            block_text = self.blocks[block]
+        line_parser = getattr(self, "parse_{}".format(block))
+        items = []
+        for iline, line in enumerate(block_lines(block_text)):
+            try:
+                items.extend(line_parser(line, iline+1))
+            except BNGLParseError:
+                raise
+            except Exception as e:
+                raise BNGLParseError("Can't parse line '{}': {}".format(line, e))
+        # blocks whose items depend on each other
+        finisher = getattr(self, "finish_{}".format(block), None)
+        if finisher is not None:
+            items = finisher(items)
+        if len(items) == 0:
+            return listkey, None
+        return listkey, {item_tag: one_or_list(items)}
+
+    @property
+    def function_names(self):
+        if self._function_names is None:
+            self._function_names = []
+            if "functions" in self.blocks:
+                for line in block_lines(self.blocks["functions"]):
+                    m = _func_re.match(line)
+                    if m is not None:
+                        self._function_names.append(m.group(1))
+        return self._function_names
+
+    ### BLOCKS ###
+    def parse_parameters(self, line, iline):
+        m = _param_re.match(line)
+        if m is None:
+            raise BNGLParseError("Can't parse parameter '{}'".format(line))
+        name, value = m.group(1), m.group(2).strip()
+        param = {"@id": name, "@type": "Constant", "@value": value}
+        try:
+            float(value)
+        except ValueError:
+            param["@expr"] = value
+        return [param]
+
+    def finish_parameters(self, params):
+        # like the XML, derived parameters carry their evaluated 
+        # value next to the expression
+        from BNGSim.expressions import ExpressionGraph, ExpressionError
+        graph = ExpressionGraph()
+        for param in params:
+            graph.set_expression(param["@id"], param["@value"])
+        try:
+            values = graph.evaluate()
+        except ExpressionError as e:
+            raise BNGLParseError("Can't evaluate parameters: {}".format(e))
+        for param in params:
+            if "@expr" in param:
+                param["@type"] = "ConstantExpression"
+                param["@value"] = repr(float(values[param["@id"]]))
+        return params
+
+    def parse_compartments(self, line, iline):
+        tokens = line.split()
+        if len(tokens) < 3 or len(tokens) > 4:
+            raise BNGLParseError("Can't parse compartment '{}'".format(line))
+        comp = {"@id": tokens[0], "@spatialDimensions": tokens[1], "@size": tokens[2]}
+        if len(tokens) == 4:
+            comp["@outside"] = tokens[3]
+        return [comp]
+
+    def parse_moltypes(self, line, iline):
+        mol = self.parse_molecule(line)
+        mtype = {"@id": mol["name"]}
+        comp_types = []
+        for comp in mol["components"]:
+            comp_type = {"@id": comp["name"]}
+            if len(comp["states"]) > 0:
+                states = [{"@id": state} for state in comp["states"]]
+                comp_type["ListOfAllowedStates"] = {"AllowedState": one_or_list(states)}
+            comp_types.append(comp_type)
+        if len(comp_types) > 0:
+            mtype["ListOfComponentTypes"] = {"ComponentType": one_or_list(comp_types)}
+        return [mtype]
+
+    def parse_species(self, line, iline):
+        tokens = split_top_level(line, " ")
+        # optional leading index
+        if len(tokens) > 2 and tokens[0].isdigit():
+            tokens = tokens[1:]
+        if len(tokens) < 2:
+            raise BNGLParseError("Can't parse species '{}'".format(line))
+        pat_str = tokens[0]
+        if pat_str.startswith("$"):
+            pat_str = pat_str[1:]
+        spec = self.parse_pattern(pat_str, "S{}".format(iline))
+        spec["@concentration"] = "".join(tokens[1:])
+        spec["@name"] = pat_str
+        return [spec]
+
+    def parse_observables(self, line, iline):
+        tokens = split_top_level(line, " ")
+        if len(tokens) < 3:
+            raise BNGLParseError("Can't parse observable '{}'".format(line))
+        otype, name = tokens[0], tokens[1]
+        oid = "O{}".format(iline)
+        pat_strs = []
+        for token in tokens[2:]:
+            pat_strs.extend(split_top_level(token, ","))
+        patterns = [self.parse_pattern(p, "{}_P{}".format(oid, ip+1)) for ip, p in enumerate(pat_strs)]
+        obs = {"@id": oid, "@name": name, "@type": otype,
+               "ListOfPatterns": {"Pattern": one_or_list(patterns)}}
+        return [obs]
+
+    def parse_functions(self, line, iline):
+        m = _func_re.match(line)
+        if m is None:
+            raise BNGLParseError("Can't parse function '{}'".format(line))
+        name, args, expr = m.group(1), m.group(2), m.group(3).strip()
+        func = {"@id": name}
+        if args is not None and len(args.strip()) > 0:
+            arg_list = [{"@id": a.strip()} for a in args.split(",")]
+            func["ListOfArguments"] = {"Argument": one_or_list(arg_list)}
+        func["Expression"] = expr
+        return [func]
+
+    def parse_rules(self, line, iline):
+        # optional leading index and name
+        line = re.sub(r"^\d+\s+", "", line)
+        m = _rule_name_re.match(line)
+        if m is not None:
+            name, line = m.group(1), m.group(2)
+        else:
+            name = "_R{}".format(iline)
+        if "<->" in line:
+            bidirectional = True
+            lhs, rhs = line.split("<->", 1)
+        elif "->" in line:
+            bidirectional = False
+            lhs, rhs = line.split("->", 1)
+        else:
+            raise BNGLParseError("Can't find the arrow in rule '{}'".format(line))
+        reactants = split_top_level(lhs, "+")
+        products, rates = self._split_rhs(rhs)
+        if bidirectional and len(rates) != 2:
+            raise BNGLParseError("Bidirectional rule needs two rate laws '{}'".format(line))
+        if not bidirectional and len(rates) != 1:
+            raise BNGLParseError("Unidirectional rule needs one rate law '{}'".format(line))
+        rid = "RR{}".format(iline)
+        rules = [self._rule_xml(rid, name, reactants, products, rates[0])]
+        if bidirectional:
+            rules.append(self._rule_xml(rid + "r", "_reverse_" + name, products, reactants, rates[1]))
+        return rules
+
+    ### RULE HELPERS ###
+    def _split_rhs(self, rhs):
+        tokens = split_top_level(rhs, " ")
+        if len(tokens) < 2:
+            raise BNGLParseError("Rule is missing products or rates '{}'".format(rhs))
+        # products are joined by + with or without spaces
+        prod_str, i = tokens[0], 1
+        while i < len(tokens) and (prod_str.endswith("+") or tokens[i].startswith("+")):
+            prod_str += tokens[i]
+            i += 1
+        # rate expressions might have spaces around operators
+        if i >= len(tokens):
+            raise BNGLParseError("Rule is missing rates '{}'".format(rhs))
+        rate_str, i = tokens[i], i+1
+        while i < len(tokens) and (rate_str[-1] in "+-*/^,(" or tokens[i][0] in "+-*/^,)"):
+            rate_str += tokens[i]
+            i += 1
+        # anything left over is a rule modifier (DeleteMolecules etc.)
+        # which the XML front-end doesn't keep either
+        return split_top_level(prod_str, "+"), split_top_level(rate_str, ",")
+
+    def _rule_xml(self, rid, name, reactants, products, rate):
+        rule = {"@id": rid, "@name": name}
+        rule["ListOfReactantPatterns"] = self._side_xml(rid, reactants, "ReactantPattern", "RP")
+        rule["ListOfProductPatterns"] = self._side_xml(rid, products, "ProductPattern", "PP")
+        rule["RateLaw"] = self._ratelaw_xml(rid, rate)
+        return rule
+
+    def _side_xml(self, rid, patterns, tag, prefix):
+        patterns = [p for p in patterns if p != "0"]
+        if len(patterns) == 0:
+            return None
+        pats = [self.parse_pattern(p, "{}_{}{}".format(rid, prefix, ip+1)) for ip, p in enumerate(patterns)]
+        return {tag: one_or_list(pats)}
+
+    def _ratelaw_xml(self, rid, rate):
+        rate_law = {"@id": rid + "_RateLaw"}
+        m = _rate_func_re.match(rate)
+        if m is not None:
+            rate_law["@type"] = m.group(1)
+            args = [{"@value": arg} for arg in split_top_level(m.group(2), ",")]
+            rate_law["ListOfRateConstants"] = {"RateConstant": one_or_list(args)}
+            return rate_law
+        m = _func_call_re.match(rate)
+        if m is not None or rate in self.function_names:
+            rate_law["@type"] = "Function"
+            rate_law["@name"] = m.group(1) if m is not None else rate
+            return rate_law
+        rate_law["@type"] = "Ele"
+        rate_law["ListOfRateConstants"] = {"RateConstant": {"@value": rate}}
+        return rate_law
+
+    ### PATTERNS ###
+    def parse_molecule(self, mol_str):
+        '''
+        returns a plain dict of the molecule: name, label,
+        compartment and components (name, states, label, bonds)
+        '''
+        m = _mol_re.match(mol_str.strip())
+        if m is None:
+            raise BNGLParseError("Can't parse molecule '{}'".format(mol_str))
+        name, label1, comps_str, label2, compartment = m.groups()
+        mol = {"name": name, "label": label1 if label1 is not None else label2,
+               "compartment": compartment, "components": []}
+        if comps_str is not None:
+            for comp_str in split_top_level(comps_str, ","):
+                cm = _comp_re.match(comp_str)
+                if cm is None:
+                    raise BNGLParseError("Can't parse component '{}'".format(comp_str))
+                comp = {"name": cm.group(1), "states": [], "label": None, "bonds": []}
+                for tag, value in _comp_tag_re.findall(cm.group(2)):
+                    if tag == "~":
+                        comp["states"].append(value)
+                    elif tag == "%":
+                        comp["label"] = value
+                    else:
+                        comp["bonds"].append(value)
+                mol["components"].append(comp)
+        return mol
+
+    def parse_pattern(self, pat_str, pid):
+        '''
+        BNGL pattern string -> XML style Pattern dict
+        '''
+        pattern = {"@id": pid}
+        pat_str = pat_str.strip()
+        # prefixes like @EC: and %x:
+        m = _prefix_re.match(pat_str)
+        while m is not None:
+            if m.group(1) is not None:
+                pattern["@compartment"] = m.group(1)
+            else:
+                pattern["@label"] = m.group(2)
+            pat_str = pat_str[m.end():]
+            m = _prefix_re.match(pat_str)
+        mol_strs = split_top_level(pat_str, ".")
+        if len(mol_strs) == 0:
+            raise BNGLParseError("Empty pattern")
+        # bond label -> list of component ids
+        bond_sites = {}
+        bond_order = []
+        molecules = []
+        for imol, mol_str in enumerate(mol_strs):
+            mol = self.parse_molecule(mol_str)
+            mid = "{}_M{}".format(pid, imol+1)
+            mol_xml = {"@id": mid, "@name": mol["name"]}
+            if mol["label"] is not None:
+                mol_xml["@label"] = mol["label"]
+            if mol["compartment"] is not None:
+                mol_xml["@compartment"] = mol["compartment"]
+            comps = []
+            for icomp, comp in enumerate(mol["components"]):
+                cid = "{}_C{}".format(mid, icomp+1)
+                comp_xml = {"@id": cid, "@name": comp["name"]}
+                if len(comp["states"]) > 1:
+                    raise BNGLParseError("Component {} has more than one state".format(comp["name"]))
+                if len(comp["states"]) == 1:
+                    comp_xml["@state"] = comp["states"][0]
+                if comp["label"] is not None:
+                    comp_xml["@label"] = comp["label"]
+                nbonds = 0
+                wildcard = None
+                for bond in comp["bonds"]:
+                    if bond in ("+", "?"):
+                        # wildcards don't make a bond
+                        wildcard = bond
+                        continue
+                    if bond not in bond_sites:
+                        bond_sites[bond] = []
+                        bond_order.append(bond)
+                    bond_sites[bond].append(cid)
+                    nbonds += 1
+                if wildcard is not None and nbonds == 0:
+                    # a numbered bond already says the site is
+                    # bound, the XML only holds one or the other
+                    nbonds = wildcard
+                comp_xml["@numberOfBonds"] = str(nbonds)
+                comps.append(comp_xml)
+            if len(comps) > 0:
+                mol_xml["ListOfComponents"] = {"Component": one_or_list(comps)}
+            molecules.append(mol_xml)
+        pattern["ListOfMolecules"] = {"Molecule": one_or_list(molecules)}
+        if len(bond_order) > 0:
+            bonds = []
+            for ibond, bond in enumerate(bond_order):
+                sites = bond_sites[bond]
+                if len(sites) != 2:
+                    raise BNGLParseError("Bond {} in {} doesn't connect two sites".format(bond, pat_str))
+                bonds.append({"@id": "{}_B{}".format(pid, ibond+1),
+                              "@site1": sites[0], "@site2": sites[1]})
+            pattern["ListOfBonds"] = {"Bond": one_or_list(bonds)}
+        return pattern
+###### NATIVE BNGL FRONT-END ######
@@ -0,0 +1,280 @@
+import os, io, hashlib, shutil, tempfile
+from BNGSim.utils import get_bngexec_version
+try:
+    import fcntl
+except ImportError:
+    # no flock on windows, eviction can race with readers there
+    fcntl = None
+
+def default_cache_dir():
+    '''
+    Cache lives under $BNGSIM_CACHE if set, otherwise
+    under the user cache folder
+    '''
+    if "BNGSIM_CACHE" in os.environ:
+        return os.environ["BNGSIM_CACHE"]
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "BNGSim")
+
+def _bngexec_parts(bngexec):
+    # The BNG2.pl modification time is there in case 
+    # the version can't be determined
+    try:
+        bng_stamp = str(os.path.getmtime(bngexec))
+    except (OSError, TypeError):
+        bng_stamp = ""
+    version = str(get_bngexec_version(bngexec))
+    return [os.path.abspath(str(bngexec)), version, bng_stamp]
+
+def _hash_parts(parts):
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(part)
+        # separator so ("ab","c") != ("a","bc")
+        h.update(b"\0")
+    return h.hexdigest()
+
+class _FolderLock:
+    '''
+    flock on a lock file in the cache folder, readers copying
+    entries out hold it shared and eviction holds it exclusive
+    '''
+    def __init__(self, folder, shared=False):
+        self.folder = folder
+        self.shared = shared
+        self.lock_file = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return self
+        os.makedirs(self.folder, exist_ok=True)
+        self.lock_file = open(os.path.join(self.folder, ".lock"), "a")
+        fcntl.flock(self.lock_file, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+
+class FileCache:
+    '''
+    A content-addressed on-disk cache of files generated
+    by BNG2.pl. Entries are stored under the hex digest of
+    whatever text produced them and the least recently used
+    entries are evicted once the cache grows past max_size
+    bytes. The modification time of an entry is used as the
+    last access time.
+    '''
+    def __init__(self, folder, max_size=256*1024*1024, suffix=""):
+        self.folder = folder
+        self.max_size = max_size
+        self.suffix = suffix
+
+    def key(self, *parts):
+        '''
+        hashes all the given parts into a single key
+        '''
+        return _hash_parts(parts)
+
+    def file_key(self, file_path, *parts):
+        '''
+        same as key but hashes the contents of a file
+        as the last part, reading it in chunks
+        '''
+        h = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode("utf-8")
+            h.update(part)
+            h.update(b"\0")
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024*1024), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def text_key(self, text, *parts):
+        '''
+        same as file_key for a file containing text
+        '''
+        h = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode("utf-8")
+            h.update(part)
+            h.update(b"\0")
+        h.update(text.encode("utf-8"))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key + self.suffix)
+
+    def get(self, key):
+        '''
+        returns the path to the cached file or None
+        '''
+        fpath = self.path(key)
+        try:
+            # mark as recently used
+            os.utime(fpath, None)
+        except OSError:
+            return None
+        return fpath
+
+    def copy_to(self, key, dest):
+        '''
+        copies the cached file to dest, returns dest or None
+        if there is no such entry. Safe against the entry 
+        being evicted by another process at the same time
+        '''
+        with _FolderLock(self.folder, shared=True):
+            fpath = self.get(key)
+            if fpath is None:
+                return None
+            try:
+                shutil.copyfile(fpath, dest)
+            except OSError:
+                return None
+        return dest
+
+    def put(self, key, file_path):
+        '''
+        copies the given file into the cache and returns
+        the path of the cached copy
+        '''
+        os.makedirs(self.folder, exist_ok=True)
+        fpath = self.path(key)
+        # copy next to the final location and rename, this
+        # way nobody ever sees a half written entry
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(file_path, temp_path)
+            os.replace(temp_path, fpath)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.evict()
+        return fpath
+
+    def size(self):
+        return sum([os.path.getsize(p) for p, _ in self._entries()])
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.folder):
+            return entries
+        for fname in os.listdir(self.folder):
+            if not fname.endswith(self.suffix) or fname.endswith(".tmp") or fname == ".lock":
+                continue
+            fpath = os.path.join(self.folder, fname)
+            try:
+                entries.append((fpath, os.path.getmtime(fpath)))
+            except OSError:
+                # removed under us
+                pass
+        return entries
+
+    def evict(self):
+        '''
+        removes least recently used entries until the
+        cache fits in max_size
+        '''
+        if self.max_size is None:
+            return
+        with _FolderLock(self.folder):
+            self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda x: x[1])
+        sizes = {}
+        for fpath, _ in entries:
+            try:
+                sizes[fpath] = os.path.getsize(fpath)
+            except OSError:
+                sizes[fpath] = 0
+        total = sum(sizes.values())
+        for fpath, _ in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(fpath)
+            except OSError:
+                pass
+            total -= sizes[fpath]
+
+    def clear(self):
+        for fpath, _ in self._entries():
+            try:
+                os.remove(fpath)
+            except OSError:
+                pass
+
+class XMLCache(FileCache):
+    '''
+    Cache of BNG2.pl --xml outputs keyed by the model file 
+    contents and the BNG2.pl that produced them
+    '''
+    def __init__(self, folder=None, max_size=256*1024*1024):
+        if folder is None:
+            folder = os.path.join(default_cache_dir(), "xml")
+        super().__init__(folder, max_size=max_size, suffix=".xml")
+
+    def model_key(self, model_name, model_file, bngexec):
+        # the XML embeds the model name so it's part
+        # of the key
+        return self.file_key(model_file, model_name, *_bngexec_parts(bngexec))
+
+    def model_text_key(self, model_name, model_text, bngexec):
+        # model_key of a file holding model_text
+        return self.text_key(model_text, model_name, *_bngexec_parts(bngexec))
+
+def network_key(model, bngexec):
+    '''
+    Key of the network a model generates, the structure of
+    the model (see BNGModel.write_structure), the 
+    generate_network options and BNG2.pl
+    '''
+    model_str = io.StringIO()
+    model.write_structure(model_str)
+    options = model.actions.generate_options() if hasattr(model, "actions") else None
+    return _hash_parts([model_str.getvalue(), repr(options)] + _bngexec_parts(bngexec))
+
+class NetCache(FileCache):
+    '''
+    Cache of generated reaction networks (.net files) keyed
+    by network_key
+    '''
+    def __init__(self, folder=None, max_size=1024*1024*1024):
+        if folder is None:
+            folder = os.path.join(default_cache_dir(), "net")
+        super().__init__(folder, max_size=max_size, suffix=".net")
+
+    def model_key(self, model, bngexec):
+        return network_key(model, bngexec)
+
+_default_xml_cache = None
+
+def get_xml_cache():
+    '''
+    returns the process-wide default XML cache
+    '''
+    global _default_xml_cache
+    if _default_xml_cache is None:
+        _default_xml_cache = XMLCache()
+    return _default_xml_cache
+
+_default_net_cache = None
+
+def get_net_cache():
+    '''
+    returns the process-wide default network cache
+    '''
+    global _default_net_cache
+    if _default_net_cache is None:
+        _default_net_cache = NetCache()
+    return _default_net_cache
@@ -0,0 +1,243 @@
+###### CANONICAL PATTERNS ######
+# Canonical form of a pattern: the same complex always
+# renders to the same string no matter the molecule order,
+# component order or bond numbering it was written with.
+# Molecules and components are vertices colored by their
+# contents and refined by their neighbors (WL refinement), any
+# remaining ties are broken by trying each tied vertex first
+# (individualization) and keeping the smallest rendering,
+# skipping the vertices an automorphism found along the way
+# shows to be equivalent.
+def _is_wildcard(bond):
+    return str(bond) in ("+", "?")
+
+def _graph(pattern):
+    '''
+    Flattens the pattern into per molecule invariants, per
+    component invariants and the bond partners, taken from
+    the pattern's bond graph. Molecules and components are
+    both vertices of the graph that gets refined, molecules
+    are 0..nmol-1 and component c is vertex nmol+c
+    '''
+    bond_graph = pattern.bond_graph
+    mol_invs = []
+    comp_invs = []
+    comp_mol = bond_graph.comp_mol
+    # molecule index -> list of global component indices
+    mol_comps = []
+    ic = 0
+    for imol, mol in enumerate(pattern.molecules):
+        comps = []
+        for comp in mol.components:
+            wild = tuple(sorted([str(b) for b in comp.bonds if _is_wildcard(b)]))
+            nbonds = len(comp.bonds) - len(wild)
+            comp_invs.append((comp.name, "" if comp.state is None else comp.state,
+                              "" if comp.label is None else comp.label, wild, nbonds,
+                              tuple(comp.states)))
+            comps.append(ic)
+            ic += 1
+        mol_comps.append(comps)
+        mol_invs.append((mol.name, "" if mol.label is None else mol.label,
+                         "" if mol.compartment is None else mol.compartment,
+                         tuple(sorted([comp_invs[ic] for ic in comps]))))
+    # component partners through bonds
+    partners = [bond_graph.partners(ic) for ic in range(len(comp_invs))]
+    nmol = len(mol_invs)
+    # vertex adjacency, a molecule to its components and a
+    # component to its molecule and bond partners
+    adjacency = [[nmol+ic for ic in comps] for comps in mol_comps]
+    for ic in range(len(comp_invs)):
+        adjacency.append([comp_mol[ic]] + [nmol+pc for pc in partners[ic]])
+    signatures = [("M",) + inv for inv in mol_invs] + [("C",) + inv for inv in comp_invs]
+    return signatures, adjacency, nmol, comp_invs, mol_comps, partners
+
+def _rank(signatures):
+    order = sorted(set(signatures))
+    ranks = {}
+    for i, sig in enumerate(order):
+        ranks[sig] = i
+    return [ranks[sig] for sig in signatures]
+
+def _refine(colors, graph):
+    adjacency = graph[1]
+    ncolors = len(set(colors))
+    while True:
+        sigs = []
+        for v, neighbors in enumerate(adjacency):
+            sigs.append((colors[v], tuple(sorted([colors[u] for u in neighbors]))))
+        colors = _rank(sigs)
+        new_ncolors = len(set(colors))
+        if new_ncolors == ncolors:
+            return colors
+        ncolors = new_ncolors
+
+def _render(colors, pattern, graph):
+    # molecules in the order of their colors, the components
+    # of each molecule in the order of theirs
+    _, _, nmol, comp_invs, mol_comps, partners = graph
+    order = sorted(range(nmol), key=lambda m: colors[m])
+    bond_numbers = {}
+    parts = []
+    if pattern.compartment is not None:
+        parts.append("@{}:".format(pattern.compartment))
+    if pattern.label is not None:
+        parts.append("%{}:".format(pattern.label))
+    for i, imol in enumerate(order):
+        mol = pattern.molecules[imol]
+        comps = sorted(mol_comps[imol], key=lambda ic: colors[nmol+ic])
+        comp_strs = []
+        for ic in comps:
+            name, state, label, wild, _, states = comp_invs[ic]
+            cstr = [name]
+            for st in states:
+                cstr.append("~{}".format(st))
+            if state != "":
+                cstr.append("~{}".format(state))
+            if label != "":
+                cstr.append("%{}".format(label))
+            bonds = []
+            for pc in partners[ic]:
+                bond_key = (min(ic, pc), max(ic, pc))
+                if bond_key not in bond_numbers:
+                    bond_numbers[bond_key] = len(bond_numbers) + 1
+                bonds.append(bond_numbers[bond_key])
+            for bond in sorted(bonds):
+                cstr.append("!{}".format(bond))
+            for w in wild:
+                cstr.append("!{}".format(w))
+            comp_strs.append("".join(cstr))
+        mstr = mol.name
+        if mol.label is not None:
+            mstr += "%{}".format(mol.label)
+        if len(comp_strs) > 0:
+            mstr += "(" + ",".join(comp_strs) + ")"
+        if mol.compartment is not None:
+            mstr += "@{}".format(mol.compartment)
+        if i > 0:
+            parts.append(".")
+        parts.append(mstr)
+    return "".join(parts)
+
+def _orbit_roots(n, autos, fixed):
+    # union-find over the automorphisms found so far that fix
+    # every vertex in fixed, gives each vertex its orbit root
+    parent = list(range(n))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for auto in autos:
+        if any(auto[v] != v for v in fixed):
+            continue
+        for i in range(n):
+            ri, rj = find(i), find(auto[i])
+            if ri != rj:
+                parent[ri] = rj
+    return [find(i) for i in range(n)]
+
+def _search(colors, pattern, graph):
+    '''
+    smallest rendering over all the ways to break ties. Two
+    leaves with the same rendering give an automorphism of the
+    pattern, children of a node that an automorphism fixing the
+    node's path maps onto each other have identical subtrees so
+    only one of them is searched
+    '''
+    # leaves are (rendering, vertex order, path), autos are
+    # vertex permutations as lists
+    state = {"first": None, "best": None, "autos": []}
+    _descend(colors, [], pattern, graph, state)
+    return state["best"][0]
+
+def _leaf(colors, path, pattern, graph, state):
+    # vertices in the order they are rendered, two leaves with
+    # the same rendering map onto each other position by position
+    nmol, mol_comps = graph[2], graph[4]
+    order = sorted(range(nmol), key=lambda m: colors[m])
+    for imol in order[:nmol]:
+        order += sorted([nmol+ic for ic in mol_comps[imol]], key=lambda v: colors[v])
+    rendering = _render(colors, pattern, graph)
+    leaf = (rendering, order, path)
+    for ref in (state["first"], state["best"]):
+        if ref is None or ref[0] != rendering or ref[1] == order:
+            continue
+        # same rendering, ref order -> this order is an automorphism
+        auto = [0]*len(order)
+        for ref_v, v in zip(ref[1], order):
+            auto[ref_v] = v
+        state["autos"].append(auto)
+        # the subtree this leaf is in, below the node where the
+        # paths split, is the image of the one ref is in
+        depth = 0
+        while depth < min(len(path), len(ref[2])) and path[depth] == ref[2][depth]:
+            depth += 1
+        if depth < len(path) and depth < len(ref[2]) and auto[ref[2][depth]] == path[depth] \
+           and all(auto[v] == v for v in path[:depth]):
+            return depth
+        return None
+    if state["first"] is None:
+        state["first"] = leaf
+    if state["best"] is None or rendering < state["best"][0]:
+        state["best"] = leaf
+    return None
+
+def _descend(colors, path, pattern, graph, state):
+    '''
+    returns the depth of the node the search should continue
+    at, None to carry on normally
+    '''
+    colors = _refine(colors, graph)
+    if len(set(colors)) == len(colors):
+        return _leaf(colors, path, pattern, graph, state)
+    # first tied color class
+    counts = {}
+    for c in colors:
+        counts[c] = counts.get(c, 0) + 1
+    tied = min([c for c in counts if counts[c] > 1])
+    explored = []
+    for v in range(len(colors)):
+        if colors[v] != tied:
+            continue
+        if len(explored) > 0:
+            roots = _orbit_roots(len(colors), state["autos"], path)
+            if roots[v] in set([roots[u] for u in explored]):
+                continue
+        explored.append(v)
+        # individualize: put v just ahead of its class
+        new_colors = [2*c for c in colors]
+        new_colors[v] -= 1
+        jump = _descend(_rank(new_colors), path + [v], pattern, graph, state)
+        if jump is not None and jump < len(path):
+            return jump
+    return None
+
+def pattern_invariant(pattern):
+    '''
+    Cheap isomorphism invariant of a pattern, the sorted
+    contents of its molecules without the bonds between them.
+    The same complex always gives the same invariant, different
+    complexes usually don't so it's used as the hash
+    '''
+    mols = []
+    for mol in pattern.molecules:
+        comps = []
+        for comp in mol.components:
+            comps.append((comp.name, comp.state or "", comp.label or "",
+                          tuple(sorted([str(b) if _is_wildcard(b) else "" for b in comp.bonds])),
+                          tuple(comp.states)))
+        comps.sort()
+        mols.append((mol.name, mol.label or "", mol.compartment or "", tuple(comps)))
+    mols.sort()
+    return (pattern.compartment or "", pattern.label or "", tuple(mols))
+
+def canonical_string(pattern):
+    '''
+    Canonical string of a pattern, two patterns describing
+    the same complex give the same string
+    '''
+    if len(pattern.molecules) == 0:
+        return ""
+    graph = _graph(pattern)
+    return _search(_rank(graph[0]), pattern, graph)
+###### CANONICAL PATTERNS ######
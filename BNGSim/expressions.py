@@ -0,0 +1,346 @@
+import re, functools
+from collections import OrderedDict
+
+import numpy as np
+
+###### EXPRESSIONS ######
+# BNGL math (parameter expressions, function bodies) is parsed
+# once into Python source that works on floats and on numpy
+# arrays alike, and compiled. ExpressionGraph keeps the compiled
+# expressions in a dependency DAG, evaluates them in topological
+# order and only re-evaluates what depends on a changed value.
+class ExpressionError(Exception):
+    pass
+
+_token_re = re.compile(r"\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)|(\w+)|(\*\*|&&|\|\||==|!=|~=|<=|>=|[-+*/^(),<>!]))")
+
+def _min(*args):
+    return functools.reduce(np.minimum, args)
+
+def _max(*args):
+    return functools.reduce(np.maximum, args)
+
+def _sum(*args):
+    return functools.reduce(np.add, args)
+
+def _avg(*args):
+    return _sum(*args)/len(args)
+
+# BNGL (muParser) built-ins -> names in the evaluation namespace
+_functions = {"exp": "_np.exp", "ln": "_np.log", "log10": "_np.log10",
+              "log2": "_np.log2", "sqrt": "_np.sqrt", "abs": "_np.abs",
+              "sin": "_np.sin", "cos": "_np.cos", "tan": "_np.tan",
+              "asin": "_np.arcsin", "acos": "_np.arccos", "atan": "_np.arctan",
+              "sinh": "_np.sinh", "cosh": "_np.cosh", "tanh": "_np.tanh",
+              "asinh": "_np.arcsinh", "acosh": "_np.arccosh", "atanh": "_np.arctanh",
+              "rint": "_np.rint", "sign": "_np.sign", "if": "_np.where",
+              "min": "_min", "max": "_max", "sum": "_sum", "avg": "_avg"}
+_constants = {"_pi": "_np.pi", "_e": "_np.e"}
+_namespace = {"_np": np, "_min": _min, "_max": _max, "_sum": _sum, "_avg": _avg}
+
+# binary operators by precedence, low to high
+_binary = [("||",), ("&&",), ("==", "!=", "~=", "<", ">", "<=", ">="), ("+", "-"), ("*", "/")]
+
+def tokenize(expr):
+    tokens = []
+    pos = 0
+    expr = expr.strip()
+    while pos < len(expr):
+        m = _token_re.match(expr, pos)
+        if m is None or m.end() == pos:
+            raise ExpressionError("Can't tokenize '{}' at '{}'".format(expr, expr[pos:]))
+        if m.group(1) is not None:
+            tokens.append(("num", m.group(1)))
+        elif m.group(2) is not None:
+            tokens.append(("name", m.group(2)))
+        else:
+            tokens.append(("op", m.group(3)))
+        pos = m.end()
+    return tokens
+
+class _Parser:
+    '''
+    Recursive descent parser turning BNGL math tokens into
+    fully parenthesized Python source
+    '''
+    def __init__(self, expr):
+        self.expr = expr
+        self.tokens = tokenize(expr)
+        self.pos = 0
+        self.names = []
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self, op=None):
+        tok = self.peek()
+        if op is not None and tok != ("op", op):
+            raise ExpressionError("Expected '{}' in '{}'".format(op, self.expr))
+        self.pos += 1
+        return tok
+
+    def parse(self):
+        src = self.binary(0)
+        if self.pos != len(self.tokens):
+            raise ExpressionError("Unexpected '{}' in '{}'".format(self.peek()[1], self.expr))
+        return src
+
+    def binary(self, level):
+        if level == len(_binary):
+            return self.unary()
+        left = self.binary(level+1)
+        while self.peek()[0] == "op" and self.peek()[1] in _binary[level]:
+            op = self.take()[1]
+            right = self.binary(level+1)
+            if op == "||":
+                left = "_np.logical_or({},{})".format(left, right)
+            elif op == "&&":
+                left = "_np.logical_and({},{})".format(left, right)
+            else:
+                if op == "~=":
+                    op = "!="
+                left = "({}{}{})".format(left, op, right)
+        return left
+
+    def unary(self):
+        tok = self.peek()
+        if tok == ("op", "-"):
+            self.take()
+            return "(-{})".format(self.unary())
+        if tok == ("op", "+"):
+            self.take()
+            return self.unary()
+        if tok == ("op", "!"):
+            self.take()
+            return "_np.logical_not({})".format(self.unary())
+        return self.power()
+
+    def power(self):
+        base = self.atom()
+        if self.peek() in (("op", "^"), ("op", "**")):
+            self.take()
+            # right associative, binds tighter than unary minus
+            # on the left but takes one on the right (2^-1)
+            return "({}**{})".format(base, self.unary())
+        return base
+
+    def atom(self):
+        kind, value = self.take()
+        if kind == "num":
+            return repr(float(value))
+        if kind == "op" and value == "(":
+            src = self.binary(0)
+            self.take(")")
+            return "({})".format(src)
+        if kind == "name":
+            if self.peek() == ("op", "("):
+                self.take()
+                args = []
+                if self.peek() != ("op", ")"):
+                    args.append(self.binary(0))
+                    while self.peek() == ("op", ","):
+                        self.take()
+                        args.append(self.binary(0))
+                self.take(")")
+                if value in _functions:
+                    return "{}({})".format(_functions[value], ",".join(args))
+                if len(args) > 0:
+                    raise ExpressionError("Functions with arguments are not supported: '{}'".format(self.expr))
+                # a model function (or time()) used as a value
+                self.names.append(value)
+                return "_v[{!r}]".format(value)
+            if value in _constants:
+                return _constants[value]
+            self.names.append(value)
+            return "_v[{!r}]".format(value)
+        raise ExpressionError("Unexpected '{}' in '{}'".format(value, self.expr))
+
+@functools.lru_cache(maxsize=None)
+def compile_expression(expr):
+    '''
+    Compiles a BNGL expression. Returns (func, names) where
+    func takes a dict of name -> value (floats or arrays) and
+    names are the names the expression depends on
+    '''
+    parser = _Parser(str(expr))
+    src = parser.parse()
+    code = compile("lambda _v: {}".format(src), "<{}>".format(expr), "eval")
+    func = eval(code, dict(_namespace))
+    names = tuple(OrderedDict.fromkeys(parser.names))
+    return func, names
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def _scalar(value):
+    # numpy hands back 0-d arrays for scalar inputs
+    if isinstance(value, np.ndarray) and value.ndim == 0:
+        return float(value)
+    if isinstance(value, (np.floating, np.bool_)):
+        return float(value)
+    return value
+
+class ExpressionGraph:
+    '''
+    Dependency DAG of named expressions. Numbers are leaves,
+    set_value changes a leaf and marks everything downstream
+    of it dirty, evaluate only recomputes dirty nodes
+    '''
+    def __init__(self):
+        # name -> (compiled function or None, dependency names)
+        self.nodes = OrderedDict()
+        self.expressions = OrderedDict()
+        self.values = {}
+        self._dependents = None
+        self._order = None
+        self._dirty = set()
+
+    def set_expression(self, name, expr):
+        self.expressions[name] = expr
+        if _is_number(expr):
+            self.nodes[name] = (None, ())
+            self.values[name] = float(expr)
+        else:
+            self.nodes[name] = compile_expression(str(expr))
+            self.values.pop(name, None)
+        self._dependents = None
+        self._order = None
+        self._dirty.add(name)
+        self._dirty.update(self.downstream(name))
+
+    def set_value(self, name, value):
+        '''
+        sets the value of a leaf, or overrides an expression
+        with a fixed value
+        '''
+        if name not in self.nodes or self.nodes[name][0] is not None:
+            self.expressions[name] = value
+            self.nodes[name] = (None, ())
+            self._dependents = None
+            self._order = None
+        self.values[name] = value
+        self._dirty.discard(name)
+        self._dirty.update(self.downstream(name))
+
+    def dependents(self):
+        '''
+        name -> names that directly depend on it
+        '''
+        if self._dependents is None:
+            self._dependents = {}
+            for name, (_, deps) in self.nodes.items():
+                for dep in deps:
+                    self._dependents.setdefault(dep, []).append(name)
+        return self._dependents
+
+    def downstream(self, name):
+        seen = set()
+        stack = [name]
+        dependents = self.dependents()
+        while len(stack) > 0:
+            for child in dependents.get(stack.pop(), ()):
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+        return seen
+
+    def order(self):
+        '''
+        names in topological order, raises on cycles
+        '''
+        if self._order is None:
+            order = []
+            state = {}
+            for root in self.nodes:
+                if root in state:
+                    continue
+                # iterative DFS, state 1 = on the stack, 2 = done
+                stack = [(root, iter(self.nodes[root][1]))]
+                state[root] = 1
+                while len(stack) > 0:
+                    name, deps = stack[-1]
+                    for dep in deps:
+                        if dep not in self.nodes:
+                            continue
+                        if state.get(dep) == 1:
+                            raise ExpressionError("Circular dependency through {}".format(dep))
+                        if dep not in state:
+                            state[dep] = 1
+                            stack.append((dep, iter(self.nodes[dep][1])))
+                            break
+                    else:
+                        stack.pop()
+                        state[name] = 2
+                        order.append(name)
+            self._order = order
+        return self._order
+
+    def evaluate(self, name=None, values=None):
+        '''
+        recomputes the dirty nodes and returns the value of
+        name, or all values. values can hold names that aren't
+        in the graph, e.g. observables a function uses
+        '''
+        if values is not None:
+            for vname, value in values.items():
+                if vname in self.nodes:
+                    self.set_value(vname, value)
+                else:
+                    # outside values may differ every call
+                    self._dirty.update(self.downstream(vname))
+        if len(self._dirty) > 0:
+            scope = dict(self.values)
+            if values is not None:
+                scope.update(values)
+            for node in self.order():
+                if node not in self._dirty:
+                    continue
+                func, _ = self.nodes[node]
+                if func is not None:
+                    try:
+                        scope[node] = _scalar(func(scope))
+                    except KeyError as e:
+                        raise ExpressionError("{} needs a value for {}".format(node, e))
+                    self.values[node] = scope[node]
+            self._dirty = set()
+        if name is not None:
+            return self.values[name]
+        return dict(self.values)
+
+    def evaluate_batch(self, batch):
+        '''
+        Vectorized evaluation over a batch of leaf values.
+        batch maps names to arrays of the same length, every
+        other leaf keeps its current value. Returns a dict of
+        name -> array, the graph itself is left unchanged
+        '''
+        scope = dict(self.evaluate())
+        size = None
+        for name, value in batch.items():
+            value = np.asarray(value, dtype=np.float64)
+            size = len(value)
+            scope[name] = value
+        changed = set(batch.keys())
+        for name in batch:
+            changed.update(self.downstream(name))
+        for node in self.order():
+            func, _ = self.nodes[node]
+            if node in changed and func is not None:
+                try:
+                    scope[node] = func(scope)
+                except KeyError as e:
+                    raise ExpressionError("{} needs a value for {}".format(node, e))
+        result = {}
+        for node in self.nodes:
+            value = scope[node]
+            if size is not None:
+                value = np.broadcast_to(value, (size,))
+            result[node] = value
+        return result
+###### EXPRESSIONS ######
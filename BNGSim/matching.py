@@ -0,0 +1,279 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from BNGSim.utils import split_bngl_blocks
+from BNGSim.bnglparser import BNGLParser, block_lines, split_top_level, parse_pattern_string
+from BNGSim.xmlparsers import SpeciesXML
+
+###### PATTERN MATCHING ######
+# Observables are computed from the species concentrations
+# (cdat) after the fact. Every observable pattern is matched
+# against every species of the network once, which gives a
+# species x observable weight matrix, and the observables of
+# any number of trajectories are then a single matrix multiply.
+def _net_text(net):
+    if isinstance(net, bytes):
+        net = net.decode("utf-8")
+    net = str(net)
+    if "\n" not in net and os.path.isfile(net):
+        with open(net, "r") as f:
+            net = f.read()
+    return net
+
+def read_net_species(net, concentrations=False, limit=None):
+    '''
+    Reads the species block of a .net file, net can be a
+    path or the text of the file. Returns the species
+    patterns in the order of their index, or (pattern, 
+    concentration) pairs. limit stops after that many species
+    '''
+    blocks = split_bngl_blocks(_net_text(net))
+    if "species" not in blocks:
+        return []
+    parser = BNGLParser("")
+    species = []
+    for iline, line in enumerate(block_lines(blocks["species"])):
+        if limit is not None and iline >= limit:
+            break
+        spec_xml = parser.parse_species(line, iline+1)[0]
+        if concentrations:
+            species.append((SpeciesXML(spec_xml), spec_xml["@concentration"]))
+        else:
+            species.append(SpeciesXML(spec_xml))
+    return species
+
+def read_net_parameters(net):
+    '''
+    Reads the parameters block of a .net file into an 
+    ordered dict of name -> value string
+    '''
+    blocks = split_bngl_blocks(_net_text(net))
+    params = OrderedDict()
+    if "parameters" not in blocks:
+        return params
+    for line in block_lines(blocks["parameters"]):
+        tokens = line.split()
+        # optional leading index
+        if len(tokens) > 2 and tokens[0].isdigit():
+            tokens = tokens[1:]
+        if len(tokens) >= 2:
+            params[tokens[0]] = "".join(tokens[1:])
+    return params
+
+def apply_net_edits(net, edits, out_file):
+    '''
+    Writes the .net file with setParameter/setConcentration
+    edits, (action type, [name, value]) pairs like the ones
+    BNGModel.network_edits gives, applied to the text
+    '''
+    params = {}
+    concs = {}
+    for action_type, args in edits:
+        if action_type == "setParameter":
+            params[args[0]] = args[1]
+        elif action_type == "setConcentration":
+            concs[SpeciesXML(parse_pattern_string(args[0]))] = args[1]
+    parser = BNGLParser("")
+    block = None
+    lines = []
+    for line in _net_text(net).splitlines():
+        stripped = line.split("#")[0].strip()
+        if stripped.startswith("begin "):
+            block = stripped[len("begin "):].strip()
+        elif stripped.startswith("end "):
+            block = None
+        elif len(stripped) > 0 and block == "parameters":
+            tokens = stripped.split()
+            if len(tokens) >= 3 and tokens[1] in params:
+                line = "    {} {} {}".format(tokens[0], tokens[1], params[tokens[1]])
+        elif len(stripped) > 0 and block == "species" and len(concs) > 0:
+            tokens = split_top_level(stripped, " ")
+            spec = SpeciesXML(parser.parse_pattern(tokens[1].lstrip("$"), "S1"))
+            if spec in concs:
+                line = "    {} {} {}".format(tokens[0], tokens[1], concs.pop(spec))
+        lines.append(line)
+    with open(out_file, "w") as f:
+        f.write("\n".join(lines))
+        f.write("\n")
+    return out_file
+
+class _FlatPattern:
+    '''
+    Pattern flattened into tuples and index lists, the
+    matcher only ever looks at these
+    '''
+    def __init__(self, pattern):
+        graph = pattern.bond_graph
+        self.mols = []
+        self.comps = []
+        self.name_counts = {}
+        ic = 0
+        for imol, mol in enumerate(pattern.molecules):
+            cmpt = mol.compartment
+            if cmpt is None:
+                cmpt = pattern.compartment
+            comps = []
+            for comp in mol.components:
+                wild = [str(b) for b in comp.bonds if str(b) in ("+", "?")]
+                partners = list(graph.partners(ic))
+                nbonds = len(comp.bonds) - len(wild)
+                # exact: the species component has to have exactly
+                # this many bonds, otherwise at least min_bonds
+                exact = len(wild) == 0 and nbonds == len(partners)
+                if "+" in wild or nbonds > len(partners):
+                    min_bonds = max(nbonds, 1)
+                else:
+                    min_bonds = nbonds
+                self.comps.append((comp.name, comp.state, exact, min_bonds, partners))
+                comps.append(ic)
+                ic += 1
+            self.mols.append((mol.name, cmpt, comps))
+            self.name_counts[mol.name] = self.name_counts.get(mol.name, 0) + 1
+        self.by_name = {}
+        for imol, (name, _, _) in enumerate(self.mols):
+            self.by_name.setdefault(name, []).append(imol)
+
+    def contains_names(self, other):
+        # quick check if other can possibly embed into self
+        for name, count in other.name_counts.items():
+            if self.name_counts.get(name, 0) < count:
+                return False
+        return True
+
+def count_embeddings(pattern, species, first_only=False):
+    '''
+    Number of distinct ways the molecules of the pattern map
+    onto the molecules of the species. With first_only it
+    stops at the first one, i.e. returns 0 or 1
+    '''
+    if not isinstance(pattern, _FlatPattern):
+        pattern = _FlatPattern(pattern)
+    if not isinstance(species, _FlatPattern):
+        species = _FlatPattern(species)
+    if not species.contains_names(pattern):
+        return 0
+    mol_map = [-1]*len(pattern.mols)
+    comp_map = [-1]*len(pattern.comps)
+    used_mols = [False]*len(species.mols)
+    used_comps = [False]*len(species.comps)
+    found = set()
+
+    def match_mol(im):
+        if im == len(pattern.mols):
+            found.add(tuple(mol_map))
+            return first_only
+        name, cmpt, pcomps = pattern.mols[im]
+        for sm in species.by_name.get(name, ()):
+            if used_mols[sm]:
+                continue
+            if cmpt is not None and species.mols[sm][1] != cmpt:
+                continue
+            mol_map[im] = sm
+            used_mols[sm] = True
+            done = match_comp(im, pcomps, 0, species.mols[sm][2])
+            used_mols[sm] = False
+            mol_map[im] = -1
+            if done:
+                return True
+        return False
+
+    def match_comp(im, pcomps, k, scomps):
+        if k == len(pcomps):
+            return match_mol(im+1)
+        pc = pcomps[k]
+        pname, pstate, exact, min_bonds, ppartners = pattern.comps[pc]
+        for sc in scomps:
+            if used_comps[sc]:
+                continue
+            sname, sstate, _, _, spartners = species.comps[sc]
+            if sname != pname:
+                continue
+            if pstate is not None and sstate != pstate:
+                continue
+            if exact and len(spartners) != min_bonds:
+                continue
+            if len(spartners) < min_bonds:
+                continue
+            bonded = True
+            for pp in ppartners:
+                if comp_map[pp] >= 0 and comp_map[pp] not in spartners:
+                    bonded = False
+                    break
+            if not bonded:
+                continue
+            comp_map[pc] = sc
+            used_comps[sc] = True
+            done = match_comp(im, pcomps, k+1, scomps)
+            used_comps[sc] = False
+            comp_map[pc] = -1
+            if done:
+                return True
+        return False
+
+    match_mol(0)
+    return len(found)
+
+class ObservableMatrix:
+    '''
+    Species x observable weight matrix. Molecules observables
+    count every match of their patterns in a species, Species
+    observables count a species once if any pattern matches.
+
+    observables is an Observables block or a list of
+    (type, name, patterns) tuples, species a list of patterns
+    in network order
+    '''
+    def __init__(self, observables, species):
+        if hasattr(observables, "_item_dict"):
+            observables = [(otype, name, obj) for name, (otype, obj) in observables._item_dict.items()]
+        self.names = []
+        self.types = []
+        flat_species = [_FlatPattern(s) for s in species]
+        self.weights = np.zeros((len(flat_species), len(observables)))
+        for iobs, (otype, name, patterns) in enumerate(observables):
+            self.names.append(name)
+            self.types.append(otype)
+            flat_patterns = [_FlatPattern(p) for p in patterns]
+            species_type = otype == "Species"
+            for ispec, spec in enumerate(flat_species):
+                weight = 0
+                for pat in flat_patterns:
+                    weight += count_embeddings(pat, spec, first_only=species_type)
+                    if species_type and weight > 0:
+                        break
+                self.weights[ispec, iobs] = weight
+
+    @classmethod
+    def from_net(cls, observables, net):
+        '''
+        builds the matrix from the species of a .net file
+        '''
+        return cls(observables, read_net_species(net))
+
+    def apply(self, cdat):
+        '''
+        Observables from species concentrations. cdat is either
+        the structured array loaded from a .cdat file or a plain
+        (time, species) array, with or without the time column.
+        Returns a record array laid out like a .gdat file
+        '''
+        if cdat.dtype.names is not None:
+            cdat = np.column_stack([cdat[n] for n in cdat.dtype.names])
+        cdat = np.atleast_2d(cdat)
+        nspec = self.weights.shape[0]
+        if cdat.shape[1] == nspec + 1:
+            time, concs = cdat[:,0], cdat[:,1:]
+        elif cdat.shape[1] == nspec:
+            time, concs = np.arange(cdat.shape[0], dtype=float), cdat
+        else:
+            raise ValueError("cdat has {} columns but the network has {} species".format(cdat.shape[1], nspec))
+        obs = concs @ self.weights
+        names = ["time"] + self.names
+        out = np.empty(cdat.shape[0], dtype={'names': names, 'formats': ["f8"]*len(names)})
+        out["time"] = time
+        for iobs, name in enumerate(self.names):
+            out[name] = obs[:,iobs]
+        return np.rec.array(out)
+###### PATTERN MATCHING ######
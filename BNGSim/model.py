@@ -1,14 +1,39 @@
-import re, functools, subprocess, os, xmltodict, sys, shutil, tempfile
-from BNGSim.utils import find_BNG_path
+import re, io, functools, itertools, subprocess, os, sys, shutil, tempfile
+import xml.etree.ElementTree as ET
+from BNGSim.utils import find_BNG_path, split_bngl_blocks
+from BNGSim.cache import XMLCache, get_xml_cache
+from BNGSim.xmlstream import iter_model_lists, element_to_dict, strip_ns
+from BNGSim.bnglparser import BNGLParser, BNGLParseError
 from BNGSim.structs import Parameters, Species, MoleculeTypes, Observables, Functions, Compartments, Rules, Actions
 
+# XML list -> (model attribute, block class, XML item tag)
+# TODO: Optional expression parsing for functions?
+# TODO: Add function arguments correctly
+xml_block_map = {"ListOfParameters": ("parameters", Parameters, "Parameter"),
+                 "ListOfCompartments": ("compartments", Compartments, "compartment"),
+                 "ListOfMoleculeTypes": ("moltypes", MoleculeTypes, "MoleculeType"),
+                 "ListOfSpecies": ("species", Species, "Species"),
+                 "ListOfObservables": ("observables", Observables, "Observable"),
+                 "ListOfFunctions": ("functions", Functions, "Function"),
+                 "ListOfReactionRules": ("rules", Rules, "ReactionRule")}
+
 ###### CORE OBJECT AND PARSING FRONT-END ######
 class BNGModel:
     '''
     The full model
     '''
-    def __init__(self, bngl_model, BNGPATH=None):
+    def __init__(self, bngl_model, BNGPATH=None, xml_cache=True, keep_xml=False, lazy=False, parser="auto"):
         self.active_blocks = []
+        # "bngl" parses BNGL in python, "xml" goes through 
+        # BNG2.pl --xml and "auto" tries python first and falls
+        # back to BNG2.pl if the model uses something we can't parse
+        self.parser = parser
+        # in lazy mode blocks are kept as raw XML until they
+        # are accessed, see __getattr__
+        self.lazy = lazy
+        self._lazy_blocks = {}
+        # original BNGL text of each block, if we have it
+        self._block_text = {}
         # We want blocks to be printed in the same order
         # every time
         self._action_list = ["generate_network(", "generate_hybrid_model(","simulate(", "simulate_ode(", "simulate_ssa(", "simulate_pla(", "simulate_nf(", "parameter_scan(", "bifurcate(", "readFile(", "writeFile(", "writeModel(", "writeNetwork(", "writeXML(", "writeSBML(", "writeMfile(", "writeMexfile(", "writeMDL(", "visualize(", "setConcentration(", "addConcentration(", "saveConcentration(", "resetConcentrations(", "setParameter(", "saveParameters(", "resetParameters(", "quit(", "setModelName(", "substanceUnits(", "version(", "setOption("]
@@ -18,6 +43,16 @@ class BNGModel:
         BNGPATH, bngexec = find_BNG_path(BNGPATH)
         self.BNGPATH = BNGPATH
         self.bngexec = bngexec 
+        # True uses the shared on-disk XML cache, an XMLCache
+        # instance uses that cache and False/None disables caching
+        if xml_cache is True:
+            xml_cache = get_xml_cache()
+        elif not isinstance(xml_cache, XMLCache):
+            xml_cache = None
+        self.xml_cache = xml_cache
+        # keeping the full xmltodict tree around is opt-in,
+        # by default the XML is streamed block by block
+        self.keep_xml = keep_xml
         self.model_name = ""
         self.parse_model(bngl_model)
 
@@ -25,19 +60,135 @@ class BNGModel:
         '''
         write the model to str
         '''
-        model_str = "begin model\n"
+        model_str = io.StringIO()
+        self.write_to(model_str)
+        return model_str.getvalue()
+
+    def write_to(self, f, actions=True):
+        '''
+        write the model to an open file block by block 
+        without building the whole string first, actions=False
+        leaves the actions out
+        '''
+        f.write("begin model\n")
         for block in self.block_order:
             if block in self.active_blocks:
                 if block != "actions":
-                    model_str += str(getattr(self, block))
-        model_str += "\nend model\n"
-        if "actions" in self.active_blocks:
-            model_str += str(self.actions)
-        return model_str
+                    self._write_block(f, block)
+        f.write("\nend model\n")
+        if actions and "actions" in self.active_blocks:
+            self.actions.write_to(f)
+
+    def write_structure(self, f):
+        '''
+        Writes the parts of the model the reaction network 
+        depends on. Values of free parameters and species
+        concentrations are left out, those edits don't need
+        a new network, see network_edits
+        '''
+        from BNGSim.expressions import _is_number
+        for block in self.block_order:
+            if block not in self.active_blocks or block == "actions":
+                continue
+            if block == "parameters":
+                f.write("\nbegin parameters\n")
+                for name, value in self.parameters._item_dict.items():
+                    if _is_number(value):
+                        f.write("  {}\n".format(name))
+                    else:
+                        f.write("  {} {}\n".format(name, value))
+                f.write("end parameters\n")
+            elif block == "species":
+                f.write("\nbegin species\n")
+                for spec in self.species:
+                    f.write("  {}\n".format(spec))
+                f.write("end species\n")
+            else:
+                self._write_block(f, block)
+
+    def network_edits(self, net_file):
+        '''
+        setParameter/setConcentration actions that bring the
+        network in net_file, generated from a model with the
+        same structure, up to date with this model. Returned
+        as (action type, args) pairs
+        '''
+        from BNGSim.matching import read_net_parameters, read_net_species
+        from BNGSim.expressions import _is_number
+        edits = []
+        changed = set()
+        net_params = read_net_parameters(net_file)
+        if "parameters" in self.active_blocks:
+            for name, value in self.parameters._item_dict.items():
+                if not _is_number(value) or name not in net_params:
+                    continue
+                net_value = net_params[name]
+                if _is_number(net_value) and float(net_value) == float(value):
+                    continue
+                edits.append(("setParameter", [name, value]))
+                changed.add(name)
+        if len(changed) > 0:
+            # derived parameters of the changed ones change too
+            graph = self.parameters.expression_graph()
+            for name in list(changed):
+                changed.update(graph.downstream(name))
+        if "species" in self.active_blocks:
+            # seed species come first in the network
+            seeds = dict(read_net_species(net_file, concentrations=True, limit=len(self.species)))
+            for spec in self.species:
+                conc = self.species[spec]
+                net_conc = seeds.get(spec)
+                if net_conc is None:
+                    continue
+                if str(conc) == str(net_conc):
+                    # concentrations given by changed parameters 
+                    # are set again
+                    names = re.findall(r"[A-Za-z_]\w*", str(conc))
+                    if len(changed.intersection(names)) == 0:
+                        continue
+                edits.append(("setConcentration", [str(spec), conc]))
+        return edits
+
+    def network_actions(self, net_file, read_name=None):
+        '''
+        Actions that run this model starting from the already
+        generated network net_file: readFile, the numeric edits
+        and the model actions except generate_network. read_name
+        is the name readFile uses, the basename by default
+        '''
+        if read_name is None:
+            read_name = os.path.basename(net_file)
+        return self.actions.network_actions(read_name, self.network_edits(net_file))
 
     def __repr__(self):
         return self.model_name
 
+    def __getattr__(self, name):
+        # only called when normal lookup fails, this is
+        # where lazy blocks get built on first access
+        lazy_blocks = self.__dict__.get("_lazy_blocks", {})
+        if name not in lazy_blocks:
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+        kind, listkey, source = lazy_blocks.pop(name)
+        if kind == "xml":
+            list_xml = element_to_dict(ET.fromstring(source))
+        else:
+            # source is the BNGLParser
+            _, list_xml = source.block_xml(name)
+        block = self._build_block(listkey, list_xml)
+        setattr(self, name, block)
+        return block
+
+    def _write_block(self, f, block):
+        '''
+        writes a single block, lazy blocks that were never
+        touched are written out as they were in the BNGL
+        '''
+        if block in self._lazy_blocks and block in self._block_text:
+            f.write(self._block_text[block])
+        else:
+            getattr(self, block).write_to(f)
+
     def __iter__(self):
         active_ordered_blocks = [getattr(self,i) for i in self.block_order if i in self.active_blocks]
         return active_ordered_blocks.__iter__()
@@ -46,13 +197,26 @@ class BNGModel:
         # this route runs BNG2.pl on the bngl and parses
         # the XML instead
         if model_file.endswith(".bngl"):
-            # TODO: Strip actions into a temp file
-            # then run the gen xml 
+            if self.parser in ("auto", "bngl"):
+                try:
+                    self.parse_bngl(model_file)
+                    return
+                except BNGLParseError as e:
+                    if self.parser == "bngl":
+                        raise
+                    print("Can't parse BNGL directly ({}), falling back to BNG2.pl".format(e))
             print("Attempting to generate XML")
+            if self.lazy:
+                with open(model_file, "r") as f:
+                    self._block_text = split_bngl_blocks(f.read())
             model_file = self.generate_xml(model_file)
             if model_file is not None:
                 print("Parsing XML")
-                self.parse_xml(model_file)
+                try:
+                    self.parse_xml(model_file)
+                finally:
+                    # the XML is in a temporary folder of its own
+                    shutil.rmtree(os.path.dirname(model_file), ignore_errors=True)
             else:
                 print("XML file doesn't exist")
         elif model_file.endswith(".xml"):
@@ -61,29 +225,65 @@ class BNGModel:
             print("The extension of {} is not supported".format(model_file))
             raise NotImplemented
 
+    def parse_bngl(self, model_file):
+        '''
+        parses the BNGL in python without calling BNG2.pl
+        '''
+        with open(model_file, "r") as f:
+            parser = BNGLParser(f.read())
+        model_name = os.path.split(model_file)[1].replace(".bngl", "")
+        if self.lazy:
+            self._block_text = parser.blocks
+            for block in self.block_order:
+                if block in parser.blocks:
+                    listkey = parser.block_xml_names[block][0]
+                    self._lazy_blocks[block] = ("bngl", listkey, parser)
+                    self.active_blocks.append(block)
+        else:
+            # parse everything before touching the model so a
+            # failure leaves us clean for the XML route
+            list_xmls = list(parser.iter_blocks())
+            for listkey, list_xml in list_xmls:
+                self._parse_xml_list(listkey, list_xml)
+        self.model_name = model_name
+        print("BNGL parsed")
+
     def generate_xml(self, model_file):
-        cur_dir = os.getcwd()
+        '''
+        XML of the model without its actions, from the XML cache
+        or by running BNG2.pl --xml. Returns the path to the XML
+        in a temporary folder the caller removes, None if the
+        generation failed
+        '''
+        path, model_name = os.path.split(model_file)
+        model_name = model_name.replace(".bngl", "")
+        with open(model_file, "r") as mf:
+            stripped_text = "".join(filter(lambda x: self._not_action(x), mf.readlines()))
         # temporary folder to work in
         temp_folder = tempfile.mkdtemp()
-        # make a stripped copy without actions in the folder
-        stripped_bngl = self.strip_actions(model_file, temp_folder)
-        # run with --xml 
-        os.chdir(temp_folder)
+        xml_file = os.path.join(temp_folder, model_name + ".xml")
+        # see if we already generated XML for this exact text,
+        # copied out under the cache lock
+        cache_key = None
+        if self.xml_cache is not None:
+            cache_key = self.xml_cache.model_text_key(model_name, stripped_text, self.bngexec)
+            if self.xml_cache.copy_to(cache_key, xml_file) is not None:
+                print("Using cached XML")
+                return xml_file
+        stripped_bngl = os.path.join(temp_folder, model_name + ".bngl")
+        with open(stripped_bngl, "w") as sf:
+            sf.write(stripped_text)
+        # run with --xml in the temp folder
         # TODO: Make output supression an option somewhere
-        rc = subprocess.run(["perl",self.bngexec, "--xml", stripped_bngl])
-        if rc.returncode == 1:
+        rc = subprocess.run(["perl",self.bngexec, "--xml", stripped_bngl], cwd=temp_folder)
+        if rc.returncode == 1 or not os.path.isfile(xml_file):
             print("XML generation failed")
-            # go back to our original location
-            os.chdir(cur_dir)
+            shutil.rmtree(temp_folder, ignore_errors=True)
             return None
-        else:
-            # we should now have the XML file 
-            path, model_name = os.path.split(stripped_bngl)
-            model_name = model_name.replace(".bngl", "")
-            xml_file = model_name + ".xml"
-            # go back to our original location
-            os.chdir(cur_dir)
-            return os.path.join(path, xml_file)
+        # we should now have the XML file 
+        if cache_key is not None:
+            self.xml_cache.put(cache_key, xml_file)
+        return xml_file
 
     def strip_actions(self, model_path, folder):
         '''
@@ -110,6 +310,33 @@ class BNGModel:
         return True
 
     def parse_xml(self, model_file):
+        if self.keep_xml:
+            self._parse_xml_dict(model_file)
+            return
+        for listkey, items in iter_model_lists(model_file):
+            if listkey == "@id":
+                self.model_name = items
+            elif listkey not in xml_block_map:
+                continue
+            elif self.lazy:
+                # keep the raw XML, empty lists are skipped
+                list_elem = ET.Element(listkey)
+                list_elem.extend(items)
+                if len(list_elem) > 0:
+                    block = xml_block_map[listkey][0]
+                    self._lazy_blocks[block] = ("xml", listkey, ET.tostring(list_elem))
+                    self.active_blocks.append(block)
+            else:
+                self._parse_xml_items(listkey, items)
+        # And that's the end of parsing
+        print("XML parsed")
+
+    def _parse_xml_dict(self, model_file):
+        '''
+        old route, parses the entire file with xmltodict 
+        and keeps the tree around as self.xml_dict
+        '''
+        import xmltodict
         with open(model_file, "r") as f:
             xml_str = "".join(f.readlines())
         xml_dict = xmltodict.parse(xml_str)
@@ -117,60 +344,36 @@ class BNGModel:
         xml_model = xml_dict['sbml']['model']
         self.model_name = xml_model['@id']
         for listkey in xml_model.keys():
-            if listkey == "ListOfParameters":
-                param_list = xml_model[listkey]
-                if param_list is not None:
-                    params = param_list['Parameter']
-                    self.parameters = Parameters()
-                    self.parameters.parse_xml_block(params)
-                    self.active_blocks.append("parameters")
-            elif listkey == "ListOfObservables":
-                obs_list = xml_model[listkey]
-                if obs_list is not None:
-                    obs = obs_list['Observable']
-                    self.observables = Observables()
-                    self.observables.parse_xml_block(obs)
-                    self.active_blocks.append("observables")
-            elif listkey == "ListOfCompartments":
-                comp_list = xml_model[listkey]
-                if comp_list is not None:
-                    self.compartments = Compartments()
-                    comps = comp_list['compartment']
-                    self.compartments.parse_xml_block(comps)
-                    self.active_blocks.append("compartments")
-            elif listkey == "ListOfMoleculeTypes":
-                mtypes_list = xml_model[listkey]
-                if mtypes_list is not None:
-                    mtypes = mtypes_list["MoleculeType"]
-                    self.moltypes = MoleculeTypes()
-                    self.moltypes.parse_xml_block(mtypes)
-                    self.active_blocks.append("moltypes")
-            elif listkey == "ListOfSpecies":
-                species_list = xml_model[listkey]
-                if species_list is not None:
-                    species = species_list["Species"]
-                    self.species = Species()
-                    self.species.parse_xml_block(species)
-                    self.active_blocks.append("species")
-            elif listkey == "ListOfReactionRules":
-                rrules_list = xml_model[listkey]
-                if rrules_list is not None:
-                    rrules = rrules_list["ReactionRule"]
-                    self.rules = Rules()
-                    self.rules.parse_xml_block(rrules)
-                    self.active_blocks.append("rules")
-            elif listkey == "ListOfFunctions":
-                # TODO: Optional expression parsing?
-                # TODO: Add arguments correctly
-                func_list = xml_model[listkey]
-                if func_list is not None:
-                    self.functions = Functions()
-                    funcs = func_list['Function']
-                    self.functions.parse_xml_block(funcs)
-                    self.active_blocks.append("functions")
+            self._parse_xml_list(listkey, xml_model[listkey])
         # And that's the end of parsing
         print("XML parsed")
 
+    def _parse_xml_list(self, listkey, list_xml):
+        if listkey in xml_block_map and list_xml is not None:
+            block = xml_block_map[listkey][0]
+            setattr(self, block, self._build_block(listkey, list_xml))
+            self.active_blocks.append(block)
+
+    def _parse_xml_items(self, listkey, items):
+        # the block is built one item at a time as they are
+        # streamed in, empty lists are skipped
+        block, block_cls, item_tag = xml_block_map[listkey]
+        item_dicts = (element_to_dict(item) for item in items if strip_ns(item.tag) == item_tag)
+        first = next(item_dicts, None)
+        if first is None:
+            return
+        block_obj = block_cls()
+        block_obj.parse_xml_block(itertools.chain([first], item_dicts))
+        setattr(self, block, block_obj)
+        self.active_blocks.append(block)
+
+    def _build_block(self, listkey, list_xml):
+        _, block_cls, item_tag = xml_block_map[listkey]
+        block_obj = block_cls()
+        if list_xml is not None:
+            block_obj.parse_xml_block(list_xml[item_tag])
+        return block_obj
+
     def add_action(self, action_type, action_args):
         # add actions block and to active list
         if not hasattr(self, "actions"):
@@ -182,37 +385,70 @@ class BNGModel:
         '''
         write the model to file 
         '''
-        model_str = ""
-        for block in self.active_blocks:
-            model_str += str(getattr(self, block))
         with open(file_name, 'w') as f:
-            f.write(model_str)
+            for block in self.active_blocks:
+                self._write_block(f, block)
 
     def write_xml(self, file_name):
         '''
         write new XML to file by calling BNG2.pl again
         '''
-        cur_dir = os.getcwd()
+        fpath = os.path.abspath(file_name)
         # temporary folder to work in
         temp_folder = tempfile.mkdtemp()
+        temp_bngl = os.path.join(temp_folder, "temp.bngl")
+        temp_xml = os.path.join(temp_folder, "temp.xml")
         # write the current model to temp folder
-        os.chdir(temp_folder)
-        with open("temp.bngl", "w") as f:
-            f.write(str(self))
-        # run with --xml 
-        # TODO: Make output supression an option somewhere
-        rc = subprocess.run(["perl",self.bngexec, "--xml", "temp.bngl"])
-        if rc.returncode == 1:
-            print("XML generation failed")
-            # go back to our original location
-            os.chdir(cur_dir)
-        else:
-            # we should now have the XML file 
-            fpath = os.path.join(cur_dir, file_name)
-            shutil.copy("temp.xml", fpath)
-            os.chdir(cur_dir)
+        with open(temp_bngl, "w") as f:
+            self.write_to(f)
+        try:
+            cache_key = None
+            if self.xml_cache is not None:
+                cache_key = self.xml_cache.model_key("temp", temp_bngl, self.bngexec)
+                if self.xml_cache.copy_to(cache_key, fpath) is not None:
+                    print("Using cached XML")
+                    return
+            # run with --xml 
+            # TODO: Make output supression an option somewhere
+            rc = subprocess.run(["perl",self.bngexec, "--xml", "temp.bngl"], cwd=temp_folder)
+            if rc.returncode == 1:
+                print("XML generation failed")
+            else:
+                # we should now have the XML file 
+                if cache_key is not None:
+                    self.xml_cache.put(cache_key, temp_xml)
+                shutil.copy(temp_xml, fpath)
+        finally:
+            shutil.rmtree(temp_folder, ignore_errors=True)
 ###### CORE OBJECT AND PARSING FRONT-END ######
 
+def block_differences(m, n):
+    '''
+    Compares two models block by block and item by item,
+    returns a list of difference descriptions
+    '''
+    diffs = []
+    for block in sorted(set(m.active_blocks + n.active_blocks)):
+        if block not in m.active_blocks or block not in n.active_blocks:
+            diffs.append("{}: only in one model".format(block))
+            continue
+        mblock, nblock = getattr(m, block), getattr(n, block)
+        mitems = [(str(k), str(v)) for k, v in mblock._item_dict.items()]
+        nitems = [(str(k), str(v)) for k, v in nblock._item_dict.items()]
+        if len(mitems) != len(nitems):
+            diffs.append("{}: {} vs {} items".format(block, len(mitems), len(nitems)))
+        for mitem, nitem in zip(mitems, nitems):
+            if mitem != nitem:
+                diffs.append("{}: {} vs {}".format(block, mitem, nitem))
+        if block == "parameters":
+            for name in mblock.values:
+                mval, nval = mblock.values.get(name), nblock.values.get(name)
+                if nval is None or abs(float(mval) - float(nval)) > 1e-12*max(abs(float(mval)), 1):
+                    diffs.append("parameters: value of {} {} vs {}".format(name, mval, nval))
+            if mblock.expressions != nblock.expressions:
+                diffs.append("parameters: expressions {} vs {}".format(mblock.expressions, nblock.expressions))
+    return diffs
+
 if __name__ == "__main__":
     # model = BNGModel("test.bngl")
     # import IPython
@@ -223,7 +459,7 @@ if __name__ == "__main__":
     bngl_list = os.listdir(os.getcwd())
     bngl_list = filter(lambda x: x.endswith(".bngl"), bngl_list)
     for bngl in bngl_list:
-        m = BNGModel(bngl)
+        m = BNGModel(bngl, parser="xml")
         with open('test.bngl', 'w') as f:
             f.write(str(m))
         rc = subprocess.run([m.bngexec, 'test.bngl'])
@@ -0,0 +1,314 @@
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+from BNGSim.utils import split_bngl_blocks, net_block_names
+from BNGSim.bnglparser import block_lines, _func_re
+from BNGSim.expressions import ExpressionGraph, compile_expression, _is_number
+from BNGSim.matching import _net_text, read_net_parameters
+
+###### BATCH ODE ######
+# A generated network (.net) turned into arrays: a species x
+# reaction stoichiometry matrix, the reactant indices of every
+# reaction and the index of its rate constant. The right hand
+# side of the mass action ODEs is then a handful of array
+# operations that work on a whole batch of parameter sets at
+# once, (batch, species) at every step, and is integrated with
+# an adaptive Dormand-Prince Runge-Kutta 5(4) scheme.
+
+# Dormand-Prince 5(4) tableau
+_dp_c = np.array([0, 1/5, 3/10, 4/5, 8/9, 1, 1])
+_dp_a = [[],
+         [1/5],
+         [3/40, 9/40],
+         [44/45, -56/15, 32/9],
+         [19372/6561, -25360/2187, 64448/6561, -212/729],
+         [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+         [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]]
+_dp_b = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0])
+_dp_e = _dp_b - np.array([5179/57600, 0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40])
+
+_rate_re = re.compile(r"^(?:([0-9.eE+-]+)\*)?([A-Za-z_]\w*)$")
+
+class NetworkODE:
+    '''
+    Mass action ODEs of a .net file, net can be a path or the
+    text of the file. Rate laws can be a parameter or a global
+    function (of parameters, observables and time), optionally
+    times a statistical factor. observables is an optional
+    ObservableMatrix, otherwise the groups block of the network
+    is used.
+
+        ode = NetworkODE("model.net")
+        gdat = ode.simulate(100, 50, params={"kp1": np.logspace(-2, 1, 1000)})
+        # gdat[i,:,0] is the time, gdat[i,:,1:] the observables
+        # of the i-th parameter set, in the order of ode.names
+    '''
+    def __init__(self, net, observables=None):
+        net = _net_text(net)
+        blocks = split_bngl_blocks(net, net_block_names)
+        # parameters, derived ones are evaluated per parameter set
+        self.parameters = read_net_parameters(net)
+        self.graph = ExpressionGraph()
+        for name, value in self.parameters.items():
+            self.graph.set_expression(name, value)
+        self.free_names = [name for name, value in self.parameters.items() if _is_number(value)]
+        self._read_species(blocks)
+        self._read_functions(blocks)
+        self._read_reactions(blocks)
+        if observables is not None:
+            self.observable_names = list(observables.names)
+            self.weights = np.asarray(observables.weights, dtype=np.float64)
+        else:
+            self._read_groups(blocks)
+        self.names = ["time"] + self.observable_names
+
+    def _read_species(self, blocks):
+        self.species = []
+        self.initial_expressions = []
+        fixed = []
+        if "species" in blocks:
+            for line in block_lines(blocks["species"]):
+                tokens = line.split()
+                if len(tokens) > 2 and tokens[0].isdigit():
+                    tokens = tokens[1:]
+                if "$" in tokens[0]:
+                    fixed.append(len(self.species))
+                self.species.append(tokens[0])
+                self.initial_expressions.append("".join(tokens[1:]))
+        self.fixed = np.array(fixed, dtype=np.int64)
+
+    def _read_functions(self, blocks):
+        # global functions only, compiled in dependency order
+        graph = ExpressionGraph()
+        if "functions" in blocks:
+            for line in block_lines(blocks["functions"]):
+                # optional leading index, the expression is
+                # everything after the name and its "=", if any
+                m = _func_re.match(re.sub(r"^\d+\s+", "", line))
+                if m is None:
+                    raise ValueError("Can't parse function: {}".format(line))
+                name, args, expr = m.group(1), m.group(2), m.group(3).strip()
+                if args is not None and len(args.strip()) > 0:
+                    raise ValueError("Local functions are not supported: {}".format(line))
+                graph.set_expression(name, expr)
+        self.functions = OrderedDict()
+        for name in graph.order():
+            if name in graph.nodes and graph.nodes[name][0] is not None:
+                self.functions[name] = graph.nodes[name][0]
+
+    def _read_reactions(self, blocks):
+        reactants = []
+        products = []
+        factors = []
+        rate_names = OrderedDict()
+        rate_index = []
+        if "reactions" in blocks:
+            for line in block_lines(blocks["reactions"]):
+                tokens = line.split()
+                if len(tokens) > 3 and tokens[0].isdigit():
+                    tokens = tokens[1:]
+                m = _rate_re.match("".join(tokens[2:]))
+                if m is None:
+                    raise ValueError("Unsupported rate law: {}".format(line))
+                factors.append(1.0 if m.group(1) is None else float(m.group(1)))
+                rate = m.group(2)
+                if rate not in self.parameters and rate not in self.functions:
+                    raise ValueError("Unknown rate constant {} in: {}".format(rate, line))
+                rate_index.append(rate_names.setdefault(rate, len(rate_names)))
+                # species index 0 is the null species
+                reactants.append([int(i)-1 for i in tokens[0].split(",") if int(i) > 0])
+                products.append([int(i)-1 for i in tokens[1].split(",") if int(i) > 0])
+        nspec = len(self.species)
+        nrxn = len(reactants)
+        self.stoichiometry = np.zeros((nspec, nrxn))
+        for irxn in range(nrxn):
+            for ispec in reactants[irxn]:
+                self.stoichiometry[ispec, irxn] -= 1
+            for ispec in products[irxn]:
+                self.stoichiometry[ispec, irxn] += 1
+        # fixed species don't change
+        self.stoichiometry[self.fixed, :] = 0
+        # reactants padded with index nspec, a column of ones
+        order = max([len(r) for r in reactants] + [1])
+        self.reactants = np.full((nrxn, order), nspec, dtype=np.int64)
+        for irxn, rxn_reactants in enumerate(reactants):
+            self.reactants[irxn, :len(rxn_reactants)] = rxn_reactants
+        self.factors = np.array(factors, dtype=np.float64)
+        self.rate_names = list(rate_names.keys())
+        self.rate_index = np.array(rate_index, dtype=np.int64)
+
+    def _read_groups(self, blocks):
+        self.observable_names = []
+        columns = []
+        if "groups" in blocks:
+            for line in block_lines(blocks["groups"]):
+                tokens = line.split()
+                if len(tokens) > 1 and tokens[0].isdigit():
+                    tokens = tokens[1:]
+                column = np.zeros(len(self.species))
+                if len(tokens) > 1:
+                    for entry in tokens[1].split(","):
+                        if "*" in entry:
+                            weight, ispec = entry.split("*")
+                            column[int(ispec)-1] += float(weight)
+                        else:
+                            column[int(entry)-1] += 1
+                self.observable_names.append(tokens[0])
+                columns.append(column)
+        self.weights = np.zeros((len(self.species), len(columns)))
+        if len(columns) > 0:
+            self.weights = np.column_stack(columns)
+
+    def evaluate_parameters(self, params=None):
+        '''
+        All parameters for a batch of parameter sets. params is
+        either a dict of name -> length N array (the rest keep
+        their .net values) or a (N, len(free_names)) array.
+        Returns (N, dict of name -> length N array)
+        '''
+        if params is None:
+            params = {}
+        if not isinstance(params, dict):
+            params = np.asarray(params, dtype=np.float64)
+            if params.ndim != 2 or params.shape[1] != len(self.free_names):
+                raise ValueError("Expected an (N, {}) array".format(len(self.free_names)))
+            params = {name: params[:,i] for i, name in enumerate(self.free_names)}
+        size = 1
+        for value in params.values():
+            size = max(size, np.size(value))
+        batch = {name: np.broadcast_to(np.asarray(value, dtype=np.float64), (size,))
+                 for name, value in params.items()}
+        values = self.graph.evaluate_batch(batch)
+        return size, {name: np.broadcast_to(value, (size,)) for name, value in values.items()}
+
+    def initial(self, values, size):
+        '''
+        (N, species) initial concentrations given the evaluated
+        parameters
+        '''
+        y0 = np.empty((size, len(self.species)))
+        for ispec, expr in enumerate(self.initial_expressions):
+            if _is_number(expr):
+                y0[:, ispec] = float(expr)
+            else:
+                y0[:, ispec] = compile_expression(expr)[0](values)
+        return y0
+
+    def rates(self, t, y, values):
+        '''
+        (N, reactions) rate constants, functions are evaluated
+        on the current observables and time
+        '''
+        size = y.shape[0]
+        consts = np.empty((size, len(self.rate_names)))
+        scope = None
+        for irate, name in enumerate(self.rate_names):
+            if name in self.functions:
+                if scope is None:
+                    scope = self._function_scope(t, y, values)
+                consts[:, irate] = scope[name]
+            else:
+                consts[:, irate] = values[name]
+        return consts[:, self.rate_index] * self.factors
+
+    def _function_scope(self, t, y, values):
+        scope = dict(values)
+        obs = y @ self.weights
+        for iobs, name in enumerate(self.observable_names):
+            scope[name] = obs[:, iobs]
+        scope["time"] = t
+        for name, func in self.functions.items():
+            scope[name] = func(scope)
+        return scope
+
+    def rhs(self, t, y, values, consts=None):
+        '''
+        dy/dt for a (N, species) array
+        '''
+        if consts is None or len(self.functions) > 0:
+            consts = self.rates(t, y, values)
+        padded = np.concatenate([y, np.ones((y.shape[0], 1))], axis=1)
+        flux = consts * padded[:, self.reactants].prod(axis=2)
+        return flux @ self.stoichiometry.T
+
+    def simulate(self, t_end, n_steps, t_start=0, params=None, atol=1e-8, rtol=1e-6,
+                 max_steps=1000000, concentrations=False):
+        '''
+        Integrates every parameter set in params (see
+        evaluate_parameters) from t_start to t_end and returns
+        a (batch, n_steps+1, 1+observables) array laid out like
+        the gdat, columns are ode.names. With concentrations
+        it returns (batch, n_steps+1, 1+species) like the cdat
+        '''
+        size, values = self.evaluate_parameters(params)
+        times = np.linspace(float(t_start), float(t_end), int(n_steps)+1)
+        y = self.initial(values, size)
+        consts = self.rates(times[0], y, values)
+        t = np.full(size, times[0])
+        out = np.empty((size, len(times), len(self.species)))
+        out[:, 0] = y
+        # index of the next output time of each member
+        inext = np.ones(size, dtype=np.int64)
+        h = np.full(size, self._initial_step(times, y, values, consts, atol, rtol))
+        k = np.empty((7, size, len(self.species)))
+        k[0] = self.rhs(t, y, values, consts)
+        nsteps = 0
+        while True:
+            active = inext < len(times)
+            if not active.any():
+                break
+            nsteps += 1
+            if nsteps > max_steps:
+                raise RuntimeError("Integration didn't finish in {} steps".format(max_steps))
+            t_next = times[np.minimum(inext, len(times)-1)]
+            # don't step over the next output time
+            step = np.where(active, np.minimum(h, t_next - t), 0)
+            for istage in range(1, 7):
+                dy = np.zeros_like(y)
+                for j, a in enumerate(_dp_a[istage]):
+                    if a != 0:
+                        dy += a * k[j]
+                k[istage] = self.rhs(t + _dp_c[istage]*step, y + step[:,None]*dy, values, consts)
+            y_new = y + step[:,None]*np.tensordot(_dp_b, k, axes=1)
+            err = step[:,None]*np.tensordot(_dp_e, k, axes=1)
+            scale = atol + rtol*np.maximum(np.abs(y), np.abs(y_new))
+            err_norm = np.sqrt(np.mean((err/scale)**2, axis=1)) if len(self.species) > 0 else np.zeros(size)
+            accept = active & (err_norm <= 1)
+            # step size control, safety factor 0.9
+            with np.errstate(divide="ignore"):
+                factor = np.clip(0.9*err_norm**-0.2, 0.2, 5)
+            factor = np.where(accept, factor, np.minimum(factor, 1))
+            h = np.where(active, step*factor, h)
+            t = np.where(accept, t + step, t)
+            y[accept] = y_new[accept]
+            # FSAL, the last stage is the first of the next step
+            k[0][accept] = k[6][accept]
+            reached = accept & np.isclose(t, t_next, rtol=1e-12, atol=0)
+            if reached.any():
+                t[reached] = t_next[reached]
+                out[reached, inext[reached]] = y[reached]
+                inext[reached] += 1
+        if concentrations:
+            data = out
+        else:
+            data = out @ self.weights
+        time = np.broadcast_to(times[None,:,None], (size, len(times), 1))
+        return np.concatenate([time, data], axis=2)
+
+    def _initial_step(self, times, y, values, consts, atol, rtol):
+        # a conservative first guess, the controller adapts it
+        span = times[-1] - times[0]
+        if span <= 0:
+            return 1.0
+        f0 = self.rhs(times[0], y, values, consts)
+        scale = atol + rtol*np.abs(y)
+        d0 = np.sqrt(np.mean((y/scale)**2)) if y.size > 0 else 0
+        d1 = np.sqrt(np.mean((f0/scale)**2)) if y.size > 0 else 0
+        if d0 < 1e-5 or d1 < 1e-5:
+            h = 1e-6
+        else:
+            h = 0.01*d0/d1
+        return min(h, span/max(len(times)-1, 1))
+###### BATCH ODE ######
@@ -1,16 +1,101 @@
-# All classes that deal with patterns 
+import sys
+from array import array
+from BNGSim.canonical import canonical_string, pattern_invariant
+# All classes that deal with patterns. These get created by
+# the hundreds of thousands for big models so they use __slots__
+# and intern their names/states to keep memory down
+
+# Every object caches its rendered string. The setters below
+# drop the cache of the object they are called on and of its
+# owner, the object or model block holding it, up the chain
+# (component -> molecule -> pattern -> rule/observable -> block)
+# so a change only re-renders what contains the changed part.
+# Changing the lists (components, bonds etc.) in place doesn't
+# do that, use the setters/add methods for that.
+def _adopt(owner, obj):
+    # obj reports its changes to owner from now on
+    if hasattr(obj, "_owner"):
+        obj._owner = owner
+    return obj
+
+def _intern(value):
+    # names, states etc. repeat a lot, share the strings
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
 class Pattern:
     '''
     A list of molecules
     '''
+    __slots__ = ("_compartment", "_label", "molecules", "_owner",
+                 "_str_cache", "_canon_cache", "_graph_cache", "_hash_cache")
+
     def __init__(self, pattern_xml):
-        self._bonds = Bonds()
+        self._owner = None
+        self._graph_cache = None
         self._compartment = None
         self._label = None
+        self._str_cache = None
+        self._canon_cache = None
+        self._hash_cache = None
         self.molecules = []
         # sets self.molecules up 
         self._parse_xml(pattern_xml)
 
+    def _touch(self):
+        self._str_cache = None
+        self._canon_cache = None
+        self._graph_cache = None
+        self._hash_cache = None
+        if self._owner is not None:
+            self._owner._touch()
+
+    @property
+    def canonical(self):
+        '''
+        Canonical string of the pattern, the same for any 
+        molecule order or bond numbering of the same complex
+        '''
+        if self._canon_cache is None:
+            self._canon_cache = canonical_string(self)
+        return self._canon_cache
+
+    @property
+    def bond_graph(self):
+        '''
+        Array backed connectivity of the pattern, 
+        see BondGraph
+        '''
+        if self._graph_cache is None:
+            self._graph_cache = BondGraph(self.molecules)
+        return self._graph_cache
+
+    def __eq__(self, other):
+        if not isinstance(other, Pattern):
+            return NotImplemented
+        if self is other:
+            return True
+        if hash(self) != hash(other):
+            return False
+        # the same string is the same complex, otherwise
+        # it takes the canonical forms to tell
+        if str(self) == str(other):
+            return True
+        return self.canonical == other.canonical
+
+    def __ne__(self, other):
+        if not isinstance(other, Pattern):
+            return NotImplemented
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        # hashing doesn't need the canonical form, that is only
+        # worked out when two patterns with the same hash meet
+        if self._hash_cache is None:
+            self._hash_cache = hash(pattern_invariant(self))
+        return self._hash_cache
+
     @property
     def compartment(self):
         return self._compartment 
@@ -20,7 +105,8 @@ class Pattern:
         # TODO: Build in logic to set the 
         # outer compartment
         # print("Warning: Logical checks are not complete")
-        self._compartment = value
+        self._compartment = _intern(value)
+        self._touch()
         # by default, once the outer compartment is set
         # we will set the compartment of each molecule
         # to that new compartment. 
@@ -36,19 +122,25 @@ class Pattern:
         # TODO: Build in logic to set 
         # the outer label
         # print("Warning: Logical checks are not complete")
-        self._label = value
+        self._label = _intern(value)
+        self._touch()
 
     def __str__(self):
-        sstr = ""
+        if self._str_cache is None:
+            self._str_cache = self._render()
+        return self._str_cache
+
+    def _render(self):
+        parts = []
         for imol, mol in enumerate(self.molecules):
             if imol == 0 and self.compartment is not None:
-                sstr += "@{}:".format(self.compartment)
+                parts.append("@{}:".format(self.compartment))
             if imol == 0 and self.label is not None:
-                sstr += "%{}:".format(self.label)
+                parts.append("%{}:".format(self.label))
             if imol > 0:
-                sstr += "."
-            sstr += str(mol)
-        return sstr
+                parts.append(".")
+            parts.append(str(mol))
+        return "".join(parts)
 
     def __repr__(self):
         return str(self)
@@ -66,20 +158,22 @@ class Pattern:
             self.compartment = xml['@compartment']
         if "@label" in xml:
             self.label = xml["@label"]
+        # XML id -> bond lookup, only needed while parsing
+        bonds = Bonds()
         if "ListOfBonds" in xml:
-            self._bonds.set_xml(xml["ListOfBonds"]["Bond"])
+            bonds.set_xml(xml["ListOfBonds"]["Bond"])
         mols = xml['ListOfMolecules']['Molecule']
         if isinstance(mols, list):
             # list of molecules
             for imol, mol in enumerate(mols):
-                mol_obj = self._process_mol(mol)
-                self.molecules.append(mol_obj)
+                mol_obj = self._process_mol(mol, bonds)
+                self.molecules.append(_adopt(self, mol_obj))
         else:
             # a single molecule
-            mol_obj = self._process_mol(mols)
-            self.molecules.append(mol_obj)
+            mol_obj = self._process_mol(mols, bonds)
+            self.molecules.append(_adopt(self, mol_obj))
 
-    def _process_mol(self, mol_xml):
+    def _process_mol(self, mol_xml, bonds):
         # we are going to store molecules, components
         # and compartments in a separate dictionary 
         # for use later
@@ -89,12 +183,12 @@ class Pattern:
             mol_obj.label = mol_xml["@label"]
         if "ListOfComponents" in mol_xml:
             # Single molecule can't have bonds
-            mol_obj.components = self._process_comp(mol_xml["ListOfComponents"]["Component"])
+            mol_obj.components = self._process_comp(mol_xml["ListOfComponents"]["Component"], bonds)
         if '@compartment' in mol_xml:
             mol_obj.compartment = mol_xml['@compartment']
         return mol_obj
 
-    def _process_comp(self, comp_xml):
+    def _process_comp(self, comp_xml, bonds):
         # bonds = compartment id, bond id 
         # comp xml can be a list or a dict
         comp_list = []
@@ -108,7 +202,7 @@ class Pattern:
                 if "@state" in comp:
                     comp_obj.state = comp['@state']
                 if comp["@numberOfBonds"] != '0':
-                    bond_id = self._bonds.get_bond_id(comp)
+                    bond_id = bonds.get_bond_id(comp)
                     for bi in bond_id:
                         comp_obj.bonds.append(bi)
                 comp_list.append(comp_obj)
@@ -121,18 +215,28 @@ class Pattern:
             if "@state" in comp_xml:
                 comp_obj.state = comp_xml['@state']
             if comp_xml['@numberOfBonds'] != '0':
-                bond_id = self._bonds.get_bond_id(comp_xml)
+                bond_id = bonds.get_bond_id(comp_xml)
                 for bi in bond_id:
                     comp_obj.bonds.append(bi)
             comp_list.append(comp_obj)
         return comp_list
 
 class Molecule:
+    __slots__ = ("_name", "_components", "_compartment", "_label", 
+                 "_owner", "_str_cache")
+
     def __init__(self):
         self._name = "0"
         self._components = []
         self._compartment = None
         self._label = None
+        self._owner = None
+        self._str_cache = None
+
+    def _touch(self):
+        self._str_cache = None
+        if self._owner is not None:
+            self._owner._touch()
 
     def __getitem__(self, key):
         if isinstance(key, int):
@@ -144,19 +248,21 @@ class Molecule:
     # TODO: implement __setitem__,  __contains__
 
     def __str__(self):
-        mol_str = self.name
+        if self._str_cache is None:
+            self._str_cache = self._render()
+        return self._str_cache
+
+    def _render(self):
+        parts = [self.name]
         if self.label is not None:
-            mol_str += "%{}".format(self.label)
+            parts.append("%{}".format(self.label))
         if len(self.components) > 0:
-            mol_str += "("
-            for icomp, comp in enumerate(self.components):
-                if icomp > 0:
-                    mol_str += ","
-                mol_str += str(comp)
-            mol_str += ")"
+            parts.append("(")
+            parts.append(",".join([str(comp) for comp in self.components]))
+            parts.append(")")
         if self.compartment is not None:
-            mol_str += "@{}".format(self.compartment)
-        return mol_str
+            parts.append("@{}".format(self.compartment))
+        return "".join(parts)
     
     ### PROPERTIES ### 
     @property
@@ -167,7 +273,8 @@ class Molecule:
     def name(self, value):
         # print("Warning: Logical checks are not complete")
         # TODO: Check for invalid characters
-        self._name = value
+        self._name = _intern(value)
+        self._touch()
 
     @property
     def components(self):
@@ -177,6 +284,9 @@ class Molecule:
     def components(self, value):
         # print("Warning: Logical checks are not complete")
         self._components = value
+        for comp in value:
+            _adopt(self, comp)
+        self._touch()
 
     def __repr__(self):
         return str(self)
@@ -188,7 +298,8 @@ class Molecule:
     @compartment.setter
     def compartment(self, value):
         # print("Warning: Logical checks are not complete")
-        self._compartment = value
+        self._compartment = _intern(value)
+        self._touch()
 
     @property
     def label(self):
@@ -197,14 +308,16 @@ class Molecule:
     @label.setter
     def label(self, value):
         # print("Warning: Logical checks are not complete")
-        self._label = value
+        self._label = _intern(value)
+        self._touch()
 
     def _add_component(self, name, state=None, states=[]):
         comp_obj = Component()
         comp_obj.name = name
         comp_obj.state = state
         comp_obj.states = states
-        self.components.append(comp_obj)
+        self.components.append(_adopt(self, comp_obj))
+        self._touch()
 
     def add_component(self, name, state=None, states=[]):
         # TODO: Add built-in logic here
@@ -212,31 +325,44 @@ class Molecule:
         self._add_component(name, state, states)
 
 class Component:
+    __slots__ = ("_name", "_label", "_state", "_states", "_bonds", 
+                 "_owner", "_str_cache")
+
     def __init__(self):
         self._name = ""
         self._label = None
         self._state = None
         self._states = []
         self._bonds = []
+        self._owner = None
+        self._str_cache = None
+
+    def _touch(self):
+        self._str_cache = None
+        if self._owner is not None:
+            self._owner._touch()
 
     def __repr__(self):
         return str(self)
 
     def __str__(self):
-        comp_str = self.name
+        if self._str_cache is None:
+            self._str_cache = self._render()
+        return self._str_cache
+
+    def _render(self):
+        parts = [self.name]
         # only for moltypes
-        if len(self.states) > 0:
-            for istate, state in enumerate(self.states):
-                comp_str += "~{}".format(state)
+        for state in self.states:
+            parts.append("~{}".format(state))
         # for any other pattern
         if self.state is not None:
-            comp_str += "~{}".format(self.state)
+            parts.append("~{}".format(self.state))
         if self.label is not None:
-            comp_str += "%{}".format(self.label)
-        if len(self.bonds) > 0:
-            for bond in self.bonds:
-                comp_str += "!{}".format(bond)
-        return comp_str
+            parts.append("%{}".format(self.label))
+        for bond in self.bonds:
+            parts.append("!{}".format(bond))
+        return "".join(parts)
 
     ### PROPERTIES ### 
     @property
@@ -247,7 +373,8 @@ class Component:
     def name(self, value):
         # TODO: Add built-in logic here
         # print("Warning: Logical checks are not complete")
-        self._name = value
+        self._name = _intern(value)
+        self._touch()
 
     @property
     def label(self):
@@ -257,7 +384,8 @@ class Component:
     def label(self, value):
         # TODO: Add built-in logic here
         # print("Warning: Logical checks are not complete")
-        self._label = value
+        self._label = _intern(value)
+        self._touch()
 
     @property
     def state(self):
@@ -267,7 +395,8 @@ class Component:
     def state(self, value):
         # TODO: Add built-in logic here
         # print("Warning: Logical checks are not complete")
-        self._state = value
+        self._state = _intern(value)
+        self._touch()
 
     @property
     def states(self):
@@ -278,6 +407,7 @@ class Component:
         # TODO: Add built-in logic here
         # print("Warning: Logical checks are not complete")
         self._states = value
+        self._touch()
 
     @property
     def bonds(self):
@@ -288,6 +418,7 @@ class Component:
         # TODO: Add built-in logic here
         # print("Warning: Logical checks are not complete")
         self._bonds = value
+        self._touch()
 
     def _add_state(self):
         raise NotImplemented
@@ -302,6 +433,93 @@ class Component:
         self._add_bond()
 
 ###### BONDS #####
+class BondGraph:
+    '''
+    Connectivity of a pattern as flat integer arrays. Components
+    are numbered in order over all molecules, the components of
+    molecule i are mol_ptr[i]:mol_ptr[i+1] and comp_mol maps a
+    component back to its molecule. The bond partners of
+    component c are adj_idx[adj_ptr[c]:adj_ptr[c+1]] (CSR).
+    Wildcard bonds (+/?) have no partner and aren't in here.
+    '''
+    __slots__ = ("mol_ptr", "comp_mol", "adj_ptr", "adj_idx")
+
+    def __init__(self, molecules):
+        self.mol_ptr = array("i", [0])
+        self.comp_mol = array("i")
+        # bond number -> the components it connects
+        bond_ends = {}
+        ic = 0
+        for imol, mol in enumerate(molecules):
+            for comp in mol.components:
+                for bond in comp.bonds:
+                    if str(bond) not in ("+", "?"):
+                        bond_ends.setdefault(bond, []).append(ic)
+                self.comp_mol.append(imol)
+                ic += 1
+            self.mol_ptr.append(ic)
+        # count then fill
+        degree = [0]*ic
+        for ends in bond_ends.values():
+            if len(ends) == 2:
+                degree[ends[0]] += 1
+                degree[ends[1]] += 1
+        self.adj_ptr = array("i", [0])
+        for d in degree:
+            self.adj_ptr.append(self.adj_ptr[-1] + d)
+        self.adj_idx = array("i", [0])*self.adj_ptr[-1]
+        fill = array("i", self.adj_ptr[:-1])
+        for ends in bond_ends.values():
+            if len(ends) == 2:
+                c1, c2 = ends
+                self.adj_idx[fill[c1]] = c2
+                fill[c1] += 1
+                self.adj_idx[fill[c2]] = c1
+                fill[c2] += 1
+
+    @property
+    def num_molecules(self):
+        return len(self.mol_ptr) - 1
+
+    @property
+    def num_components(self):
+        return len(self.comp_mol)
+
+    def components(self, imol):
+        return range(self.mol_ptr[imol], self.mol_ptr[imol+1])
+
+    def partners(self, icomp):
+        return self.adj_idx[self.adj_ptr[icomp]:self.adj_ptr[icomp+1]]
+
+    def bonded_molecules(self, imol):
+        '''
+        indices of the molecules bonded to molecule imol
+        '''
+        mols = []
+        for ic in self.components(imol):
+            for pc in self.partners(ic):
+                pm = self.comp_mol[pc]
+                if pm not in mols:
+                    mols.append(pm)
+        return mols
+
+    def is_connected(self):
+        nmol = self.num_molecules
+        if nmol == 0:
+            return True
+        seen = bytearray(nmol)
+        seen[0] = 1
+        stack = [0]
+        count = 1
+        while len(stack) > 0:
+            imol = stack.pop()
+            for pm in self.bonded_molecules(imol):
+                if not seen[pm]:
+                    seen[pm] = 1
+                    count += 1
+                    stack.append(pm)
+        return count == nmol
+
 class Bonds:
     def __init__(self, bonds_xml=None):
         self.bonds_dict = {}
@@ -353,7 +571,7 @@ class Bonds:
                 if bond_partner_1 not in self.bonds_dict:
                     self.bonds_dict[bond_partner_1] = [ibond+1]
                 else:
-                    self.bonds_dict[bond_partner_1].append([ibond+1])
+                    self.bonds_dict[bond_partner_1].append(ibond+1)
                 if bond_partner_2 not in self.bonds_dict:
                     self.bonds_dict[bond_partner_2] = [ibond+1]
                 else:
@@ -1,17 +1,50 @@
-import os, sys, subprocess, h5py, pickle
-from multiprocessing import Pool
-from shutil import copyfile
+import os
 
 import numpy as np
 
 class BNGResult:
-    def __init__(self, bngl=None):
+    def __init__(self, bngl=None, path=None, outputs=None):
         self.name = "BNGResult"
+        # seed the simulation ran with, if known
+        self.seed = None
+        # folder the results are in, defaults to the folder
+        # of the bngl or the current folder
+        if path is None:
+            if bngl is not None:
+                path = os.path.dirname(os.path.abspath(bngl))
+            else:
+                path = os.getcwd()
+        self.path = os.path.abspath(path)
         if bngl is not None:
             self.bngl = self.load_bngl(bngl)
         # find and set existing files, load if it's a dat file
-        self._find_existing_files()
+        if outputs is None:
+            self._find_existing_files()
+        else:
+            self._find_existing_files(extensions=outputs)
     
+    @classmethod
+    def from_arrays(cls, arrays, path=None):
+        '''
+        Builds a result from arrays in memory instead of files.
+        arrays maps extensions (gdat, cdat) to record arrays or
+        (column names, 2D array) pairs
+        '''
+        result = cls.__new__(cls)
+        result.name = "BNGResult"
+        result.seed = None
+        result.path = None if path is None else os.path.abspath(path)
+        for ext, value in arrays.items():
+            if isinstance(value, tuple):
+                names, data = value
+                data = np.atleast_2d(data)
+                value = np.empty(data.shape[0], dtype={'names': names, 'formats': ["f8"]*len(names)})
+                for icol, name in enumerate(names):
+                    value[name] = data[:,icol]
+                value = np.rec.array(value)
+            setattr(result, ext, value)
+        return result
+
     def set_name(self, name):
         self.name = name
         
@@ -20,10 +53,30 @@ class BNGResult:
             f = open(bngl)
             l = f.readlines()
             f.close()
-            return np.string_("".join(l))
+            return np.bytes_("".join(l))
         else:
-            return np.string_("")
+            return np.bytes_("")
     
+    def compute_observables(self, observables, net=None, cdat=None):
+        '''
+        Computes observables from the species concentrations
+        without re-running the simulation. observables is an
+        Observables block (e.g. model.observables), net and cdat
+        default to the loaded .net and .cdat files.
+
+        Returns a record array laid out like a gdat
+        '''
+        from BNGSim.matching import ObservableMatrix
+        if net is None:
+            net = getattr(self, "net", None)
+        if cdat is None:
+            cdat = getattr(self, "cdat", None)
+        if net is None or cdat is None:
+            raise ValueError("Need both the .net and .cdat files to compute observables")
+        if isinstance(net, dict) or isinstance(cdat, dict):
+            raise ValueError("Multiple .net/.cdat files are loaded, pass the ones to use")
+        return ObservableMatrix.from_net(observables, net).apply(cdat)
+
     def _find_existing_files(self, extensions=["gdat", "cdat", "net"]):
         '''
         Searches through the extensions we want and loads them in 
@@ -36,16 +89,16 @@ class BNGResult:
         # Magical trick to pull a particular extension file from the current path
         for ext in extensions:
             print("Finding and loading .{} file".format(ext))
-            dat_files = list(filter(lambda x: x.endswith("." + ext), os.listdir(os.getcwd())))
+            dat_files = list(filter(lambda x: x.endswith("." + ext), os.listdir(self.path)))
             if len(dat_files) == 0:
                 print("Can't find any .{} files".format(ext))
             elif len(dat_files) == 1:
-                setattr(self, ext, self._load_file(dat_files[0], ext=ext))
+                setattr(self, ext, self._load_file(os.path.join(self.path, dat_files[0]), ext=ext))
             else:
                 print("There are multiple .{} files, loading all".format(ext))
                 attr = {}
                 for dat_file in dat_files:
-                    attr[dat_file] = self._load_file(dat_file, ext=ext)
+                    attr[dat_file] = self._load_file(os.path.join(self.path, dat_file), ext=ext)
                 setattr(self, ext, attr)
         print("Loaded results files")
 
@@ -1,21 +1,20 @@
-import os, h5py, sys
+import os, sys, shutil, subprocess, tempfile, asyncio, random
 sys.setrecursionlimit(2000)
 from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 
-from BNGSim import BNGWorker
-from BNGSim import BNGModel
-from BNGSim.utils import find_BNG_path
-
-def _call_into_simulator(simulator):
-    res = simulator.run()
-    return res
+from BNGSim.worker import BNGWorker, BNGJob, run_job, run_network_methods, _model_text
+from BNGSim.model import BNGModel
+from BNGSim.structs import Actions
+from BNGSim.utils import find_BNG_path, find_run_network
+from BNGSim.cache import NetCache, get_net_cache, network_key
 
 class BNGSimulator:
     """
     A simple front-end for running BNG simulations
     """
-    def __init__(self, bngl, path=None, bngexec=None, nsims=1, ncores=1, outname='output.h5', combined=False):
+    def __init__(self, bngl, path=None, bngexec=None, nsims=1, ncores=1, outname='output.h5', combined=False, net_cache=True, executor="process", chunksize=1, seed=None, outputs=None, backend="bng2"):
         # find BNG2.pl and path 
         self.BNGPATH, self.bngexec = find_BNG_path(bngexec)
         # Let's load in the model first
@@ -26,58 +25,416 @@ class BNGSimulator:
         # setup our path variable
         # none means we'll run under temp folders
         self.path = path
-        # but we want to come back to save output 
-        self.cur_dir = os.getcwd()
         # How many cores will we use?
         self.ncores = ncores
+        # "process" runs workers in a multiprocessing pool, 
+        # "thread" in a thread pool. Workers never change the
+        # working directory so threads are safe, the work
+        # happens in BNG2.pl child processes anyway
+        self.executor = executor
+        # tasks handed to a pool process at once
+        self.chunksize = chunksize
+        # job i runs with seed+i if a seed is given, jobs are
+        # numbered over all runs of the simulator
+        self.seed = seed
+        self._job_count = 0
+        # result file extensions to load, None loads all
+        self.outputs = outputs
+        # "bng2" runs every simulation through BNG2.pl, 
+        # "run_network" calls the run_network binary on the 
+        # generated network directly and "roadrunner" runs
+        # ODE simulations of it in-process with libroadrunner
+        self.backend = backend
+        self._pool = None
+        self._pool_spec = None
         # Initialize results
         self.results = []
         # other misc parameters
         self.nsims = nsims
         self.outname = outname
         self.combined = combined
+        # True uses the shared on-disk network cache, a NetCache
+        # instance uses that cache and False/None disables caching
+        if net_cache is True:
+            net_cache = get_net_cache()
+        elif not isinstance(net_cache, NetCache):
+            net_cache = None
+        self.net_cache = net_cache
+        # generated network and the model version it belongs to
+        self._net_key = None
+        self._net_file = None
+        self._network = None
+        self._obs_matrix = None
+
+    def _network_jobs(self):
+        # jobs for the backends that simulate the generated
+        # network directly instead of through BNG2.pl
+        if self._network is None:
+            raise ValueError("The {} backend needs a generate_network action".format(self.backend))
+        net_file = self._network[0]
+        run_args = self._simulate_args()
+        options = {"run_args": run_args, "backend": self.backend}
+        if self.backend == "roadrunner":
+            if run_args["method"] != "ode":
+                raise ValueError("The roadrunner backend only runs ODE simulations")
+            sbml_file = self.write_sbml()
+            if sbml_file is None:
+                raise ValueError("Can't export the network to SBML")
+            options["sbml_file"] = sbml_file
+            options["values"] = self._roadrunner_values(net_file)
+            options["observables"] = self._observable_matrix(net_file)
+        else:
+            if run_args["method"] not in run_network_methods:
+                raise ValueError("run_network can't run method {}".format(run_args["method"]))
+            # run_network always starts at time 0
+            if float(run_args["t_start"]) != 0:
+                raise ValueError("The run_network backend needs t_start to be 0")
+            run_network = find_run_network(self.BNGPATH)
+            if run_network is None:
+                raise ValueError("Can't find run_network under {}".format(self.BNGPATH))
+            options["run_network"] = run_network
+            # the edits since the network was generated go
+            # straight into a copy of the .net file
+            edits = self.model.network_edits(net_file)
+            if len(edits) > 0:
+                from BNGSim.matching import apply_net_edits
+                edited = os.path.join(os.path.dirname(net_file), self.model.model_name + "_edited.net")
+                net_file = apply_net_edits(net_file, edits, edited)
+        indices = self._job_indices()
+        # every replicate gets its own, recorded, seed
+        seed = self.seed
+        if seed is None:
+            seed = random.randrange(1, 2**31 - self._job_count)
+        jobs = []
+        for i in indices:
+            name = self._job_name(i)
+            path = None
+            if self.path is not None:
+                path = os.path.join(self.path, name)
+            jobs.append(BNGJob(self.model.model_name, self.bngexec, "", net_file=net_file,
+                               path=path, seed=seed + i, outputs=self.outputs, name=name,
+                               **options))
+        return jobs
+
+    def _simulate_args(self):
+        actions = self.model.actions
+        for action_type in ["simulate", "simulate_ode", "simulate_ssa", "simulate_pla"]:
+            if action_type in actions:
+                break
+        else:
+            raise ValueError("The {} backend needs a simulate action".format(self.backend))
+        args = dict(actions[action_type])
+        if action_type == "simulate":
+            method = str(args.get("method", "ode")).strip("\"")
+        else:
+            method = action_type.replace("simulate_", "")
+        run_args = {"method": method, "t_start": args.get("t_start", 0),
+                    "t_end": args["t_end"], "n_steps": args.get("n_steps", 1)}
+        for tol in ["atol", "rtol"]:
+            if tol in args:
+                run_args[tol] = args[tol]
+        return run_args
+
+    def write_sbml(self):
+        '''
+        Exports the generated network to SBML with the writeSBML
+        action, once per network. Returns the path to the SBML 
+        file, None if there's no network or the export failed
+        '''
+        if self._network is None:
+            return None
+        net_folder, net_name = os.path.split(self._network[0])
+        name = os.path.splitext(net_name)[0] + "_sbml"
+        sbml_file = os.path.join(net_folder, name + ".xml")
+        if os.path.isfile(sbml_file):
+            return sbml_file
+        actions = Actions()
+        actions.add_action("readFile", [("file", net_name)])
+        actions.add_action("writeSBML", [])
+        model_file = os.path.join(net_folder, name + ".bngl")
+        with open(model_file, "w") as f:
+            actions.write_to(f)
+        print("Writing SBML")
+        rc = subprocess.run(["perl", self.bngexec, model_file], cwd=net_folder)
+        if rc.returncode != 0 or not os.path.isfile(sbml_file):
+            print("SBML export failed")
+            return None
+        return sbml_file
+
+    def _roadrunner_values(self, net_file):
+        # the edits since the network was generated as 
+        # RoadRunner ids -> values, parameters keep their 
+        # names and species are S1, S2... in network order
+        from BNGSim.matching import read_net_species
+        from BNGSim.bnglparser import parse_pattern_string
+        from BNGSim.xmlparsers import SpeciesXML
+        from BNGSim.expressions import compile_expression, _is_number
+        values = {}
+        scope = None
+        species = None
+        for action_type, (name, value) in self.model.network_edits(net_file):
+            if not _is_number(value):
+                if scope is None:
+                    scope = self.model.parameters.evaluate()
+                value = compile_expression(str(value))[0](scope)
+            if action_type == "setParameter":
+                values[name] = float(value)
+            else:
+                if species is None:
+                    species = read_net_species(net_file)
+                ispec = species.index(SpeciesXML(parse_pattern_string(name)))
+                values["init([S{}])".format(ispec+1)] = float(value)
+        return values
+
+    def _observable_matrix(self, net_file):
+        # the observables of the network, kept as long as the
+        # network is the same
+        if "observables" not in self.model.active_blocks:
+            return None
+        if self._obs_matrix is None or self._obs_matrix[0] != net_file:
+            from BNGSim.matching import ObservableMatrix
+            self._obs_matrix = (net_file, ObservableMatrix.from_net(self.model.observables, net_file))
+        return self._obs_matrix[1]
+
+    def _setup_jobs(self):
+        '''
+        One BNGJob per simulation. Jobs only carry the model 
+        text (or the path to the generated network) and the 
+        actions, the model text is rendered once and shared
+        '''
+        if self.backend in ("run_network", "roadrunner"):
+            return self._network_jobs()
+        if self._network is None:
+            net_file = None
+            model_text = _model_text(self.model)
+            actions = self.model.actions if "actions" in self.model.active_blocks else Actions()
+        else:
+            net_file, actions = self._network
+            model_text = None
+        actions_text = str(actions)
+        jobs = []
+        for i in self._job_indices():
+            name = self._job_name(i)
+            path = None
+            if self.path is not None:
+                # one folder per job so they don't overwrite
+                # each others output
+                path = os.path.join(self.path, name)
+            seed = None
+            job_actions = actions_text
+            if self.seed is not None:
+                seed = self.seed + i
+                job_actions = str(actions.with_seed(seed))
+            jobs.append(BNGJob(self.model.model_name, self.bngexec, job_actions,
+                               model_text=model_text, net_file=net_file, path=path,
+                               seed=seed, outputs=self.outputs, name=name))
+        return jobs
+
+    def _job_indices(self):
+        # indices of the next nsims jobs, they never repeat so 
+        # names, folders and seeds stay unique over repeated 
+        # runs, failed ones included
+        indices = range(self._job_count, self._job_count + self.nsims)
+        self._job_count += self.nsims
+        return indices
+
+    def _job_name(self, i):
+        # results keep the name of the job they came from
+        return "simulation_{:08d}".format(i)
 
     def _setup_workers(self):
         '''
-        Setting up a list of simulator instances to run. Each instance knows it's own 
-        path to run the simulations so the simulators are entirely independent.
+        Setting up a list of workers to run. Each worker knows it's own 
+        path to run the simulations so they are entirely independent.
         '''
-        if self.path is None:
-            workers = [BNGWorker(self, self.path) for i in range(self.nsims)]
-        return workers 
+        self.jobs = self._setup_jobs()
+        return [BNGWorker(job=job) for job in self.jobs]
 
     def get_model(self):
         return self.model
 
-    def run_simulation(self, nsims=1):
+    ###### NETWORK ######
+    # The reaction network is generated once per structural 
+    # version of the model, workers get the .net file and only
+    # read it in and simulate
+    def generate_network(self):
+        '''
+        Runs generate_network for the current model unless the 
+        network of this version of the model exists already, 
+        either here or in the network cache. Returns the path 
+        to the .net file, None if the model actions don't 
+        generate a network or generation failed
+        '''
+        model = self.model
+        if not hasattr(model, "actions") or "generate_network" not in model.actions:
+            return None
+        key = network_key(model, self.bngexec)
+        if self._net_key == key and os.path.isfile(self._net_file):
+            return self._net_file
+        net_folder = tempfile.mkdtemp(prefix="BNGSim_net_")
+        net_file = os.path.join(net_folder, model.model_name + ".net")
+        if self.net_cache is not None and self.net_cache.copy_to(key, net_file) is not None:
+            print("Using cached network")
+        else:
+            model_file = os.path.join(net_folder, model.model_name + ".bngl")
+            actions = Actions()
+            actions.add_action("generate_network", [("overwrite",1)] + model.actions.generate_options())
+            with open(model_file, "w") as f:
+                model.write_to(f, actions=False)
+                actions.write_to(f)
+            print("Generating network")
+            rc = subprocess.run(["perl", self.bngexec, model_file], cwd=net_folder)
+            if rc.returncode != 0 or not os.path.isfile(net_file):
+                print("Network generation failed")
+                shutil.rmtree(net_folder, ignore_errors=True)
+                return None
+            if self.net_cache is not None:
+                self.net_cache.put(key, net_file)
+        # the network of the previous version isn't needed anymore
+        if self._net_file is not None:
+            shutil.rmtree(os.path.dirname(self._net_file), ignore_errors=True)
+        self._net_key, self._net_file = key, net_file
+        return net_file
+
+    def get_network(self):
+        '''
+        (.net file, actions to run on it) if the workers can 
+        start from the generated network, None otherwise
+        '''
+        return self._network
+
+    def _prepare_network(self):
+        self._network = None
+        net_file = self.generate_network()
+        if net_file is None:
+            return
+        # parameter and concentration edits since the network
+        # was generated become actions run after readFile
+        actions = self.model.network_actions(net_file)
+        self._network = (net_file, actions)
+    ###### NETWORK ######
+
+    ###### EXECUTION ######
+    # The pool is created on first use and kept until close(),
+    # use the simulator as a context manager to have it closed
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        # the pool can't be pickled
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        state["_pool_spec"] = None
+        return state
+
+    def _get_pool(self):
+        spec = (self.executor, self.ncores)
+        if self._pool is not None and self._pool_spec != spec:
+            # executor or core count changed since
+            self.close()
+        if self._pool is None:
+            if self.executor == "thread":
+                print("starting {} threads".format(self.ncores))
+                self._pool = ThreadPoolExecutor(max_workers=self.ncores)
+            else:
+                print("starting {} processes".format(self.ncores))
+                self._pool = Pool(self.ncores)
+            self._pool_spec = spec
+        return self._pool
+
+    def close(self):
+        '''
+        shuts down the worker pool
+        '''
+        if self._pool is None:
+            return
+        if isinstance(self._pool, ThreadPoolExecutor):
+            self._pool.shutdown(wait=True)
+        else:
+            self._pool.close()
+            self._pool.join()
+        self._pool = None
+        self._pool_spec = None
+
+    def iter_simulation(self):
+        '''
+        Runs the simulations and yields each result as soon
+        as it is done, not necessarily in submission order
+        '''
+        # network generation happens once, here
+        self._prepare_network()
         # let's get our workers ready
         self.workers = self._setup_workers()
-
         if self.ncores == 1:
-            for worker in self.workers:
-                result = worker.run()
+            finished = (worker.run() for worker in self.workers)
+        elif self.executor == "thread":
+            pool = self._get_pool()
+            futures = [pool.submit(worker.run) for worker in self.workers]
+            finished = (future.result() for future in as_completed(futures))
+        else:
+            pool = self._get_pool()
+            # only the jobs are sent to the processes
+            finished = pool.imap_unordered(run_job, self.jobs, self.chunksize)
+        for result in finished:
+            if result is not None:
+                self.results.append(result)
+                yield result
+
+    def run_simulation(self, nsims=1):
+        for _ in self.iter_simulation():
+            pass
+    ###### EXECUTION ######
+
+    async def iter_results(self):
+        '''
+        Async iterator running the simulations with at most
+        ncores BNG2.pl processes at a time, yields each result
+        as soon as it is done (not in submission order)
+
+            async for result in sim.iter_results():
+                ...
+        '''
+        loop = asyncio.get_running_loop()
+        # network generation blocks, keep it off the loop
+        await loop.run_in_executor(None, self._prepare_network)
+        self.workers = self._setup_workers()
+        semaphore = asyncio.Semaphore(self.ncores)
+
+        async def run_worker(worker):
+            async with semaphore:
+                return await worker.run_async()
+
+        tasks = [asyncio.ensure_future(run_worker(worker)) for worker in self.workers]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
                 if result is not None:
-                    result.set_name("simulation_{:08d}".format(len(self.results)))
                     self.results.append(result)
-        elif self.ncores > nsims:
-            print("running parallel with {} cores".format(self.ncores))
-            p = Pool(nsims)
-            para_res = p.map(_call_into_simulator, self.workers)
-            for res in para_res:
-                res.set_name("simulation_{:08d}".format(len(self.results)))
-                self.results.append(res)
-        else:
-            print("running parallel with {} cores".format(self.ncores))
-            p = Pool(self.ncores)
-            para_res = p.map(_call_into_simulator, self.workers)
-            for res in para_res:
-                res.set_name("simulation_{:08d}".format(len(self.results)))
-                self.results.append(res)
-    
+                    yield result
+        finally:
+            # the consumer stopped early, the workers kill their
+            # processes when cancelled, wait for that
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run_async(self):
+        '''
+        async version of run, returns the results
+        '''
+        async for _ in self.iter_results():
+            pass
+        return self.results
+
     def save_results(self, fname="results.h5", combined=False):
         """
         Saves results in an hdf5 file
         """
+        # h5py is slow to import, only pull it in when saving
+        import h5py
         dt = h5py.special_dtype(vlen=str)
         with h5py.File(fname, "w") as h:
             for result in self.results:
@@ -153,9 +510,6 @@ class BNGSimulator:
         '''
         # run simulations
         self.run_simulation(nsims=self.nsims)
-        # Save results
-        if self.path is None:
-            os.chdir(self.cur_dir)
         # if self.combined:
         #     self.combine_results()
         #     self.save_results(self.outname, combined=True)
@@ -1,11 +1,21 @@
 from collections import OrderedDict
 from BNGSim.xmlparsers import ObsXML, MolTypeXML, RuleXML, FuncXML, SpeciesXML
+from BNGSim.pattern import _adopt
+from BNGSim.bnglparser import parse_pattern_string
 
 ###### MODEL STRUCTURES ###### 
 # Objects in the model
 class ModelBlock:
     def __init__(self):
         self._item_dict = OrderedDict()
+        # rendered string of the block, anything that changes 
+        # the block has to call _invalidate
+        self._rendered = None
+        # ordered key list for integer indexing and string -> key
+        # index for blocks keyed by pattern objects, kept up to 
+        # date by _key_added/_keys_removed
+        self._key_list = None
+        self._key_index = None
 
     def __len__(self):
         return len(self._item_dict)
@@ -16,18 +26,85 @@ class ModelBlock:
         # say ipython
         return str(self._item_dict)
 
+    def __str__(self):
+        if self._rendered is None:
+            self._rendered = self._render()
+        return self._rendered
+
+    def _render(self):
+        return "\n".join(self._iter_lines())
+
+    def _iter_lines(self):
+        # blocks yield their lines one by one so they can
+        # be streamed straight to a file, see write_to
+        yield repr(self)
+
+    def write_to(self, f):
+        '''
+        writes the block to an open file, line by line
+        unless there is an up-to-date rendering already
+        '''
+        if self._rendered is not None:
+            f.write(self._rendered)
+            return
+        for iline, line in enumerate(self._iter_lines()):
+            if iline > 0:
+                f.write("\n")
+            f.write(line)
+
+    def _invalidate(self):
+        self._rendered = None
+
+    def _touch(self):
+        # a pattern object held by the block was changed through
+        # its setters, its string may be different now
+        self._invalidate()
+        self._key_index = None
+
+    def _keys(self):
+        if self._key_list is None:
+            self._key_list = list(self._item_dict.keys())
+        return self._key_list
+
+    def _lookup(self, key_str):
+        '''
+        the key that renders to key_str, None if there isn't one.
+        The index is rebuilt if a pattern changed since
+        '''
+        if self._key_index is None:
+            self._key_index = {}
+            for ikey in self._item_dict:
+                self._key_index[str(ikey)] = ikey
+        return self._key_index.get(key_str)
+
+    def _key_added(self, key):
+        # call after setting self._item_dict[key], the dict only 
+        # grew if the key is new
+        if self._key_list is not None and len(self._key_list) != len(self._item_dict):
+            self._key_list.append(key)
+        if self._key_index is not None:
+            self._key_index[str(key)] = key
+
+    def _keys_removed(self):
+        self._key_list = None
+        self._key_index = None
+
     def __getitem__(self, key):
         if isinstance(key, int):
             # get the item in order
-            return list(self._item_dict.keys())[key]
+            return self._keys()[key]
         return self._item_dict[key]
 
     def __setitem__(self, key, value):
-        self._item_dict[key] = value
+        self._item_dict[key] = _adopt(self, value)
+        self._key_added(key)
+        self._invalidate()
 
     def __delitem__(self, key):
         if key in self._item_dict:
             self._item_dict.pop(key)
+            self._keys_removed()
+            self._invalidate()
         else: 
             print("Item {} not found".format(key))
 
@@ -43,7 +120,9 @@ class ModelBlock:
         # to adjust the math
         # TODO: Error handling, some names will definitely break this
         name, value = item_tpl
-        self._item_dict[name] = value
+        self._item_dict[name] = _adopt(self, value)
+        self._key_added(name)
+        self._invalidate()
         try:
             setattr(self, name, value)
         except:
@@ -69,6 +148,15 @@ class Parameters(ModelBlock):
     def __init__(self):
         self.expressions = {}
         self.values = {}
+        # rendered line of each parameter, a change only 
+        # re-renders the line of that parameter
+        self._line_cache = {}
+        # free (non-expression) parameters in order and their
+        # index in the vector, see get_vector
+        self._free_names = None
+        self._free_index = None
+        # compiled expressions, built on first evaluate
+        self._graph = None
         super().__init__()
         self.name = "parameters"
 
@@ -76,47 +164,185 @@ class Parameters(ModelBlock):
         changed = False
         if hasattr(self, "_item_dict"):
             if name in self._item_dict.keys():
+                self._invalidate()
+                self._line_cache.pop(name, None)
                 try: 
                     new_value = float(value)
                     changed = True
                     self._item_dict[name] = new_value
                 except:
                     self._item_dict[name] = value
+                # a parameter can turn from free to derived 
+                # and back, the vector view follows
+                if changed:
+                    self.values[name] = new_value
+                    if self.expressions.pop(name, None) is not None:
+                        self._free_names = None
+                else:
+                    if name not in self.expressions:
+                        self._free_names = None
+                    self.expressions[name] = value
+                if self._graph is not None:
+                    if changed:
+                        self._graph.set_value(name, new_value)
+                    else:
+                        self._graph.set_expression(name, value)
         if changed:
             self.__dict__[name] = new_value
         else:
             self.__dict__[name] = value
 
-    def __str__(self):
-        # overwrites what the method returns when 
-        # it's converted to string
-        block_lines = ["\nbegin {}".format(self.name)]
+    def __setitem__(self, key, value):
+        # same path as setting the attribute so the rendered
+        # line, the vector view and the graph stay in sync
+        if key in self._item_dict:
+            setattr(self, key, value)
+        else:
+            self.add_item((key, value))
+
+    def _iter_lines(self):
+        # lines the block is written out as, 
+        # joined for str()
+        yield "\nbegin {}".format(self.name)
         for item in self._item_dict.keys():
-            block_lines.append("  " + "{} {}".format(item, self._item_dict[item]))
-        block_lines.append("end {}\n".format(self.name))
-        return "\n".join(block_lines)
+            line = self._line_cache.get(item)
+            if line is None:
+                line = "  " + "{} {}".format(item, self._item_dict[item])
+                self._line_cache[item] = line
+            yield line
+        yield "end {}\n".format(self.name)
 
     def add_item(self, item_tpl):
         name, value = item_tpl
         self._item_dict[name] = value
+        self._key_added(name)
+        self._line_cache.pop(name, None)
+        self._free_names = None
+        self._graph = None
+        self._invalidate()
         try:
             setattr(self, name, value)
         except:
             print("can't set {} to {}".format(name, value))
             pass
 
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._line_cache.pop(key, None)
+        self._free_names = None
+        self._graph = None
+
+    ### VECTOR VIEW ###
+    # free parameters as a float64 vector for optimizers etc.
+    # the order is the order of the block and is stable as 
+    # long as no parameters are added or removed
+    def _free(self):
+        if self._free_names is None:
+            self._free_names = [n for n in self._item_dict if n not in self.expressions]
+            self._free_index = {}
+            for i, n in enumerate(self._free_names):
+                self._free_index[n] = i
+        return self._free_names
+
+    @property
+    def free_names(self):
+        '''
+        names of the free parameters in vector order
+        '''
+        return list(self._free())
+
+    @property
+    def index(self):
+        '''
+        free parameter name -> index in the vector
+        '''
+        self._free()
+        return dict(self._free_index)
+
+    def get_vector(self):
+        '''
+        values of the free parameters as a float64 array
+        '''
+        import numpy as np
+        names = self._free()
+        return np.array([float(self._item_dict[n]) for n in names], dtype=np.float64)
+
+    def set_vector(self, arr):
+        '''
+        sets all free parameters from an array in the order of
+        get_vector, only the changed ones get re-rendered
+        '''
+        names = self._free()
+        if len(arr) != len(names):
+            raise ValueError("Expected {} values, got {}".format(len(names), len(arr)))
+        changed = False
+        for name, value in zip(names, arr):
+            value = float(value)
+            if float(self._item_dict[name]) == value:
+                continue
+            self._item_dict[name] = value
+            self.__dict__[name] = value
+            self.values[name] = value
+            self._line_cache.pop(name, None)
+            if self._graph is not None:
+                self._graph.set_value(name, value)
+            changed = True
+        if changed:
+            self._invalidate()
+    ### VECTOR VIEW ###
+
+    ### EVALUATION ###
+    def expression_graph(self):
+        '''
+        the parameters as a compiled ExpressionGraph, kept up
+        to date with changes made through the block
+        '''
+        if self._graph is None:
+            from BNGSim.expressions import ExpressionGraph
+            graph = ExpressionGraph()
+            for name, value in self._item_dict.items():
+                graph.set_expression(name, value)
+            self._graph = graph
+        return self._graph
+
+    def evaluate(self, name=None):
+        '''
+        value of a parameter, or of all parameters, with 
+        derived parameters evaluated. Only parameters that
+        depend on something changed since the last call are
+        recomputed
+        '''
+        return self.expression_graph().evaluate(name)
+
+    def evaluate_batch(self, batch):
+        '''
+        Evaluates all parameters for a batch of parameter sets.
+        batch is either a (N, len(free_names)) array in the
+        order of get_vector or a dict of name -> length N array.
+        Returns a dict of name -> length N array
+        '''
+        if not isinstance(batch, dict):
+            import numpy as np
+            batch = np.asarray(batch, dtype=np.float64)
+            names = self._free()
+            if batch.ndim != 2 or batch.shape[1] != len(names):
+                raise ValueError("Expected an (N, {}) array".format(len(names)))
+            batch = dict([(n, batch[:,i]) for i, n in enumerate(names)])
+        return self.expression_graph().evaluate_batch(batch)
+    ### EVALUATION ###
+
     def parse_xml_block(self, block_xml):
         # 
-        if isinstance(block_xml, list):
+        if not isinstance(block_xml, dict):
             for b in block_xml:
-                self.values[b['@id']] = b['@value']
+                self.values[b['@id']] = float(b['@value'])
                 if '@expr' in b:
                     self.expressions[b['@id']] = b['@expr']
                     self.add_item((b['@id'],b['@expr']))
                 else:
                     self.add_item((b['@id'],b['@value']))
         else:
-            self.values[block_xml['@id']] = block_xml['@value']
+            self.values[block_xml['@id']] = float(block_xml['@value'])
             if '@expr' in block_xml:
                 self.expressions[block_xml['@id']] = block_xml['@expr']
                 self.add_item((block_xml['@id'], block_xml['@expr']))
@@ -131,47 +357,84 @@ class Species(ModelBlock):
     def __init__(self):
         super().__init__()
         self.name = "species"
-
-    def __str__(self):
-        # overwrites what the method returns when 
-        # it's converted to string
-        block_lines = ["\nbegin {}".format(self.name)]
-        for item in self._item_dict.keys():
-            block_lines.append("  " + "{} {}".format(item,self._item_dict[item]))
-        block_lines.append("end {}\n".format(self.name))
-        return "\n".join(block_lines)
+        # species patterns hash by their contents so the
+        # dict has to be rebuilt once one of them changed
+        self._stale = False
+
+    def _iter_lines(self):
+        # lines the block is written out as, 
+        # joined for str()
+        yield "\nbegin {}".format(self.name)
+        for item, value in dict.items(self._item_dict):
+            yield "  " + "{} {}".format(item,value)
+        yield "end {}\n".format(self.name)
+
+    def _touch(self):
+        super()._touch()
+        self._stale = True
+
+    def _sync(self):
+        if self._stale:
+            # plain dict items, the ordered view looks keys up
+            # by their (now stale) hashes
+            self._item_dict = OrderedDict(dict.items(self._item_dict))
+            self._keys_removed()
+            self._stale = False
+
+    def _find_key(self, key):
+        '''
+        turns a species string into a pattern key, strings of
+        the same species written differently work too
+        '''
+        self._sync()
+        if not isinstance(key, str):
+            return key
+        ikey = self._lookup(key)
+        if ikey is None:
+            pattern_xml = parse_pattern_string(key)
+            if pattern_xml is not None:
+                ikey = SpeciesXML(pattern_xml)
+        return ikey
 
     def __getitem__(self, key):
-        if isinstance(key, str):
-            # our keys are objects
-            for ikey in self._item_dict:
-                if key == str(ikey):
-                    return self._item_dict[ikey]
         if isinstance(key, int):
             # get the item in order
-            return list(self._item_dict.keys())[key]
-        return self._item_dict[key]
+            self._sync()
+            return self._keys()[key]
+        # our keys are objects
+        ikey = self._find_key(key)
+        if ikey is None:
+            raise KeyError(key)
+        return self._item_dict[ikey]
 
     def __setitem__(self, key, value):
+        self._invalidate()
         if isinstance(key, str):
-            for ikey in self._item_dict:
-                if key == str(ikey):
-                    self._item_dict[ikey] = value
+            ikey = self._find_key(key)
+            if ikey is not None and ikey in self._item_dict:
+                self._item_dict[ikey] = value
             return
         if isinstance(key, int):
-            k = list(self._item_dict.keys())[key]
+            self._sync()
+            k = self._keys()[key]
             self._item_dict[k] = value
             return
-        self._item_dict[key] = value
+        self._sync()
+        self._item_dict[_adopt(self, key)] = value
+        self._key_added(key)
+
+    def __delitem__(self, key):
+        ikey = self._find_key(key)
+        if ikey is not None:
+            key = ikey
+        super().__delitem__(key)
 
     def __contains__(self, key):
-        for ikey in self._item_dict:
-            if key == str(ikey):
-                return True
-        return False
+        ikey = self._find_key(key)
+        return ikey is not None and ikey in self._item_dict
 
     def parse_xml_block(self, block_xml):
-        if isinstance(block_xml, list):
+        if not isinstance(block_xml, dict):
             for sd in block_xml:
                 xmlobj = SpeciesXML(sd)
                 self.add_item((xmlobj,sd['@concentration']))
@@ -181,7 +444,10 @@ class Species(ModelBlock):
 
     def add_item(self, item_tpl):
         name, val = item_tpl
-        self._item_dict[name] = val
+        self._sync()
+        self._item_dict[_adopt(self, name)] = val
+        self._key_added(name)
+        self._invalidate()
 
 class MoleculeTypes(ModelBlock):
     '''
@@ -196,41 +462,47 @@ class MoleculeTypes(ModelBlock):
 
     def add_item(self, item_tpl):
         name, = item_tpl
-        self._item_dict[name] = ""
+        self._item_dict[_adopt(self, name)] = ""
+        self._key_added(name)
+        self._invalidate()
 
     def __getitem__(self, key):
         if isinstance(key, str):
             # our keys are objects
-            for ikey in self._item_dict:
-                if key == str(ikey):
-                    return self._item_dict[ikey]
+            ikey = self._lookup(key)
+            if ikey is not None:
+                return self._item_dict[ikey]
         if isinstance(key, int):
             # get the item in order
-            return list(self._item_dict.keys())[key]
+            return self._keys()[key]
         return self._item_dict[key]
 
     def __setitem__(self, key, value):
-        for ikey in self._item_dict:
-            if key == str(ikey):
-                self._item_dict[ikey] = value
+        self._invalidate()
+        ikey = self._lookup(str(key))
+        if ikey is not None:
+            self._item_dict[ikey] = value
+
+    def __delitem__(self, key):
+        if isinstance(key, str):
+            ikey = self._lookup(key)
+            if ikey is not None:
+                key = ikey
+        super().__delitem__(key)
 
     def __contains__(self, key):
-        for ikey in self._item_dict:
-            if key == str(ikey):
-                return True
-        return False
+        return self._lookup(str(key)) is not None
 
-    def __str__(self):
-        # overwrites what the method returns when 
-        # it's converted to string
-        block_lines = ["\nbegin {}".format(self.name)]
+    def _iter_lines(self):
+        # lines the block is written out as, 
+        # joined for str()
+        yield "\nbegin {}".format(self.name)
         for item in self._item_dict.keys():
-            block_lines.append("  " + "{}".format(item))
-        block_lines.append("end {}\n".format(self.name))
-        return "\n".join(block_lines)
+            yield "  " + "{}".format(item)
+        yield "end {}\n".format(self.name)
 
     def parse_xml_block(self, block_xml):
-        if isinstance(block_xml, list):
+        if not isinstance(block_xml, dict):
             for md in block_xml:
                 xmlobj = MolTypeXML(md)
                 self.add_item((xmlobj,))
@@ -250,39 +522,41 @@ class Observables(ModelBlock):
     def __setattr__(self, name, value):
         if hasattr(self, "_item_dict"):
             if name in self._item_dict.keys():
-                self._item_dict[name][1] = value
+                self._item_dict[name][1] = _adopt(self, value)
+                self._invalidate()
         self.__dict__[name] = value
 
     def add_item(self, item_tpl): 
         otype, name, obj = item_tpl
-        self._item_dict[name] = [otype, obj]
+        self._item_dict[name] = [otype, _adopt(self, obj)]
+        self._key_added(name)
+        self._invalidate()
         try:
             setattr(self, name, obj)
         except:
             print("can't set {} to {}".format(name, obj))
             pass
 
-    def __str__(self):
-        # overwrites what the method returns when 
-        # it's converted to string
-        block_lines = ["\nbegin {}".format(self.name)]
+    def _iter_lines(self):
+        # lines the block is written out as, 
+        # joined for str()
+        yield "\nbegin {}".format(self.name)
         for item in self._item_dict.keys():
-            block_lines.append("  " + 
+            yield ("  " + 
                     "{} {} {}".format(self._item_dict[item][0],
                                       item,
                                       self._item_dict[item][1]))
-        block_lines.append("end {}\n".format(self.name))
-        return "\n".join(block_lines)
+        yield "end {}\n".format(self.name)
 
     def __getitem__(self, key):
         if isinstance(key, int):
             # get the item in order
-            return self._item_dict[list(self._item_dict.keys())[key]][1]
+            return self._item_dict[self._keys()[key]][1]
         return self._item_dict[key]
 
     def parse_xml_block(self, block_xml):
         #
-        if isinstance(block_xml, list):
+        if not isinstance(block_xml, dict):
             for b in block_xml:
                 xmlobj = ObsXML(b['ListOfPatterns'])
                 self.add_item((b['@type'], b['@name'], xmlobj))
@@ -299,20 +573,57 @@ class Functions(ModelBlock):
     def __init__(self):
         super().__init__()
         self.name = "functions"
+        self._graph = None
+
+    def _invalidate(self):
+        super()._invalidate()
+        self._graph = None
+
+    def evaluate(self, parameters, values=None):
+        '''
+        Evaluates the functions without arguments given the
+        Parameters block. values holds anything else they
+        use, e.g. observables and time, floats or arrays.
+        Returns a dict of function name -> value
+        '''
+        from BNGSim.expressions import ExpressionGraph
+        param_values = parameters.evaluate()
+        if self._graph is None:
+            graph = ExpressionGraph()
+            for name, value in param_values.items():
+                graph.set_value(name, value)
+            for item, expr in self._item_dict.items():
+                fname, args = item.split("(", 1)
+                if args.strip() != ")":
+                    # local functions need their arguments
+                    continue
+                graph.set_expression(fname, expr)
+            self._graph = graph
+        else:
+            # only push the parameters that changed
+            for name, value in param_values.items():
+                if self._graph.values.get(name) != value:
+                    self._graph.set_value(name, value)
+        all_values = self._graph.evaluate(values=values)
+        result = {}
+        for item in self._item_dict:
+            fname = item.split("(", 1)[0]
+            if fname in all_values and fname not in param_values:
+                result[fname] = all_values[fname]
+        return result
 
     # TODO: Fix this such that we can re-write functions
-    def __str__(self):
-        # overwrites what the method returns when 
-        # it's converted to string
-        block_lines = ["\nbegin {}".format(self.name)]
+    def _iter_lines(self):
+        # lines the block is written out as, 
+        # joined for str()
+        yield "\nbegin {}".format(self.name)
         for item in self._item_dict.keys():
-            block_lines.append("  " + 
+            yield ("  " + 
                     "{} = {}".format(item, self._item_dict[item]))
-        block_lines.append("end {}\n".format(self.name))
-        return "\n".join(block_lines)
+        yield "end {}\n".format(self.name)
 
     def parse_xml_block(self, block_xml):
-        if isinstance(block_xml, list):
+        if not isinstance(block_xml, dict):
              for func in block_xml:
                  xmlobj = FuncXML(func)
                  self.add_item(xmlobj.item_tuple)
@@ -328,27 +639,28 @@ class Compartments(ModelBlock):
         super().__init__()
         self.name = "compartments"
 
-    def __str__(self):
-        # overwrites what the method returns when 
-        # it's converted to string
-        block_lines = ["\nbegin {}".format(self.name)]
+    def _iter_lines(self):
+        # lines the block is written out as, 
+        # joined for str()
+        yield "\nbegin {}".format(self.name)
         for item in self._item_dict.keys():
             comp_line = "  {} {} {}".format(item, 
                             self._item_dict[item][0],
                             self._item_dict[item][1])
             if self._item_dict[item][2] is not None:
                 comp_line += " {}".format(self._item_dict[item][2])
-            block_lines.append(comp_line)
-        block_lines.append("end {}\n".format(self.name))
-        return "\n".join(block_lines)
+            yield comp_line
+        yield "end {}\n".format(self.name)
 
     def add_item(self, item_tpl):
         name, dim, size, outside = item_tpl
         self._item_dict[name] = [dim, size, outside]
+        self._key_added(name)
+        self._invalidate()
 
     def parse_xml_block(self, block_xml):
         # 
-        if isinstance(block_xml, list):
+        if not isinstance(block_xml, dict):
             for comp in block_xml:
                 cname = comp['@id']
                 dim = comp['@spatialDimensions']
@@ -374,18 +686,17 @@ class Rules(ModelBlock):
         super().__init__()
         self.name = "reaction rules"
 
-    def __str__(self):
-        block_lines = ["\nbegin {}".format(self.name)]
+    def _iter_lines(self):
+        yield "\nbegin {}".format(self.name)
         for item in self._item_dict.keys():
-            block_lines.append(str(self._item_dict[item]))
-        block_lines.append("end {}\n".format(self.name))
-        return "\n".join(block_lines)
+            yield str(self._item_dict[item])
+        yield "end {}\n".format(self.name)
 
     def __iter__(self):
         return self._item_dict.values().__iter__()
 
     def parse_xml_block(self, block_xml):
-        if isinstance(block_xml, list):
+        if not isinstance(block_xml, dict):
             for rd in block_xml:
                 xmlobj = RuleXML(rd)
                 self.add_item((xmlobj.name, xmlobj))
@@ -418,43 +729,112 @@ class Rules(ModelBlock):
         # delete items marked for deletion
         for del_item in delete_list:
             self._item_dict.pop(del_item)
+        self._keys_removed()
+        self._invalidate()
 
 class Actions(ModelBlock):
     def __init__(self):
         super().__init__()
         self.name = "actions"
+        # actions that take a random seed
+        self._seeded_actions = ["simulate", "simulate_ssa", "simulate_pla", "simulate_nf", "parameter_scan"]
+        # actions called with positional arguments
+        self._positional_actions = ["setConcentration", "addConcentration", "saveConcentration", "resetConcentrations", "setParameter", "saveParameters", "resetParameters"]
+        # arguments that take strings and have to be quoted
+        self._string_args = ["method", "file", "prefix", "suffix", "format", "parameter"]
         self._action_list = ["generate_network", "generate_hybrid_model","simulate", "simulate_ode", "simulate_ssa", "simulate_pla", "simulate_nf", "parameter_scan", "bifurcate", "readFile", "writeFile", "writeModel", "writeNetwork", "writeXML", "writeSBML", "writeMfile", "writeMexfile", "writeMDL", "visualize", "setConcentration", "addConcentration", "saveConcentration", "resetConcentrations", "setParameter", "saveParameters", "resetParameters", "quit", "setModelName", "substanceUnits", "version", "setOption"]
 
-    def __str__(self):
+    def _iter_lines(self):
         # TODO: figure out every argument that has special 
         # requirements, e.g. method requires the value to 
         # be a string
-        block_lines = []
         for item in self._item_dict.keys():
+            if isinstance(item, tuple):
+                # positional arguments, e.g. setParameter("k1",5)
+                yield "{}({})".format(item[0], ",".join([self._positional(a) for a in self._item_dict[item]]))
+                continue
             action_str = "{}(".format(item) + "{"
             for iarg,arg in enumerate(self._item_dict[item]):
                 val = arg[1]
                 arg = arg[0]
                 if iarg > 0:
                     action_str += ","
-                if arg == "method":
+                if arg in self._string_args and not str(val).startswith('"'):
                     action_str += '{}=>"{}"'.format(arg, val)
                 else:
                     action_str += '{}=>{}'.format(arg, val)
             action_str += "})"
-            block_lines.append(action_str)
-        return "\n".join(block_lines)
+            yield action_str
+
+    def _positional(self, value):
+        # numbers go in as they are, anything else is quoted
+        try:
+            float(value)
+            return str(value)
+        except (TypeError, ValueError):
+            return '"{}"'.format(value)
 
     def add_action(self, action_type, action_args):
         '''
         adds action, needs type as string and args as list of tuples
-        (which preserve order) of (argument, value) pairs
+        (which preserve order) of (argument, value) pairs. Actions
+        taking positional arguments (setParameter etc.) get a list
+        of values instead and can be added once per first argument
         '''
-        if action_type in self._action_list:
+        if action_type in self._positional_actions:
+            key = (action_type,) + tuple(action_args[:1])
+            self._item_dict[key] = list(action_args)
+            self._key_added(key)
+            self._invalidate()
+        elif action_type in self._action_list:
             self._item_dict[action_type] = action_args
+            self._key_added(action_type)
+            self._invalidate()
         else:
             print("Action type {} not valid".format(action_type))
 
+    def with_seed(self, seed):
+        '''
+        copy of the actions with the seed of every 
+        simulation action set to seed
+        '''
+        actions = Actions()
+        for action_key, action_args in self._item_dict.items():
+            action_type = action_key[0] if isinstance(action_key, tuple) else action_key
+            if action_type in self._seeded_actions:
+                action_args = [arg for arg in action_args if arg[0] != "seed"] + [("seed", seed)]
+            actions.add_action(action_type, action_args)
+        return actions
+
+    def generate_options(self):
+        '''
+        generate_network arguments that change the network,
+        None if there is no generate_network action
+        '''
+        if "generate_network" not in self._item_dict:
+            return None
+        return [arg for arg in self._item_dict["generate_network"] if arg[0] != "overwrite"]
+
+    def network_actions(self, net_file, edits=None):
+        '''
+        Actions to run on an already generated network, reads 
+        in the .net file instead of generating the network. 
+        edits are (action type, args) pairs run right after
+        '''
+        actions = Actions()
+        actions.add_action("readFile", [("file", net_file)])
+        if edits is not None:
+            for action_type, action_args in edits:
+                actions.add_action(action_type, action_args)
+        for action_key, action_args in self._item_dict.items():
+            if action_key == "generate_network":
+                continue
+            action_type = action_key[0] if isinstance(action_key, tuple) else action_key
+            actions.add_action(action_type, action_args)
+        return actions
+
     def clear_actions(self):
         self._item_dict.clear()
+        self._keys_removed()
+        self._invalidate()
 ###### MODEL STRUCTURES ###### 
@@ -1,5 +1,10 @@
-import os, subprocess
-from distutils import spawn
+import os, re, shutil, subprocess
+
+# Resolved BNG2.pl installs, keyed by the BNGPATH they were
+# looked up with (None for the command line). Each entry is
+# (BNGPATH, bngexec, version) so BNG2.pl only gets probed once 
+# per process, and child processes inherit the registry on fork.
+_bng_registry = {}
 
 def find_BNG_path(BNGPATH=None):
     # TODO: Figure out how to use the BNG2.pl if it's set 
@@ -12,26 +17,138 @@ def find_BNG_path(BNGPATH=None):
             BNGPATH = os.environ["BNGPATH"]
         except:
             pass
+    if BNGPATH in _bng_registry:
+        path, bngexec, _ = _bng_registry[BNGPATH]
+        return path, bngexec
+    registry_key = BNGPATH
+    version = None
     # if still none, try pulling it from cmd line
     if BNGPATH is None:
         bngexec = "BNG2.pl"
-        if test_bngexec(bngexec):
+        works, version = probe_bngexec(bngexec)
+        if works:
             print("BNG2.pl seems to be working")
             # get the source of BNG2.pl
-            BNGPATH = spawn.find_executable("BNG2.pl")
+            BNGPATH = shutil.which("BNG2.pl")
             BNGPATH, _ = os.path.split(BNGPATH)
     else:
         bngexec = os.path.join(BNGPATH, "BNG2.pl")
-        if test_bngexec(bngexec):
+        works, version = probe_bngexec(bngexec)
+        if works:
             print("BNG2.pl seems to be working")
         else:
             print("BNG2.pl not working, simulator won't run")
+    _bng_registry[registry_key] = (BNGPATH, bngexec, version)
     return BNGPATH, bngexec
 
-def test_bngexec(bngexec):
-    rc = subprocess.run(["perl", bngexec])
-    if rc.returncode == 0:
-        return True
+def find_run_network(BNGPATH=None):
+    '''
+    Path to the run_network binary under the bin folder
+    of the BNG install find_BNG_path finds, None if
+    there isn't one
+    '''
+    BNGPATH, _ = find_BNG_path(BNGPATH)
+    if BNGPATH is None:
+        return None
+    for exe in ["run_network", "run_network.exe"]:
+        run_network = os.path.join(BNGPATH, "bin", exe)
+        if os.path.isfile(run_network) and os.access(run_network, os.X_OK):
+            return run_network
+    return None
+
+def get_BNG_version(BNGPATH=None):
+    '''
+    BioNetGen version string of the BNG2.pl find_BNG_path
+    resolves to, None if it couldn't be determined
+    '''
+    if BNGPATH is None:
+        BNGPATH = os.environ.get("BNGPATH", None)
+    if BNGPATH not in _bng_registry:
+        find_BNG_path(BNGPATH)
+    return _bng_registry[BNGPATH][2]
+
+def get_bngexec_version(bngexec):
+    '''
+    version of an already resolved BNG2.pl, None if 
+    it wasn't resolved through find_BNG_path
+    '''
+    for _, resolved, version in _bng_registry.values():
+        if resolved == bngexec:
+            return version
+    return None
+
+def clear_BNG_cache(BNGPATH=None):
+    '''
+    Forget resolved BNG2.pl installs so the next find_BNG_path 
+    probes again. Clears everything if BNGPATH isn't given.
+    '''
+    if BNGPATH is None:
+        _bng_registry.clear()
     else:
-        return False
+        _bng_registry.pop(BNGPATH, None)
+
+def probe_bngexec(bngexec):
+    '''
+    Runs BNG2.pl once, returns if it works and 
+    the version it reports
+    '''
+    try:
+        rc = subprocess.run(["perl", bngexec], stdout=subprocess.PIPE, 
+                stderr=subprocess.STDOUT, universal_newlines=True)
+    except OSError:
+        return False, None
+    version = None
+    match = re.search(r"BioNetGen version (\S+)", rc.stdout)
+    if match is not None:
+        version = match.group(1)
+    return rc.returncode == 0, version
+
+def test_bngexec(bngexec):
+    works, _ = probe_bngexec(bngexec)
+    return works
 
+# BNGL block names and the BNGModel attribute they map to
+bngl_block_names = {"parameters": "parameters", 
+                    "compartments": "compartments",
+                    "molecule types": "moltypes",
+                    "species": "species",
+                    "seed species": "species",
+                    "observables": "observables",
+                    "functions": "functions",
+                    "reaction rules": "rules"}
+
+# blocks of a generated network (.net)
+net_block_names = {"parameters": "parameters",
+                   "species": "species",
+                   "functions": "functions",
+                   "reactions": "reactions",
+                   "groups": "groups"}
+
+def split_bngl_blocks(bngl_text, block_names=None):
+    '''
+    Splits BNGL text into its begin/end blocks. Returns a
+    dictionary keyed by the BNGModel attribute name of the block
+    with the text of each block, including begin/end lines.
+    block_names maps block names to keys, bngl_block_names by
+    default
+    '''
+    if block_names is None:
+        block_names = bngl_block_names
+    blocks = {}
+    current, lines = None, []
+    for line in bngl_text.splitlines():
+        stripped = line.split("#")[0].strip()
+        stripped = re.sub(r"\s+", " ", stripped)
+        if current is None:
+            if stripped.startswith("begin "):
+                name = stripped[len("begin "):]
+                if name in block_names:
+                    current, lines = name, ["", "begin {}".format(name)]
+        else:
+            if stripped == "end {}".format(current):
+                lines.append("end {}\n".format(current))
+                blocks[block_names[current]] = "\n".join(lines)
+                current = None
+            else:
+                lines.append(line.rstrip("\n"))
+    return blocks
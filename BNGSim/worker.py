@@ -1,74 +1,285 @@
-import tempfile, os, subprocess
+import io, tempfile, os, shutil, subprocess, asyncio, threading, signal
+import numpy as np
 from BNGSim.utils import find_BNG_path
 from BNGSim.result import BNGResult
+from BNGSim.cache import network_key
+
+class BNGJob:
+    """
+    Everything a single simulation needs and nothing else, so
+    it's cheap to send to pool processes. Either model_text is
+    the BNGL of the model (without actions) or net_file is the
+    path to an already generated network, actions_text is run
+    on it. outputs are the result file extensions to load.
+
+    With backend "run_network" the network is simulated by 
+    calling the run_network binary directly, run_args holds 
+    method, t_start, t_end, n_steps and optionally atol/rtol.
+    With backend "roadrunner" the exported sbml_file is simulated
+    in-process, values are the RoadRunner ids -> values to set
+    before the run and observables an ObservableMatrix.
+    The result gets the name and the seed of the job
+    """
+    def __init__(self, model_name, bngexec, actions_text, model_text=None,
+                 net_file=None, path=None, seed=None, outputs=None,
+                 backend="bng2", run_network=None, run_args=None,
+                 sbml_file=None, values=None, observables=None, name=None):
+        self.model_name = model_name
+        self.bngexec = bngexec
+        self.actions_text = actions_text
+        self.model_text = model_text
+        self.net_file = net_file
+        self.path = path
+        self.seed = seed
+        self.outputs = outputs
+        self.backend = backend
+        self.run_network = run_network
+        self.run_args = run_args
+        self.sbml_file = sbml_file
+        self.values = values
+        self.observables = observables
+        self.name = name
+
+# simulate methods -> run_network propagators, as BNG2.pl maps them
+run_network_methods = {"ode": "cvode", "cvode": "cvode", "ssa": "ssa",
+                       "pla": "pla", "psa": "psa"}
+
+def run_job(job):
+    '''
+    runs a job in the calling process, this is what
+    the pool processes call
+    '''
+    return BNGWorker(job=job).run()
 
 class BNGWorker:
     """
-    Takes the parent (for getting the up-to-date model later) and an
-    optional path parameter.
-    
+    Runs a single BNGJob. For backwards compatibility it can
+    also be given a parent (with a get_model method) and an
+    optional path, the job is then made from the current model
+    right away and the parent isn't kept around.
+
     If a path isn't given, the simulation will run in a temporary folder
-    and the results will be saved in memory. 
+    and the results will be saved in memory.
 
-    Currently only BNG2.pl simulations can be run but eventually a 
-    RoadRunner simulator option will be implemented
+    Simulations run through BNG2.pl or, for generated networks,
+    the run_network binary directly or libroadrunner in-process
     """
-    def __init__(self, parent, path=None, bngexec=None):
-        # we'll need our parent to get the model
-        self.parent = parent
+    def __init__(self, parent=None, path=None, bngexec=None, job=None):
+        if job is None:
+            # if we are not given the path to BNG2.pl
+            # try to find it
+            if bngexec is None:
+                _, bngexec = find_BNG_path()
+            model = parent.get_model()
+            job = self._parent_job(parent, model, bngexec, path)
+        self.job = job
         # this allows us to setup a path
-        self.path = path
+        self.path = job.path
+        self.bngexec = job.bngexec
         self.result = None
-        # if we are not given the path to BNG2.pl 
-        # try to find it
-        if bngexec is None:
-            self.BNGPATH, self.bngexec = find_BNG_path()
-        else:
-            self.bngexec = bngexec
-    
+
+    def _parent_job(self, parent, model, bngexec, path):
+        # starts from the parent's generated network if it has 
+        # one, otherwise the network cache is checked at run time
+        self._net_lookup = None
+        network = None
+        if hasattr(parent, "get_network"):
+            network = parent.get_network()
+        if network is not None:
+            net_file, actions = network
+            return BNGJob(model.model_name, bngexec, str(actions), net_file=net_file, path=path)
+        net_cache = getattr(parent, "net_cache", None)
+        if net_cache is not None and hasattr(model, "actions") and "generate_network" in model.actions:
+            self._net_lookup = (net_cache, network_key(model, bngexec), model)
+        actions_text = str(model.actions) if "actions" in model.active_blocks else ""
+        return BNGJob(model.model_name, bngexec, actions_text,
+                      model_text=_model_text(model), path=path)
+
+    def _cached_network(self, sim_path, model_file):
+        # the network might be cached from an earlier run even
+        # if the parent didn't generate it, writes the actions
+        # to run on it and returns True if it was
+        lookup = getattr(self, "_net_lookup", None)
+        if lookup is None:
+            return False
+        net_cache, key, model = lookup
+        net_file = os.path.join(sim_path, self.job.model_name + ".net")
+        if net_cache.copy_to(key, net_file) is None:
+            return False
+        with open(model_file, "w") as f:
+            model.network_actions(net_file).write_to(f)
+        return True
+
     def _setup_working_path(self):
+        # returns the absolute path of the folder to run in,
+        # the process-wide working directory is never changed
+        # so workers can run on threads
         if self.path is None:
             # work in temp folder
-            temp_folder = tempfile.mkdtemp()
-            os.chdir(temp_folder)
-            return temp_folder
+            return tempfile.mkdtemp()
         else:
-            if not os.path.isider(self.path):
+            if not os.path.isdir(self.path):
                 print("Given simulation path does not exist or invalid, trying to create")
                 try:
-                    os.mkdir(path)
+                    os.makedirs(self.path)
                 except OSError:
                     print("Failed to create given path")
-                    os.exit(1)
-            os.chdir(self.path)
-            return self.path
-
-    def _get_model(self):
-        # this gets us the model object
-        model = self.parent.get_model()
-        # we are assuming we are in the right
-        # folder for what we are doing
-        model_name = model.model_name
-        self.model_name = model_name
-        model_file = model_name + ".bngl"
+                    raise
+            return os.path.abspath(self.path)
+
+    def _get_model(self, sim_path):
+        # writes the job into sim_path
+        job = self.job
+        self.model_name = job.model_name
+        model_file = os.path.join(sim_path, job.model_name + ".bngl")
+        if job.net_file is not None:
+            # the actions read this in instead of
+            # generating the network
+            shutil.copyfile(job.net_file, os.path.join(sim_path, job.model_name + ".net"))
+        if job.backend == "run_network":
+            # no BNGL, run_network reads the network
+            return None
+        if job.net_file is None and self._cached_network(sim_path, model_file):
+            return model_file
         with open(model_file, "w") as f:
-            f.write(str(model))
+            if job.model_text is not None:
+                f.write(job.model_text)
+                f.write("\n")
+            f.write(job.actions_text)
         return model_file
 
-    def run(self):
+    def _command(self, sim_path, model_file):
+        job = self.job
+        if job.backend != "run_network":
+            return ["perl", self.bngexec, model_file]
+        # same call BNG2.pl makes for simulate on a network
+        args = job.run_args
+        net_file = os.path.join(sim_path, job.model_name + ".net")
+        # run_network starts at 0, the simulator makes sure t_start is 0
+        t_step = float(args["t_end"])/int(args["n_steps"])
+        cmd = [job.run_network, "-o", os.path.join(sim_path, job.model_name), 
+               "-p", run_network_methods[args["method"]]]
+        if "atol" in args:
+            cmd += ["-a", str(args["atol"])]
+        if "rtol" in args:
+            cmd += ["-r", str(args["rtol"])]
+        if job.seed is not None:
+            cmd += ["-h", str(job.seed)]
+        cmd += ["--cdat", "1", "--fdat", "0", "-g", net_file, net_file, 
+                str(t_step), str(int(args["n_steps"]))]
+        return cmd
+
+    def _prepare(self):
         # setup our path
         sim_path = self._setup_working_path()
         # get our model
-        model_file = self._get_model()
-        # run 
-        rc = subprocess.run(["perl", self.bngexec, model_file])
-        print(os.listdir(os.getcwd()))
-        if rc.returncode == 0:
+        model_file = self._get_model(sim_path)
+        return sim_path, model_file
+
+    def run(self):
+        if self.job.backend == "roadrunner":
+            return self._run_roadrunner()
+        sim_path, model_file = self._prepare()
+        # run
+        rc = subprocess.run(self._command(sim_path, model_file), cwd=sim_path)
+        return self._load_result(rc.returncode, model_file, sim_path)
+
+    async def run_async(self):
+        '''
+        Same as run but BNG2.pl runs as an asyncio subprocess
+        and the file copying before and the loading after it
+        happen on the default executor, the event loop is free
+        while the simulation runs
+        '''
+        loop = asyncio.get_running_loop()
+        if self.job.backend == "roadrunner":
+            return await loop.run_in_executor(None, self._run_roadrunner)
+        # copying files and the network cache lock block
+        sim_path, model_file = await loop.run_in_executor(None, self._prepare)
+        # own process group, BNG2.pl starts run_network itself
+        proc = await asyncio.create_subprocess_exec(*self._command(sim_path, model_file), cwd=sim_path,
+                                                    start_new_session=True)
+        try:
+            returncode = await proc.wait()
+        except asyncio.CancelledError:
+            # the consumer stopped, don't leave the simulation running
+            _kill(proc)
+            await proc.wait()
+            raise
+        return await loop.run_in_executor(None, self._load_result, returncode, model_file, sim_path)
+
+    def _load_result(self, returncode, model_file, sim_path):
+        if returncode == 0:
             print("Simulation succesful, loading results")
-            self.result = BNGResult(bngl=model_file)
-            return self.result
+            self.result = BNGResult(bngl=model_file, path=sim_path, outputs=self.job.outputs)
+            return self._label(self.result)
         else:
             print("Simulation failed")
-            print(rc.stdout)
-            print(rc.stderr)
             return None
+
+    def _run_roadrunner(self):
+        job = self.job
+        args = job.run_args
+        rr = _get_roadrunner(job.sbml_file)
+        # back to the SBML file, then this job's values
+        rr.resetAll()
+        for name, value in job.values.items():
+            rr.setValue(name, value)
+        rr.reset()
+        if "atol" in args:
+            rr.integrator.setValue("absolute_tolerance", float(args["atol"]))
+        if "rtol" in args:
+            rr.integrator.setValue("relative_tolerance", float(args["rtol"]))
+        # species in network order, like the cdat
+        species = list(rr.model.getFloatingSpeciesIds()) + list(rr.model.getBoundarySpeciesIds())
+        species.sort(key=lambda s: int(s[1:]))
+        rr.timeCourseSelections = ["time"] + ["[{}]".format(s) for s in species]
+        data = np.array(rr.simulate(float(args["t_start"]), float(args["t_end"]), int(args["n_steps"])+1))
+        arrays = {"cdat": (["time"] + species, data)}
+        if job.observables is not None:
+            arrays["gdat"] = job.observables.apply(data)
+        if job.outputs is not None:
+            arrays = {ext: arr for ext, arr in arrays.items() if ext in job.outputs}
+        self.result = BNGResult.from_arrays(arrays, path=job.path)
+        return self._label(self.result)
+
+    def _label(self, result):
+        # ties the result to its job regardless of the order
+        # the jobs finish in
+        if self.job.name is not None:
+            result.set_name(self.job.name)
+        result.seed = self.job.seed
+        return result
+
+###### ROADRUNNER ######
+# loaded RoadRunner models by SBML file. RoadRunner instances 
+# aren't thread safe so each thread (and so each process) 
+# loads its own, once, and reuses it for every job
+_roadrunners = {}
+
+def _get_roadrunner(sbml_file):
+    key = (sbml_file, threading.get_ident())
+    rr = _roadrunners.get(key)
+    if rr is None:
+        # only needed for this backend
+        import roadrunner
+        rr = roadrunner.RoadRunner(sbml_file)
+        _roadrunners[key] = rr
+    return rr
+###### ROADRUNNER ######
+
+def _kill(proc):
+    # kills the process and everything it started
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (AttributeError, OSError):
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
+def _model_text(model):
+    # the model without its actions
+    model_str = io.StringIO()
+    model.write_to(model_str, actions=False)
+    return model_str.getvalue()
@@ -1,11 +1,17 @@
-from BNGSim.pattern import Pattern, Molecule, Component, Bonds
+from BNGSim.pattern import Pattern, Molecule, Component, Bonds, _adopt
 
 ###### XMLObjs ###### 
 class XMLObj:
     def __init__(self, xml):
+        # the model block holding the object, see pattern._adopt
+        self._owner = None
         self.xml = xml
         self.resolve_xml(self.xml)
 
+    def _touch(self):
+        if self._owner is not None:
+            self._owner._touch()
+
     def __repr__(self):
         return self.gen_string()
 
@@ -41,22 +47,18 @@ class ObsXML(XMLObj):
             # we have multiple patterns so this is a list
             for ipattern, pattern in enumerate(patterns): 
                 # 
-                self.patterns.append(Pattern(pattern))
+                self.patterns.append(_adopt(self, Pattern(pattern)))
         else:
-            self.patterns.append(Pattern(patterns))
+            self.patterns.append(_adopt(self, Pattern(patterns)))
 
 class SpeciesXML(Pattern):
     '''
     A species is a list of molecules
     '''
+    __slots__ = ()
+
     def __init__(self, xml):
-        self._xml = xml
-        self._bonds = Bonds()
-        self._label = None
-        self._compartment = None
-        self.molecules = []
-        # sets self.molecules up 
-        self._parse_xml(xml)
+        super().__init__(xml)
 
 class MolTypeXML(XMLObj):
     def __init__(self, xml):
@@ -83,8 +85,8 @@ class MolTypeXML(XMLObj):
                         for istate, state in enumerate(al_states):
                             comp_obj.states.append(state["@id"])
                     else:
-                        comp_obj.states.append(state["@id"])
-                mol_obj.components.append(comp_obj)
+                        comp_obj.states.append(al_states["@id"])
+                mol_obj.components.append(_adopt(mol_obj, comp_obj))
             else:
                 # multiple components
                 for icomp, comp in enumerate(comp_dict):
@@ -98,8 +100,8 @@ class MolTypeXML(XMLObj):
                                 comp_obj.states.append(state['@id'])
                         else:
                             comp_obj.states.append(al_states['@id'])
-                    mol_obj.components.append(comp_obj)
-        self.molecule = mol_obj
+                    mol_obj.components.append(_adopt(mol_obj, comp_obj))
+        self.molecule = _adopt(self, mol_obj)
 
 class RuleXML(XMLObj):
     '''
@@ -107,11 +109,81 @@ class RuleXML(XMLObj):
     product patterns, list of rate constant functions)
     '''
     def __init__(self, pattern_xml):
-        self.bidirectional = False
+        # rendered rule, dropped by the setters below, which
+        # also tell the Rules block to re-render
+        self._str_cache = None
+        self._bidirectional = False
         super().__init__(pattern_xml)
 
     def __iter__(self):
-        return self.iter_tpl.__iter__()
+        return self.rule_tpl.__iter__()
+
+    def __str__(self):
+        if self._str_cache is None:
+            self._str_cache = self.gen_string()
+        return self._str_cache
+
+    def __repr__(self):
+        return str(self)
+
+    def _touch(self):
+        self._str_cache = None
+        super()._touch()
+
+    ### PROPERTIES ###
+    @property
+    def rule_tpl(self):
+        return (self.reactants, self.products, self.rate_constants)
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        self._name = value
+        self._touch()
+
+    @property
+    def reactants(self):
+        return self._reactants
+
+    @reactants.setter
+    def reactants(self, value):
+        self._reactants = value
+        for pat in value:
+            _adopt(self, pat)
+        self._touch()
+
+    @property
+    def products(self):
+        return self._products
+
+    @products.setter
+    def products(self, value):
+        self._products = value
+        for pat in value:
+            _adopt(self, pat)
+        self._touch()
+
+    @property
+    def rate_constants(self):
+        return self._rate_constants
+
+    @rate_constants.setter
+    def rate_constants(self, value):
+        self._rate_constants = value
+        self._touch()
+
+    @property
+    def bidirectional(self):
+        return self._bidirectional
+
+    @bidirectional.setter
+    def bidirectional(self, value):
+        self._bidirectional = value
+        self._touch()
+    ### PROPERTIES ###
 
     def gen_string(self):
         if self.bidirectional:
@@ -147,7 +219,6 @@ class RuleXML(XMLObj):
         if 'RateLaw' not in pattern_xml:
             print("Rule seems to be missing a rate law, please make sure that XML exporter of BNGL supports whatever you are doing!")
         self.rate_constants = [self.resolve_ratelaw(pattern_xml['RateLaw'])]
-        self.rule_tpl = (self.reactants, self.products, self.rate_constants)
 
     def resolve_ratelaw(self, rate_xml):
         rate_type = rate_xml['@type']
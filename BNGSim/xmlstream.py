@@ -0,0 +1,85 @@
+import xml.etree.ElementTree as ET
+
+###### STREAMING XML FRONT-END ######
+# BNG XML is walked with iterparse one item of a ListOf*
+# block at a time. Each item is turned into the same nested
+# dict layout xmltodict produces so the block parsers don't
+# care which route the XML came through, and its elements
+# are freed before moving on to the next one.
+def strip_ns(tag):
+    if "}" in tag:
+        return tag.split("}", 1)[1]
+    return tag
+
+def element_to_dict(elem):
+    '''
+    Converts an element into an xmltodict style dict,
+    attributes are keyed with "@", repeated children
+    become lists and text-only elements become strings
+    '''
+    d = {}
+    for key, value in elem.attrib.items():
+        d["@" + key] = value
+    for child in elem:
+        tag = strip_ns(child.tag)
+        value = element_to_dict(child)
+        if tag in d:
+            if isinstance(d[tag], list):
+                d[tag].append(value)
+            else:
+                d[tag] = [d[tag], value]
+        else:
+            d[tag] = value
+    text = elem.text.strip() if elem.text is not None else ""
+    if len(text) > 0:
+        if len(d) == 0:
+            return text
+        d["#text"] = text
+    if len(d) == 0:
+        return None
+    return d
+
+def _block_items(events, block):
+    # the elements directly under block until it ends, each
+    # one is dropped from the block once the next is asked for
+    depth = 0
+    for event, elem in events:
+        if event == "start":
+            depth += 1
+        elif depth == 0:
+            # end of the block itself
+            return
+        else:
+            depth -= 1
+            if depth == 0:
+                yield elem
+                del block[:]
+
+def iter_model_lists(model_file):
+    '''
+    Generator over the ListOf* blocks of a BNG XML file.
+    First yields ("@id", model_id) once the model element
+    starts, then (list_tag, items) for every block directly
+    under the model where items is a generator over the item
+    elements of the block. Items are parsed as they are asked
+    for and dropped afterwards so only one is in memory at a
+    time, whatever the consumer doesn't read is skipped.
+    '''
+    events = ET.iterparse(model_file, events=("start", "end"))
+    depth = 0
+    for event, elem in events:
+        if event == "end":
+            depth -= 1
+            continue
+        depth += 1
+        if depth == 2 and strip_ns(elem.tag) == "model":
+            yield ("@id", elem.attrib.get("id", ""))
+        elif depth == 3:
+            # sbml > model > ListOf*
+            items = _block_items(events, elem)
+            yield (strip_ns(elem.tag), items)
+            for _ in items:
+                pass
+            # the block's end was read by _block_items
+            depth -= 1
+###### STREAMING XML FRONT-END ######
@@ -0,0 +1,116 @@
+'''
+Shared bits of the benchmark scripts: the synthetic models
+they run on and the timing/memory measurement. The scripts
+are run from a checkout, e.g. python benchmarks/xml_parse.py
+'''
+import os, sys, time, gc, tracemalloc
+
+# use the checkout the script is in, installed or not
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def measure(func, setup=None):
+    '''
+    Calls func twice, once for the wall time and once under
+    tracemalloc for the peak python memory (tracemalloc slows
+    things down so the two aren't mixed). If setup is given
+    each call gets a fresh setup() made outside the measurement.
+    Returns (seconds, peak bytes, result of the timed call)
+    '''
+    def call():
+        if setup is None:
+            return func, ()
+        return func, (setup(),)
+    gc.collect()
+    f, args = call()
+    t = time.perf_counter()
+    result = f(*args)
+    seconds = time.perf_counter() - t
+    f, args = call()
+    gc.collect()
+    tracemalloc.start()
+    f(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, result
+
+def report(name, seconds, peak):
+    print("{:<28} {:>9.3f} s {:>10.1f} MB".format(name, seconds, peak/2**20))
+
+###### SYNTHETIC MODELS ######
+def write_bngl(fname, nspecies, nrules=1000, nmoltypes=100, nstates=40):
+    '''
+    Writes a BNGL model with nspecies seed species, all
+    different dimers of nmoltypes molecule types with nstates
+    states, and nrules binding rules between them
+    '''
+    states = "~".join([str(j) for j in range(nstates)])
+    with open(fname, "w") as f:
+        f.write("begin model\nbegin parameters\n  k1 1\n  k2 k1*2\nend parameters\n")
+        f.write("begin molecule types\n")
+        for i in range(nmoltypes):
+            f.write("  M{}(s~{},b)\n".format(i, states))
+        f.write("end molecule types\nbegin seed species\n")
+        for n in range(nspecies):
+            (i, x), (j, y) = _dimer(n, nmoltypes, nstates)
+            f.write("  M{}(s~{},b!1).M{}(s~{},b!1) {}\n".format(i, x, j, y, n))
+        f.write("end seed species\nbegin observables\n")
+        for i in range(nmoltypes):
+            f.write("  Molecules free{0} M{0}(b)\n".format(i))
+        f.write("end observables\nbegin reaction rules\n")
+        for n in range(nrules):
+            (i, x), (j, y) = _dimer(n, nmoltypes, nstates)
+            f.write("  r{0}: M{1}(s~{2},b) + M{3}(s~{4},b) <-> M{1}(s~{2},b!1).M{3}(s~{4},b!1) k1,k2\n".format(
+                    n, i, x, j, y))
+        f.write("end reaction rules\nend model\n")
+
+def _xml_component(cid, name, state=None):
+    if state is None:
+        return '<Component id="{}" name="{}" numberOfBonds="1"/>'.format(cid, name)
+    return '<Component id="{}" name="{}" state="{}" numberOfBonds="0"/>'.format(cid, name, state)
+
+def _dimer(n, nmoltypes, nstates):
+    # the n-th distinct dimer M{i}(s~x,b!1).M{i+1}(s~y,b!1)
+    i = n % nmoltypes
+    x, y = (n // nmoltypes) % nstates, (n // (nmoltypes*nstates)) % nstates
+    return (i, x), ((i+1) % nmoltypes, y)
+
+def write_xml(fname, nspecies, nmoltypes=100, nstates=40):
+    '''
+    Writes a BNG XML file with nspecies seed species, all
+    different dimers of nmoltypes molecule types with nstates
+    states, laid out the way BNG2.pl --xml writes it
+    '''
+    with open(fname, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<sbml xmlns="http://www.sbml.org/sbml/level3" level="3" version="1">\n')
+        f.write('  <model id="synthetic">\n')
+        f.write('    <ListOfParameters>\n')
+        f.write('      <Parameter id="k1" type="Constant" value="1"/>\n')
+        f.write('    </ListOfParameters>\n')
+        f.write('    <ListOfMoleculeTypes>\n')
+        states = "".join(['<AllowedState id="{}"/>'.format(j) for j in range(nstates)])
+        for i in range(nmoltypes):
+            f.write('      <MoleculeType id="M{}"><ListOfComponentTypes>'.format(i))
+            f.write('<ComponentType id="s"><ListOfAllowedStates>{}</ListOfAllowedStates></ComponentType>'.format(states))
+            f.write('<ComponentType id="b"/></ListOfComponentTypes></MoleculeType>\n')
+        f.write('    </ListOfMoleculeTypes>\n')
+        f.write('    <ListOfSpecies>\n')
+        for n in range(nspecies):
+            mols = _dimer(n, nmoltypes, nstates)
+            sid = "S{}".format(n+1)
+            f.write('      <Species id="{}" concentration="{}" name="M{}(s~{},b!1).M{}(s~{},b!1)">'.format(
+                    sid, n, mols[0][0], mols[0][1], mols[1][0], mols[1][1]))
+            f.write('<ListOfMolecules>')
+            for m, (mname, state) in enumerate(mols):
+                mid = "{}_M{}".format(sid, m+1)
+                f.write('<Molecule id="{}" name="M{}"><ListOfComponents>'.format(mid, mname))
+                f.write(_xml_component(mid + "_C1", "s", state))
+                f.write(_xml_component(mid + "_C2", "b"))
+                f.write('</ListOfComponents></Molecule>')
+            f.write('</ListOfMolecules><ListOfBonds>')
+            f.write('<Bond id="{0}_B1" site1="{0}_M1_C2" site2="{0}_M2_C2"/>'.format(sid))
+            f.write('</ListOfBonds></Species>\n')
+        f.write('    </ListOfSpecies>\n')
+        f.write('  </model>\n')
+        f.write('</sbml>\n')
+###### SYNTHETIC MODELS ######
@@ -0,0 +1,55 @@
+'''
+Per-task cost of sending simulations to pool processes vs
+model size: a BNGJob (what the pool gets now) against the
+whole BNGSimulator with its model (what every task used to
+carry through the worker's parent). Nothing is simulated,
+the pool processes just unpickle the task
+
+    python benchmarks/job_dispatch.py [nspecies ...]
+'''
+import os, sys, time, pickle, tempfile, contextlib, io
+from multiprocessing import Pool
+from bench_utils import write_xml
+from BNGSim import BNGModel, BNGSimulator
+
+NTASKS = 5
+
+def _noop(task):
+    return None
+
+def per_task(func, ntasks):
+    t = time.perf_counter()
+    for _ in range(ntasks):
+        func()
+    return (time.perf_counter() - t)/ntasks
+
+def main(sizes):
+    print("{:>8} {:>10} {:>10} {:>12} {:>12} {:>12} {:>12}".format(
+          "species", "job KB", "sim KB", "job pickle", "sim pickle", "job pool", "sim pool"))
+    with tempfile.TemporaryDirectory() as folder, Pool(2) as pool:
+        for nspecies in sizes:
+            xml_file = os.path.join(folder, "synthetic.xml")
+            write_xml(xml_file, nspecies)
+            with contextlib.redirect_stdout(io.StringIO()):
+                model = BNGModel(xml_file, xml_cache=False)
+                model.add_action("simulate", [("method", "ode"), ("t_end", 10), ("n_steps", 10)])
+                sim = BNGSimulator(model, nsims=NTASKS, net_cache=False)
+                jobs = sim._setup_jobs()
+            job, sim_bytes = jobs[0], pickle.dumps(sim)
+            job_bytes = pickle.dumps(job)
+            # a round trip through pickle and through the pool,
+            # per task in ms
+            job_pickle = per_task(lambda: pickle.loads(pickle.dumps(job)), NTASKS)
+            sim_pickle = per_task(lambda: pickle.loads(pickle.dumps(sim)), NTASKS)
+            t = time.perf_counter()
+            pool.map(_noop, jobs, chunksize=1)
+            job_pool = (time.perf_counter() - t)/NTASKS
+            t = time.perf_counter()
+            pool.map(_noop, [sim]*NTASKS, chunksize=1)
+            sim_pool = (time.perf_counter() - t)/NTASKS
+            print("{:>8} {:>10.1f} {:>10.1f} {:>9.2f} ms {:>9.2f} ms {:>9.2f} ms {:>9.2f} ms".format(
+                  nspecies, len(job_bytes)/1024, len(sim_bytes)/1024, 1000*job_pickle,
+                  1000*sim_pickle, 1000*job_pool, 1000*sim_pool))
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [1000, 5000, 20000])
@@ -0,0 +1,46 @@
+'''
+Memory held by the species of a large model, 100k dimer
+species by default, and what that comes to per pattern
+object. Peak is the most memory used while parsing
+
+    python benchmarks/pattern_memory.py [nspecies]
+'''
+import os, sys, time, tempfile, contextlib, io, gc, tracemalloc
+from bench_utils import write_xml
+from BNGSim import BNGModel
+
+def main(nspecies):
+    with tempfile.TemporaryDirectory() as folder:
+        xml_file = os.path.join(folder, "synthetic.xml")
+        write_xml(xml_file, nspecies)
+        gc.collect()
+        tracemalloc.start()
+        t = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            model = BNGModel(xml_file, xml_cache=False)
+        seconds = time.perf_counter() - t
+        gc.collect()
+        held, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    species = list(model.species)
+    assert len(species) == nspecies
+    nmols = sum([len(sp.molecules) for sp in species])
+    ncomps = sum([len(mol.components) for sp in species for mol in sp.molecules])
+    print("{} species, {} molecules, {} components".format(nspecies, nmols, ncomps))
+    print("parsed in {:.1f} s (under tracemalloc)".format(seconds))
+    print("model holds {:.1f} MB, peak {:.1f} MB".format(held/2**20, peak/2**20))
+    print("{:.0f} bytes per species, {:.0f} per object".format(
+          held/nspecies, held/(nspecies + nmols + ncomps)))
+    # the objects themselves, without what they point to
+    sp, mol, comp = species[0], species[0].molecules[0], species[0].molecules[0].components[0]
+    print("instance sizes: pattern {}, molecule {}, component {} bytes".format(
+          *[_instance_size(obj) for obj in (sp, mol, comp)]))
+
+def _instance_size(obj):
+    # slotted objects have no __dict__
+    if hasattr(obj, "__dict__"):
+        return sys.getsizeof(obj) + sys.getsizeof(obj.__dict__)
+    return sys.getsizeof(obj)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,45 @@
+'''
+Wall time and peak memory of writing a large model to a file
+with model.write_to vs building str(model) first
+
+    python benchmarks/write_model.py [nspecies] [nrules]
+'''
+import os, sys, tempfile, contextlib, io
+from bench_utils import measure, report, write_bngl
+from BNGSim import BNGModel
+
+def main(nspecies, nrules):
+    with tempfile.TemporaryDirectory() as folder:
+        bngl = os.path.join(folder, "synthetic.bngl")
+        write_bngl(bngl, nspecies, nrules)
+        out = os.path.join(folder, "out.bngl")
+        def load():
+            # a fresh model for every call, nothing rendered yet
+            with contextlib.redirect_stdout(io.StringIO()):
+                return BNGModel(bngl, parser="bngl", xml_cache=False)
+        def load_written():
+            # written once already, the pattern strings are
+            # cached and only the model text itself is new
+            model = load()
+            with open(os.devnull, "w") as f:
+                model.write_to(f)
+            model.parameters.k1 = 2
+            return model
+        def write_str(model):
+            with open(out, "w") as f:
+                f.write(str(model))
+        def write_to(model):
+            with open(out, "w") as f:
+                model.write_to(f)
+        print("{} species, {} rules".format(nspecies, nrules))
+        for name, setup in [("first write", load), ("rewrite", load_written)]:
+            seconds, peak, _ = measure(write_str, setup)
+            report(name + ", str(model)", seconds, peak)
+            expected = open(out).read()
+            seconds, peak, _ = measure(write_to, setup)
+            report(name + ", write_to", seconds, peak)
+            assert open(out).read() == expected
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
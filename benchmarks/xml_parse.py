@@ -0,0 +1,33 @@
+'''
+Parse time and peak memory of loading a large BNG XML file,
+streamed with iterparse (the default) vs the full xmltodict
+tree kept as model.xml_dict (keep_xml=True)
+
+    python benchmarks/xml_parse.py [nspecies]
+'''
+import os, sys, tempfile, contextlib, io, importlib.util
+from bench_utils import measure, report, write_xml
+from BNGSim import BNGModel
+
+def load(xml_file, keep_xml):
+    # BNGModel reports its progress, keep that out of the table
+    with contextlib.redirect_stdout(io.StringIO()):
+        return BNGModel(xml_file, xml_cache=False, keep_xml=keep_xml)
+
+def main(nspecies):
+    with tempfile.TemporaryDirectory() as folder:
+        xml_file = os.path.join(folder, "synthetic.xml")
+        write_xml(xml_file, nspecies)
+        print("{} species, {:.1f} MB of XML".format(nspecies, os.path.getsize(xml_file)/2**20))
+        seconds, peak, model = measure(lambda: load(xml_file, False))
+        report("iterparse", seconds, peak)
+        assert len(model.species) == nspecies
+        if importlib.util.find_spec("xmltodict") is None:
+            print("xmltodict isn't installed, skipping keep_xml=True")
+            return
+        seconds, peak, model = measure(lambda: load(xml_file, True))
+        report("xmltodict (keep_xml=True)", seconds, peak)
+        assert len(model.species) == nspecies
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -29,6 +29,6 @@ setuptools.setup(
         classifiers=[
             "Programming Language :: Python :: 3",
             "Operating System :: OS :: OS Independent"],
-        python_requires=">=3.6",
+        python_requires=">=3.7",
         install_requires=meta.install_requires,
 )
@@ -0,0 +1,81 @@
+import pytest
+
+# a small model the native parser handles, no BNG2.pl needed
+MODEL_BNGL = """begin model
+begin parameters
+  kp1 0.5
+  km1 0.1
+  k2 kp1*0.4
+  L0 100
+  R0 2*L0
+end parameters
+begin molecule types
+  L(r)
+  R(l,s~U~P)
+end molecule types
+begin seed species
+  L(r) L0
+  R(l,s~U) R0
+end seed species
+begin observables
+  Molecules Lfree L(r)
+  Species RP R(s~P)
+end observables
+begin functions
+  f1() = kp1*Lfree/10
+end functions
+begin reaction rules
+  bind: L(r) + R(l) <-> L(r!1).R(l!1) kp1,km1
+  phos: R(l!+,s~U) -> R(l!+,s~P) f1()
+end reaction rules
+end model
+"""
+
+# network of the model above, as BNG2.pl writes it
+MODEL_NET = """# Created by BioNetGen 2.5.0
+begin parameters
+    1 kp1                 0.5  # Constant
+    2 km1                 0.1  # Constant
+    3 k2                  kp1*0.4  # ConstantExpression
+    4 L0                  100  # Constant
+    5 R0                  2*L0  # ConstantExpression
+end parameters
+begin species
+    1 L(r) L0
+    2 R(l,s~U) R0
+    3 L(r!1).R(l!1,s~U) 0
+    4 L(r!1).R(l!1,s~P) 0
+    5 R(l,s~P) 0
+end species
+begin functions
+    1 f1() kp1*Lfree/10
+end functions
+begin reactions
+    1 1,2 3 kp1 #bind
+    2 3 1,2 km1 #_reverse_bind
+    3 3 4 f1 #phos
+    4 4 1,5 km1 #_reverse_bind
+    5 1,5 4 kp1 #bind
+end reactions
+begin groups
+    1 Lfree                1
+    2 RP                   4,5
+end groups
+"""
+
+@pytest.fixture
+def model_file(tmp_path):
+    path = tmp_path / "test.bngl"
+    path.write_text(MODEL_BNGL)
+    return str(path)
+
+@pytest.fixture
+def net_file(tmp_path):
+    path = tmp_path / "test.net"
+    path.write_text(MODEL_NET)
+    return str(path)
+
+@pytest.fixture
+def model(model_file):
+    from BNGSim import BNGModel
+    return BNGModel(model_file, parser="bngl", xml_cache=False)
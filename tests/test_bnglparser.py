@@ -0,0 +1,49 @@
+import os
+import shutil
+
+import pytest
+
+from BNGSim import BNGModel
+from BNGSim.bnglparser import BNGLParser, parse_pattern_string
+from BNGSim.model import block_differences
+from BNGSim.utils import probe_bngexec
+from BNGSim.xmlparsers import SpeciesXML
+
+from .conftest import MODEL_BNGL
+
+def _bng_path():
+    # folder of a working BNG2.pl, from BNGPATH or the PATH
+    if "BNGPATH" in os.environ:
+        bngexec = os.path.join(os.environ["BNGPATH"], "BNG2.pl")
+    else:
+        bngexec = shutil.which("BNG2.pl")
+    if bngexec is None or not probe_bngexec(bngexec)[0]:
+        return None
+    return os.path.dirname(os.path.abspath(bngexec))
+
+def test_wildcards():
+    assert str(SpeciesXML(parse_pattern_string("A(x!+)"))) == "A(x!+)"
+    assert str(SpeciesXML(parse_pattern_string("A(x!?,y!1).B(z!1)"))) == "A(x!?,y!1).B(z!1)"
+
+def test_wildcard_with_bond():
+    # the numbered bond already says the site is bound
+    pattern = BNGLParser("").parse_pattern("A(x!+!1).B(y!1)", "P1")
+    comp = pattern["ListOfMolecules"]["Molecule"][0]["ListOfComponents"]["Component"]
+    assert comp["@numberOfBonds"] == "1"
+    assert str(SpeciesXML(pattern)) == "A(x!1).B(y!1)"
+    assert str(SpeciesXML(parse_pattern_string("A(x!1!?).B(y!1)"))) == "A(x!1).B(y!1)"
+
+def test_derived_parameter_values(model):
+    # the native parser evaluates derived parameters like BNG2.pl
+    assert model.parameters.values["R0"] == 200
+    assert model.parameters.expressions["R0"] == "2*L0"
+
+@pytest.mark.skipif(_bng_path() is None, reason="BNG2.pl is not available")
+def test_native_matches_xml(tmp_path):
+    # the native parser gives the same model as BNG2.pl's XML
+    path = tmp_path / "test.bngl"
+    path.write_text(MODEL_BNGL)
+    xml_model = BNGModel(str(path), BNGPATH=_bng_path(), parser="xml", xml_cache=False)
+    native_model = BNGModel(str(path), BNGPATH=_bng_path(), parser="bngl", xml_cache=False)
+    assert block_differences(xml_model, native_model) == []
+    assert str(xml_model) == str(native_model)
@@ -0,0 +1,133 @@
+import random
+import time
+
+import pytest
+
+from BNGSim.bnglparser import parse_pattern_string
+from BNGSim.xmlparsers import SpeciesXML
+
+def species(text):
+    return SpeciesXML(parse_pattern_string(text))
+
+def star(k, leaves=None):
+    # a hub with k identical sites, each bound to a leaf
+    if leaves is None:
+        leaves = list(range(k))
+    hub = "H({})".format(",".join("s!{}".format(i+1) for i in range(k)))
+    return ".".join([hub] + ["L(h!{})".format(i+1) for i in leaves])
+
+def test_reordering_and_renumbering():
+    a = species("A(x!1).B(y!1,z!2).C(w!2)")
+    b = species("C(w!5).A(x!3).B(z!5,y!3)")
+    assert a.canonical == b.canonical
+    assert a == b
+    assert hash(a) == hash(b)
+
+def test_states_and_free_sites():
+    a = species("R(l!1,s~P).L(r!1,r)")
+    b = species("L(r,r!7).R(s~P,l!7)")
+    c = species("R(l!1,s~U).L(r!1,r)")
+    assert a == b
+    assert a != c
+
+def test_non_isomorphic():
+    # two 3-rings against a 4-ring and a 2-ring, same
+    # molecules, same bond count, same degrees
+    two_triangles = species("A(a!1,b!2).A(a!2,b!3).A(a!3,b!1)"
+                            ".A(a!4,b!5).A(a!5,b!6).A(a!6,b!4)")
+    square_and_pair = species("A(a!1,b!2).A(a!2,b!3).A(a!3,b!4).A(a!4,b!1)"
+                              ".A(a!5,b!6).A(a!6,b!5)")
+    assert two_triangles.canonical != square_and_pair.canonical
+    assert two_triangles != square_and_pair
+
+def test_ring_rotation():
+    a = species("A(a!1,b!2).A(a!2,b!3).A(a!3,b!4).A(a!4,b!1)")
+    b = species("A(a!3,b!4).A(a!4,b!1).A(a!1,b!2).A(a!2,b!3)")
+    assert a == b
+
+@pytest.mark.parametrize("k", [9, 12])
+def test_symmetric_star(k):
+    # k! equivalent orderings of the leaves, automorphism
+    # pruning has to keep this fast
+    start = time.perf_counter()
+    a = species(star(k))
+    b = species(star(k, leaves=list(reversed(range(k)))))
+    assert a.canonical == b.canonical
+    assert time.perf_counter() - start < 2
+
+def test_component_order():
+    # identical components listed in a different order
+    a = species("A(x!1,x!2).A(x!1,x!2)")
+    b = species("A(x!1,x!2).A(x!2,x!1)")
+    assert a.canonical == b.canonical
+    assert a == b
+    c = species("A(x!1,y~P!2).B(z!1,z!2)")
+    d = species("B(z!2,z!1).A(y~P!1,x!2)")
+    assert c == d
+    assert species("A(x,x!1).B(z!1)") == species("A(x!1,x).B(z!1)")
+
+def _write(mols, bonds, rng=None):
+    # mols are (name, components), bonds pairs of
+    # (molecule, component) ends
+    numbers = list(range(1, len(bonds)+1))
+    order = list(range(len(mols)))
+    if rng is not None:
+        rng.shuffle(numbers)
+        rng.shuffle(order)
+    parts = []
+    for imol in order:
+        name, comps = mols[imol]
+        comp_strs = []
+        for icomp, comp in enumerate(comps):
+            for ibond, ends in enumerate(bonds):
+                if (imol, icomp) in ends:
+                    comp += "!{}".format(numbers[ibond])
+            comp_strs.append(comp)
+        if rng is not None:
+            rng.shuffle(comp_strs)
+        parts.append("{}({})".format(name, ",".join(comp_strs)))
+    return ".".join(parts)
+
+def test_random_permutations():
+    # every complex written with shuffled molecules, shuffled
+    # components and renumbered bonds has the same canonical form
+    rng = random.Random(7)
+    types = [("A", ["x", "x", "y~P"]), ("B", ["z", "z"]), ("C", ["x", "w~0"])]
+    for _ in range(300):
+        mols = [rng.choice(types) for _ in range(rng.randint(2, 5))]
+        free = [(imol, icomp) for imol, (_, comps) in enumerate(mols) for icomp in range(len(comps))]
+        bonds = []
+        # a chain keeps the complex connected
+        for imol in range(1, len(mols)):
+            ends = (rng.choice([s for s in free if s[0] == imol-1]),
+                    rng.choice([s for s in free if s[0] == imol]))
+            free.remove(ends[0])
+            free.remove(ends[1])
+            bonds.append(ends)
+        if len(free) >= 2:
+            ends = tuple(rng.sample(free, 2))
+            bonds.append(ends)
+        text = _write(mols, bonds)
+        assert species(text).canonical == species(_write(mols, bonds, rng)).canonical, text
+
+def test_species_block_is_lazy(model):
+    keys = list(model.species)
+    # nothing is canonicalized to load or look up by string
+    assert model.species["L(r)"] == "L0"
+    assert all([key._canon_cache is None for key in keys])
+    # strings written differently still find the species
+    model.species.add_item((species("L(r!1).R(l!1,s~U)"), "5"))
+    assert model.species["R(s~U,l!3).L(r!3)"] == "5"
+    assert species("R(s~U,l!3).L(r!3)") in model.species
+    assert len(model.species) == 3
+    assert keys[0]._canon_cache is None
+
+def test_isomers_share_a_hash():
+    chain = species("A(a!1).B(b!1,b!2).A(a!2)")
+    other = species("A(a!1).B(b!1,b!2).C(c!2)")
+    # same molecules and bonded sites, different connectivity
+    isomer = species("A(a!1).C(c!1).B(b!2,b!2)")
+    assert hash(chain) == hash(species("A(a!2).A(a!1).B(b!2,b!1)"))
+    assert hash(chain) != hash(other)
+    assert hash(other) == hash(isomer)
+    assert other != isomer
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from BNGSim.expressions import ExpressionGraph, ExpressionError, compile_expression
+
+def graph(**exprs):
+    g = ExpressionGraph()
+    for name, expr in exprs.items():
+        g.set_expression(name, expr)
+    return g
+
+def test_evaluate():
+    g = graph(a="2", b="a*3", c="b+a^2")
+    assert g.evaluate("b") == 6
+    assert g.evaluate() == {"a": 2, "b": 6, "c": 10}
+
+def test_incremental():
+    g = graph(a="2", x="5", b="a*3", c="b+1", y="x*2")
+    g.evaluate()
+    assert g.downstream("a") == {"b", "c"}
+    g.set_value("a", 4)
+    # only what depends on a is dirty
+    assert g._dirty == {"b", "c"}
+    assert g.evaluate("c") == 13
+    assert g.evaluate("y") == 10
+    g.set_expression("b", "a*10")
+    assert g.evaluate("c") == 41
+
+def test_override_expression():
+    g = graph(a="2", b="a*3", c="b+1")
+    g.set_value("b", 1)
+    assert g.evaluate("c") == 2
+    g.set_value("a", 5)
+    assert g.evaluate("c") == 2
+
+def test_outside_values():
+    g = graph(k="2", f="k*Obs")
+    assert g.evaluate("f", values={"Obs": 3}) == 6
+    assert g.evaluate("f", values={"Obs": 4}) == 8
+
+def test_batch():
+    g = graph(a="2", x="5", b="a*3", c="b+x")
+    out = g.evaluate_batch({"a": np.array([1.0, 2.0, 3.0])})
+    assert np.allclose(out["b"], [3, 6, 9])
+    assert np.allclose(out["c"], [8, 11, 14])
+    assert np.allclose(out["x"], 5)
+    # the graph itself is left unchanged
+    assert g.evaluate("c") == 11
+
+def test_operators():
+    scope = {"a": 2.0, "b": 3.0}
+    def value(expr):
+        return compile_expression(expr)[0](scope)
+    assert value("a^b") == 8
+    assert value("-a^2") == -4
+    assert value("a>=2") == 1
+    assert value("a==b") == 0
+    assert value("a!=b") == 1
+    assert value("if(a<b, 10, 20)") == 10
+    assert value("(a>1) && (b<1)") == 0
+    assert value("(a>1) || (b<1)") == 1
+    assert value("max(a, b, 1)") == 3
+    assert compile_expression("a*b+c")[1] is not None
+
+def test_cycle():
+    g = graph(a="b+1", b="a*2")
+    with pytest.raises(ExpressionError):
+        g.evaluate()
+
+def test_missing_value():
+    g = graph(f="k*2")
+    with pytest.raises(ExpressionError):
+        g.evaluate("f")
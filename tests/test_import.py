@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that only the simulation/analysis side needs
+HEAVY = ["numpy", "h5py", "xmltodict", "multiprocessing", "asyncio"]
+
+def _import_times():
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import BNGSim"],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+def test_import_is_light():
+    times = _import_times()
+    assert "BNGSim" in times
+    assert [name for name in HEAVY if name in times] == []
+
+def test_import_time():
+    times = _import_times()
+    # microseconds, generous for slow machines
+    assert times["BNGSim"] < 500000
+
+def test_lazy_attributes():
+    import BNGSim
+    from BNGSim.expressions import ExpressionGraph
+    assert BNGSim.ExpressionGraph is ExpressionGraph
+    assert "NetworkODE" in dir(BNGSim)
@@ -0,0 +1,68 @@
+import numpy as np
+
+from BNGSim.bnglparser import parse_pattern_string
+from BNGSim.xmlparsers import SpeciesXML
+from BNGSim.matching import count_embeddings, read_net_species, read_net_parameters, ObservableMatrix
+
+def pattern(text):
+    return SpeciesXML(parse_pattern_string(text))
+
+def test_read_net(net_file):
+    species = read_net_species(net_file)
+    assert [str(s) for s in species][:2] == ["L(r)", "R(l,s~U)"]
+    assert len(species) == 5
+    seeds = read_net_species(net_file, concentrations=True, limit=2)
+    assert [c for _, c in seeds] == ["L0", "R0"]
+    params = read_net_parameters(net_file)
+    assert params["R0"] == "2*L0"
+
+def test_count_embeddings(net_file):
+    species = read_net_species(net_file)
+    assert count_embeddings(pattern("L(r)"), species[0]) == 1
+    # a listed site without a bond is unbound
+    assert count_embeddings(pattern("L(r)"), species[2]) == 0
+    assert count_embeddings(pattern("L(r!?)"), species[2]) == 1
+    assert count_embeddings(pattern("L()"), species[2]) == 1
+    assert count_embeddings(pattern("L(r!+)"), species[0]) == 0
+    assert count_embeddings(pattern("L(r!1).R(l!1)"), species[3]) == 1
+    assert count_embeddings(pattern("R(s~P)"), species[2]) == 0
+    assert count_embeddings(pattern("R(s~P)"), species[4]) == 1
+
+def test_count_embeddings_symmetric():
+    dimer = pattern("A(a!1).A(a!1)")
+    assert count_embeddings(pattern("A()"), dimer) == 2
+    assert count_embeddings(pattern("A(a!1).A(a!1)"), dimer) == 2
+    assert count_embeddings(pattern("A()"), dimer, first_only=True) == 1
+
+def test_observable_matrix(net_file):
+    observables = [("Molecules", "Lall", [pattern("L()")]),
+                   ("Molecules", "Lfree", [pattern("L(r)")]),
+                   ("Species", "Rbound", [pattern("R(l!+)")]),
+                   ("Molecules", "Rtot", [pattern("R(s~U)"), pattern("R(s~P)")])]
+    matrix = ObservableMatrix.from_net(observables, net_file)
+    assert matrix.names == ["Lall", "Lfree", "Rbound", "Rtot"]
+    expected = np.array([[1, 1, 0, 0],
+                         [0, 0, 0, 1],
+                         [1, 0, 1, 1],
+                         [1, 0, 1, 1],
+                         [0, 0, 0, 1]])
+    assert np.array_equal(matrix.weights, expected)
+    cdat = np.array([[0.0, 1, 2, 3, 4, 5],
+                     [1.0, 5, 4, 3, 2, 1]])
+    gdat = matrix.apply(cdat)
+    assert list(gdat.dtype.names) == ["time", "Lall", "Lfree", "Rbound", "Rtot"]
+    assert np.allclose(gdat["time"], [0, 1])
+    assert np.allclose(gdat["Lall"], [1+3+4, 5+3+2])
+    assert np.allclose(gdat["Rtot"], [2+3+4+5, 4+3+2+1])
+
+def test_observable_matrix_species_counts_once():
+    species = [pattern("A(a!1).A(a!1)")]
+    observables = [("Molecules", "Amol", [pattern("A()")]),
+                   ("Species", "Aspec", [pattern("A()")])]
+    matrix = ObservableMatrix(observables, species)
+    assert np.array_equal(matrix.weights, [[2, 1]])
+
+def test_model_observables(model, net_file):
+    matrix = ObservableMatrix.from_net(model.observables, net_file)
+    assert matrix.names == ["Lfree", "RP"]
+    assert np.array_equal(matrix.weights[:, 1], [0, 0, 0, 1, 1])
@@ -0,0 +1,146 @@
+import pytest
+
+from BNGSim import BNGModel
+from BNGSim.bnglparser import BNGLParseError
+
+def lines(block):
+    return [line.strip() for line in str(block).splitlines() if line.strip() != ""]
+
+def test_parse(model):
+    assert model.active_blocks[:2] == ["parameters", "moltypes"]
+    assert list(model.rules._item_dict.keys()) == ["bind", "phos"]
+    assert list(model.observables._item_dict.keys()) == ["Lfree", "RP"]
+
+def test_rule_edits(model):
+    str(model.rules)
+    rule = model.rules["bind"]
+    rule.rate_constants = ["kp1*2", "km1"]
+    assert "bind: L(r) + R(l) <-> L(r!1).R(l!1) kp1*2,km1" in lines(model.rules)
+    rule.name = "binding"
+    assert lines(model.rules)[1].startswith("binding:")
+
+def test_edits_invalidate_owner_only(model):
+    species = str(model.species)
+    str(model.rules)
+    model.rules["bind"].rate_constants = ["kp1*2", "km1"]
+    # only the rules block re-renders
+    assert model.species._rendered is species
+    assert model.rules._rendered is None
+    str(model.rules)
+    # a change deep inside a species pattern reaches its block
+    spec = model.species[1]
+    spec.molecules[0].components[1].state = "P"
+    assert model.species._rendered is None
+    assert "R(l,s~P) R0" in lines(model.species)
+    assert model.species["R(l,s~P)"] == "R0"
+    assert model.rules._rendered is not None
+    # and patterns of observables reach theirs
+    str(model.observables)
+    model.observables["RP"][1][0].molecules[0].name = "Q"
+    assert "Species RP Q(s~P)" in lines(model.observables)
+
+def test_write_model(model, tmp_path):
+    model.parameters.kp1 = 3
+    out = tmp_path / "out.bngl"
+    model.write_model(str(out))
+    text = out.read_text()
+    assert "kp1 3" in text
+    again = BNGModel(str(out), parser="bngl", xml_cache=False)
+    assert again.parameters.evaluate("k2") == pytest.approx(1.2)
+
+def test_network_edits(model, net_file):
+    assert model.network_edits(net_file) == []
+    model.parameters.L0 = 50
+    edits = model.network_edits(net_file)
+    params = [args for action, args in edits if action == "setParameter"]
+    assert [(name, float(value)) for name, value in params] == [("L0", 50)]
+    # R0 = 2*L0 sets the concentration of R through a derived parameter
+    assert ("setConcentration", ["R(l,s~U)", "R0"]) in edits
+    assert ("setConcentration", ["L(r)", "L0"]) in edits
+
+def test_bad_derived_parameter(tmp_path):
+    path = tmp_path / "bad.bngl"
+    path.write_text("begin model\nbegin parameters\n  a b*2\n  b a+1\nend parameters\nend model\n")
+    with pytest.raises(BNGLParseError):
+        BNGModel(str(path), parser="bngl", xml_cache=False)
+
+# BNG2.pl --xml output for a trimmed down version of the test
+# model, the empty list has to be skipped and the two
+# unidirectional rules merged
+MODEL_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<sbml xmlns="http://www.sbml.org/sbml/level3" level="3" version="1">
+  <model id="test">
+    <ListOfParameters>
+      <Parameter id="kp1" type="Constant" value="0.5"/>
+      <Parameter id="km1" type="Constant" value="0.1"/>
+    </ListOfParameters>
+    <ListOfCompartments>
+    </ListOfCompartments>
+    <ListOfMoleculeTypes>
+      <MoleculeType id="L"><ListOfComponentTypes><ComponentType id="r"/></ListOfComponentTypes></MoleculeType>
+      <MoleculeType id="R"><ListOfComponentTypes><ComponentType id="l"/></ListOfComponentTypes></MoleculeType>
+    </ListOfMoleculeTypes>
+    <ListOfSpecies>
+      <Species id="S1" concentration="100" name="L(r)">
+        <ListOfMolecules>
+          <Molecule id="S1_M1" name="L"><ListOfComponents><Component id="S1_M1_C1" name="r" numberOfBonds="0"/></ListOfComponents></Molecule>
+        </ListOfMolecules>
+      </Species>
+      <Species id="S2" concentration="0" name="L(r!1).R(l!1)">
+        <ListOfMolecules>
+          <Molecule id="S2_M1" name="L"><ListOfComponents><Component id="S2_M1_C1" name="r" numberOfBonds="1"/></ListOfComponents></Molecule>
+          <Molecule id="S2_M2" name="R"><ListOfComponents><Component id="S2_M2_C1" name="l" numberOfBonds="1"/></ListOfComponents></Molecule>
+        </ListOfMolecules>
+        <ListOfBonds><Bond id="S2_B1" site1="S2_M1_C1" site2="S2_M2_C1"/></ListOfBonds>
+      </Species>
+    </ListOfSpecies>
+    <ListOfReactionRules>
+      <ReactionRule id="RR1" name="bind" symmetry_factor="1">
+        <ListOfReactantPatterns>
+          <ReactantPattern id="RR1_RP1"><ListOfMolecules><Molecule id="RR1_RP1_M1" name="L"><ListOfComponents><Component id="RR1_RP1_M1_C1" name="r" numberOfBonds="0"/></ListOfComponents></Molecule></ListOfMolecules></ReactantPattern>
+          <ReactantPattern id="RR1_RP2"><ListOfMolecules><Molecule id="RR1_RP2_M1" name="R"><ListOfComponents><Component id="RR1_RP2_M1_C1" name="l" numberOfBonds="0"/></ListOfComponents></Molecule></ListOfMolecules></ReactantPattern>
+        </ListOfReactantPatterns>
+        <ListOfProductPatterns>
+          <ProductPattern id="RR1_PP1">
+            <ListOfMolecules>
+              <Molecule id="RR1_PP1_M1" name="L"><ListOfComponents><Component id="RR1_PP1_M1_C1" name="r" numberOfBonds="1"/></ListOfComponents></Molecule>
+              <Molecule id="RR1_PP1_M2" name="R"><ListOfComponents><Component id="RR1_PP1_M2_C1" name="l" numberOfBonds="1"/></ListOfComponents></Molecule>
+            </ListOfMolecules>
+            <ListOfBonds><Bond id="RR1_PP1_B1" site1="RR1_PP1_M1_C1" site2="RR1_PP1_M2_C1"/></ListOfBonds>
+          </ProductPattern>
+        </ListOfProductPatterns>
+        <RateLaw id="RR1_RateLaw" type="Ele" totalrate="0"><ListOfRateConstants><RateConstant value="kp1"/></ListOfRateConstants></RateLaw>
+      </ReactionRule>
+      <ReactionRule id="RR2" name="_reverse_bind" symmetry_factor="1">
+        <ListOfReactantPatterns>
+          <ReactantPattern id="RR2_RP1">
+            <ListOfMolecules>
+              <Molecule id="RR2_RP1_M1" name="L"><ListOfComponents><Component id="RR2_RP1_M1_C1" name="r" numberOfBonds="1"/></ListOfComponents></Molecule>
+              <Molecule id="RR2_RP1_M2" name="R"><ListOfComponents><Component id="RR2_RP1_M2_C1" name="l" numberOfBonds="1"/></ListOfComponents></Molecule>
+            </ListOfMolecules>
+            <ListOfBonds><Bond id="RR2_RP1_B1" site1="RR2_RP1_M1_C1" site2="RR2_RP1_M2_C1"/></ListOfBonds>
+          </ReactantPattern>
+        </ListOfReactantPatterns>
+        <ListOfProductPatterns>
+          <ProductPattern id="RR2_PP1"><ListOfMolecules><Molecule id="RR2_PP1_M1" name="L"><ListOfComponents><Component id="RR2_PP1_M1_C1" name="r" numberOfBonds="0"/></ListOfComponents></Molecule></ListOfMolecules></ProductPattern>
+          <ProductPattern id="RR2_PP2"><ListOfMolecules><Molecule id="RR2_PP2_M1" name="R"><ListOfComponents><Component id="RR2_PP2_M1_C1" name="l" numberOfBonds="0"/></ListOfComponents></Molecule></ListOfMolecules></ProductPattern>
+        </ListOfProductPatterns>
+        <RateLaw id="RR2_RateLaw" type="Ele" totalrate="0"><ListOfRateConstants><RateConstant value="km1"/></ListOfRateConstants></RateLaw>
+      </ReactionRule>
+    </ListOfReactionRules>
+  </model>
+</sbml>
+"""
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_parse_xml(tmp_path, lazy):
+    path = tmp_path / "test.xml"
+    path.write_text(MODEL_XML)
+    model = BNGModel(str(path), xml_cache=False, lazy=lazy)
+    assert model.model_name == "test"
+    assert model.active_blocks == ["parameters", "moltypes", "species", "rules"]
+    assert [str(sp) for sp in model.species] == ["L(r)", "L(r!1).R(l!1)"]
+    assert lines(model.rules)[1] == "bind: L(r) + R(l) <-> L(r!1).R(l!1) kp1,km1"
+    # same model as the old xmltodict route
+    pytest.importorskip("xmltodict")
+    assert str(model) == str(BNGModel(str(path), xml_cache=False, keep_xml=True))
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from BNGSim.ode import NetworkODE
+
+DECAY_NET = """begin parameters
+    1 k    0.5
+    2 A0   10
+end parameters
+begin species
+    1 A()  A0
+    2 B()  0
+end species
+begin reactions
+    1 1 2 k #decay
+end reactions
+begin groups
+    1 Atot  1
+    2 Btot  2
+end groups
+"""
+
+DIMER_NET = """begin parameters
+    1 k    0.2
+    2 A0   3
+end parameters
+begin species
+    1 A()  A0
+    2 B()  A0
+    3 C()  0
+end species
+begin reactions
+    1 1,2 3 k #bind
+end reactions
+begin groups
+    1 Atot  1
+    2 Ctot  3
+end groups
+"""
+
+SWITCH_NET = """begin parameters
+    1 k    1
+    2 on   1
+end parameters
+begin species
+    1 A()  1
+    2 B()  0
+end species
+begin functions
+    1 f() = if(on>=1, k, 0)*(on==1)
+end functions
+begin reactions
+    1 1 2 f #switch
+end reactions
+begin groups
+    1 Atot  1
+end groups
+"""
+
+def test_first_order_decay():
+    ode = NetworkODE(DECAY_NET)
+    assert ode.names == ["time", "Atot", "Btot"]
+    ks = np.array([0.1, 0.5, 2.0])
+    gdat = ode.simulate(5, 10, params={"k": ks})
+    assert gdat.shape == (3, 11, 3)
+    t = gdat[0, :, 0]
+    assert np.allclose(t, np.linspace(0, 5, 11))
+    expected = 10*np.exp(-ks[:,None]*t[None,:])
+    assert np.allclose(gdat[:, :, 1], expected, rtol=1e-5, atol=1e-7)
+    # mass is conserved
+    assert np.allclose(gdat[:, :, 1] + gdat[:, :, 2], 10)
+
+def test_second_order():
+    ode = NetworkODE(DIMER_NET)
+    gdat = ode.simulate(10, 20)
+    assert gdat.shape == (1, 21, 3)
+    t = gdat[0, :, 0]
+    expected = 3/(1 + 0.2*3*t)
+    assert np.allclose(gdat[0, :, 1], expected, rtol=1e-5, atol=1e-7)
+
+def test_parameter_array():
+    ode = NetworkODE(DECAY_NET)
+    assert ode.free_names == ["k", "A0"]
+    gdat = ode.simulate(1, 1, params=np.array([[1.0, 1.0], [1.0, 2.0]]))
+    assert np.allclose(gdat[:, -1, 1], [np.exp(-1), 2*np.exp(-1)], rtol=1e-5)
+    with pytest.raises(ValueError):
+        ode.simulate(1, 1, params=np.ones((2, 3)))
+
+def test_concentrations():
+    ode = NetworkODE(DIMER_NET)
+    cdat = ode.simulate(1, 4, concentrations=True)
+    assert cdat.shape == (1, 5, 4)
+    assert np.allclose(cdat[0, :, 1], cdat[0, :, 2])
+
+def test_functions_with_comparisons():
+    ode = NetworkODE(SWITCH_NET)
+    gdat = ode.simulate(1, 2, params={"on": np.array([1.0, 0.0])})
+    assert np.allclose(gdat[0, :, 1], np.exp(-np.array([0, 0.5, 1])), rtol=1e-5)
+    assert np.allclose(gdat[1, :, 1], 1)
+
+def test_model_network(net_file):
+    ode = NetworkODE(net_file)
+    assert ode.names == ["time", "Lfree", "RP"]
+    gdat = ode.simulate(1, 5, params={"L0": np.array([0.0, 100.0])})
+    # no ligand, nothing binds or gets phosphorylated
+    assert np.allclose(gdat[0, :, 1:], 0)
+    assert gdat[1, -1, 1] < 100
+    assert np.all(gdat[1, 1:, 2] > 0)
@@ -0,0 +1,63 @@
+import numpy as np
+
+def lines(block):
+    return [line.strip() for line in str(block).splitlines() if line.strip() != ""]
+
+def test_values(model):
+    params = model.parameters
+    # derived parameters hold their evaluated value
+    assert params.values["k2"] == 0.2
+    assert params.values["R0"] == 200
+    assert params.evaluate("R0") == 200
+    assert params.free_names == ["kp1", "km1", "L0"]
+    assert np.allclose(params.get_vector(), [0.5, 0.1, 100])
+
+def test_setattr(model):
+    params = model.parameters
+    str(params)
+    params.kp1 = 2
+    assert "kp1 2.0" in lines(params)
+    assert params.values["kp1"] == 2
+    assert params.evaluate("k2") == 0.8
+
+def test_setitem(model):
+    params = model.parameters
+    str(params)
+    params["L0"] = 10
+    assert "L0 10.0" in lines(params)
+    assert params.evaluate("R0") == 20
+    params["knew"] = 3
+    assert "knew 3.0" in lines(params)
+    assert "knew" in params.free_names
+
+def test_set_vector(model):
+    params = model.parameters
+    str(params)
+    params.set_vector([1, 0.1, 5])
+    rendered = lines(params)
+    assert "kp1 1.0" in rendered
+    assert "km1 0.1" in rendered
+    assert "L0 5.0" in rendered
+    assert params.evaluate("R0") == 10
+    assert np.allclose(params.get_vector(), [1, 0.1, 5])
+    assert params.values["kp1"] == 1
+    assert params.values["L0"] == 5
+    assert params.kp1 == 1
+
+def test_free_and_derived(model):
+    params = model.parameters
+    assert "k2" not in params.free_names
+    # derived becomes free
+    params.k2 = 0.3
+    assert "k2" in params.free_names
+    assert "k2 0.3" in lines(params)
+    # free becomes derived
+    params.km1 = "kp1/5"
+    assert "km1" not in params.free_names
+    assert "km1 kp1/5" in lines(params)
+    assert params.evaluate("km1") == 0.1
+    assert len(params.get_vector()) == len(params.free_names)
+
+def test_evaluate_batch(model):
+    out = model.parameters.evaluate_batch({"L0": np.array([1.0, 2.0])})
+    assert np.allclose(out["R0"], [2, 4])
@@ -0,0 +1,14 @@
+from BNGSim import BNGSimulator
+
+def test_job_names_and_seeds(model, tmp_path):
+    model.add_action("simulate", [("method", "ssa"), ("t_end", 10), ("n_steps", 10)])
+    sim = BNGSimulator(model, nsims=2, seed=10, net_cache=False, path=str(tmp_path))
+    first = sim._setup_jobs()
+    # a second run, e.g. after a failed replicate, continues 
+    # the numbering instead of reusing names and seeds
+    second = sim._setup_jobs()
+    jobs = first + second
+    assert [job.name for job in jobs] == ["simulation_{:08d}".format(i) for i in range(4)]
+    assert [job.seed for job in jobs] == [10, 11, 12, 13]
+    assert len(set([job.path for job in jobs])) == 4
+    assert "seed=>13" in second[1].actions_text
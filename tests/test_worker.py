@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from BNGSim.worker import BNGJob, BNGWorker
+
+def worker(method, seed=None, **args):
+    run_args = {"method": method, "t_start": 0, "t_end": 10, "n_steps": 5}
+    run_args.update(args)
+    job = BNGJob("test", "BNG2.pl", "", net_file="test.net", path="sims",
+                 seed=seed, backend="run_network", run_network="run_network",
+                 run_args=run_args)
+    return BNGWorker(job=job)
+
+@pytest.mark.parametrize("method,flag", [("ode", "cvode"), ("cvode", "cvode"), ("ssa", "ssa"), ("pla", "pla")])
+def test_run_network_methods(method, flag):
+    cmd = worker(method)._command("sim", "test.bngl")
+    assert cmd[0] == "run_network"
+    assert cmd[cmd.index("-p")+1] == flag
+
+def test_run_network_command():
+    cmd = worker("ssa", seed=7, atol=1e-8)._command("sim", "test.bngl")
+    assert cmd[cmd.index("-o")+1] == os.path.join("sim", "test")
+    assert cmd[cmd.index("-h")+1] == "7"
+    assert cmd[cmd.index("-a")+1] == "1e-08"
+    assert "-r" not in cmd
+    # step size and number of steps come last
+    assert cmd[-3:] == [os.path.join("sim", "test.net"), "2.0", "5"]
+
+def test_bng2_command():
+    job = BNGJob("test", "BNG2.pl", "simulate({method=>\"ode\"})", model_text="", path="sims")
+    assert BNGWorker(job=job)._command("sim", "test.bngl") == ["perl", "BNG2.pl", "test.bngl"]